@@ -1,4 +1,5 @@
 from django.urls import path
+from gestion.geolocalisation import views as geolocalisation_views
 from . import views
 
 app_name = 'chauffeurs_mobile'
@@ -34,6 +35,7 @@ urlpatterns = [
     path('api/reservations/mes-reservations/', views.api_mes_reservations, name='mobile_api_mes_reservations'),
     path('api/reservations/annuler/<int:reservation_id>/', views.api_annuler_reservation, name='mobile_api_annuler_reservation'),
     path('api/agents/disponibles/demain/', views.api_agents_disponibles_demain, name='mobile_api_agents_disponibles_demain'),
+    path('api/agents/proches/', geolocalisation_views.api_agents_proches, name='mobile_api_agents_proches'),
     path('reservation/', views.mobile_reservation_view, name='mobile_reservation'),
     # NOUVELLES URLs SUPER-CHAFFEUR
     path('api/super/chauffeurs/', views.api_super_chauffeurs_list, name='mobile_api_super_chauffeurs'),
@@ -8,7 +8,7 @@ from django.shortcuts import render, redirect
 from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 
 try:
     # Essayer d'importer depuis votre structure d'app
@@ -908,17 +908,7 @@ def api_reserver_agent(request):
                 })
             
             # 4. Vérifier si l'agent est dans le planning pour demain
-            planning_agent = None
-            for planning_data in gestionnaire.planning.values():
-                if isinstance(planning_data, dict):
-                    for agent_data in planning_data.get('agents', []):
-                        if isinstance(agent_data, dict) and agent_data.get('nom') == agent.nom:
-                            planning_agent = agent_data
-                            break
-                    if planning_agent:
-                        break
-            
-            if not planning_agent:
+            if not gestionnaire.est_programme(agent.nom, jour_semaine):
                 print(f"❌ Agent {agent.nom} NON PROGRAMMÉ pour demain ({jour_semaine})")
                 return JsonResponse({
                     'success': False,
@@ -931,26 +921,9 @@ def api_reserver_agent(request):
             
             print(f"🔍 Vérification: Agent {agent.nom}, {jour_semaine}, {type_transport}, {heure_valeur}h")
             
-            # Simuler une recherche dans le planning
-            class FiltreFormPlanning:
-                def __init__(self, jour, type_transport, heure_valeur):
-                    self.cleaned_data = {
-                        'jour': jour,
-                        'type_transport': type_transport,
-                        'heure_ete': False,
-                        'filtre_agents': 'tous'
-                    }
-                    self.data = {'heure_specifique': str(heure_valeur)}
-            
-            form_filtre = FiltreFormPlanning(jour_semaine, type_transport, heure_valeur)
-            liste_transports = gestionnaire.traiter_donnees(form_filtre)
-            
-            # Vérifier si l'agent est dans la liste filtrée
-            agent_programme = False
-            for transport in liste_transports:
-                if transport.get('agent') == agent.nom:
-                    agent_programme = True
-                    break
+            # Lecture de l'index (jour, type, heure) du planning
+            liste_transports = gestionnaire.rechercher_transports(jour_semaine, type_transport, heure_valeur)
+            agent_programme = any(transport['agent'] == agent.nom for transport in liste_transports)
             
             if not agent_programme:
                 print(f"❌ Agent {agent.nom} non programmé pour {type_transport} à {heure_valeur}h")
@@ -1423,20 +1396,8 @@ def api_agents_disponibles_demain(request):
             # 5. Récupérer les agents PROGRAMMÉS pour ce jour et cette heure
             agents_programmes = []
             
-            # Utiliser la même logique que dans liste_transports
-            class FiltreFormPlanning:
-                def __init__(self, jour, type_transport, heure_valeur):
-                    self.cleaned_data = {
-                        'jour': jour,
-                        'type_transport': type_transport,
-                        'heure_ete': False,
-                        'filtre_agents': 'tous'
-                    }
-                    # Ajouter l'heure pour traiter_donnees
-                    self.data = {'heure_specifique': str(heure_valeur)}
-            
-            form_filtre = FiltreFormPlanning(jour_semaine, type_transport, heure_valeur)
-            liste_transports = gestionnaire.traiter_donnees(form_filtre)
+            # Lecture directe de l'index (jour, type, heure) du planning
+            liste_transports = gestionnaire.rechercher_transports(jour_semaine, type_transport, heure_valeur)
             
             print(f"📊 {len(liste_transports)} agent(s) programmé(s) pour {jour_semaine} {type_transport} {heure_valeur}h")
             
@@ -1445,11 +1406,16 @@ def api_agents_disponibles_demain(request):
             total_disponibles = 0
             total_reserves = 0
             
+            # Agents déjà résolus par le gestionnaire : une seule requête par id
+            agents_par_id = Agent.objects.select_related('societe').in_bulk(
+                [transport['agent_id'] for transport in liste_transports if transport['agent_id']]
+            )
+            
             for transport in liste_transports:
                 agent_nom = transport['agent']
                 
                 # Chercher l'agent dans la base de données
-                agent_obj = Agent.objects.filter(nom__icontains=agent_nom).first()
+                agent_obj = agents_par_id.get(transport['agent_id'])
                 
                 if agent_obj:
                     # Vérifier si l'agent est réservé
@@ -1680,14 +1646,31 @@ def api_courses_selection(request):
         courses = Course.objects.filter(
             chauffeur_id=chauffeur_id,
             date_reelle=selected_date
-        ).order_by('heure')
+        ).order_by('heure').prefetch_related(
+            Prefetch('affectation_set', queryset=Affectation.objects.select_related('agent'))
+        )
+        
+        # Horaires de passage (positions connues des agents, distances à vol d'oiseau : pas d'appel
+        # au service de routage dans une liste) ; enchaînement des courses du chauffeur
+        from gestion.geolocalisation.horaires import horaires_course, verifier_enchainement
+        horaires_courses = []
+        for course in courses:
+            try:
+                horaires_courses.append((course, horaires_course(
+                    course, affectations=course.affectation_set.all(), mode_distance='haversine'
+                )))
+            except Exception as e:
+                print(f"⚠️ Erreur horaires pour course {course.id}: {e}")
+        verifier_enchainement(horaires_courses)
+        horaires_par_course = {course.id: horaires for course, horaires in horaires_courses}
         
         courses_data = []
         for course in courses:
             agents_data = []
+            horaires = horaires_par_course.get(course.id)
             
             try:
-                affectations = course.affectation_set.select_related('agent').all()
+                affectations = list(course.affectation_set.all())
                 
                 for affectation in affectations[:3]:
                     if affectation.agent:
@@ -1696,9 +1679,9 @@ def api_courses_selection(request):
                             'adresse': affectation.agent.adresse or 'Non spécifié',
                         })
                 
-                if affectations.count() > 3:
+                if len(affectations) > 3:
                     agents_data.append({
-                        'nom': f'+ {affectations.count() - 3} autres',
+                        'nom': f'+ {len(affectations) - 3} autres',
                         'adresse': ''
                     })
                     
@@ -1713,12 +1696,20 @@ def api_courses_selection(request):
                 'type_display': 'Ramassage' if course.type_transport == 'ramassage' else 'Départ',
                 'heure': course.heure,
                 'heure_display': f"{course.heure}h",
-                'nb_agents': course.affectation_set.count(),
+                'nb_agents': len(course.affectation_set.all()),
                 'agents': agents_data,
                 'statut': course.statut,
                 'statut_display': course.get_statut_display() if hasattr(course, 'get_statut_display') else course.statut,
                 'prix': float(course.get_prix_course() or 0) if hasattr(course, 'get_prix_course') else 0,
                 'peut_valider': course.statut in ['en_attente', 'en_cours'],
+                'heure_depart_chauffeur': horaires['heure_depart_chauffeur'] if horaires else None,
+                'horaires_realisables': horaires['realisable'] if horaires else None,
+                'alertes_horaires': horaires['alertes'] if horaires else [],
+                'passages': [
+                    {'agent_id': agent['agent_id'], 'nom': agent['nom'], 'heure': arret['heure'],
+                     'ordre_passage': arret['ordre_passage']}
+                    for arret in horaires['arrets'] for agent in arret['agents']
+                ] if horaires else [],
             })
         
         return JsonResponse({
@@ -1977,14 +1968,23 @@ def api_agents_disponibles(request):
         print(f"📅 {len(reservations_filtrees)} réservation(s) pour aujourd'hui ({type_transport})")
         
         # 4. Récupérer TOUS les agents (exclure ceux avec voiture personnelle)
-        tous_agents = Agent.objects.filter(
-            voiture_personnelle=False
-        ).order_by('nom')
+        PlanningShift = apps.get_model('gestion', 'PlanningShift')
+        if PlanningShift.objects.filter(date_reelle=date_obj).exists():
+            # Planning enregistré en base : agents programmés à cette heure et
+            # sans course aujourd'hui, en une seule anti-jointure SQL
+            tous_agents = Agent.objects.filter(
+                id__in=PlanningShift.non_affectes(date_obj, type_transport, [heure_int]).values('agent_id')
+            ).select_related('societe').order_by('nom')
+        else:
+            tous_agents = Agent.objects.filter(
+                voiture_personnelle=False
+            ).exclude(
+                id__in=Affectation.objects.filter(date_reelle=date_obj).values('agent_id')
+            ).select_related('societe').order_by('nom')
         
         # 5. Séparer les agents en trois catégories
         agents_reserves = []      # Réservés pour aujourd'hui
         agents_disponibles = []   # Pas dans une course
-        agents_dans_course = []   # Déjà dans une course (ceux-ci doivent être exclus)
         
         # Dictionnaire pour les réservations par agent
         reservations_par_agent = {}
@@ -2006,12 +2006,7 @@ def api_agents_disponibles(request):
                 'est_complet': agent.est_complet() if hasattr(agent, 'est_complet') else True,
             }
             
-            # Vérifier si l'agent est déjà dans une course
-            if agent.id in agents_deja_dans_course:
-                # Agent déjà dans une course → EXCLURE DE LA LISTE
-                agents_dans_course.append(agent_data)
-                continue
-            
+            # Les agents déjà dans une course sont exclus par la requête (anti-jointure)
             # Vérifier si l'agent a une réservation pour aujourd'hui
             if agent.id in reservations_par_agent:
                 # Agent réservé → ajouter aux réservés
@@ -2023,6 +2018,7 @@ def api_agents_disponibles(request):
                 agent_data['est_disponible'] = True
                 agents_disponibles.append(agent_data)
         
+        agents_dans_course = list(agents_deja_dans_course)
         print(f"📊 {len(agents_reserves)} réservé(s), {len(agents_disponibles)} disponible(s), {len(agents_dans_course)} déjà dans une course (exclus)")
         
         # 6. Organiser l'ordre d'affichage
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.http import HttpResponse
 import pandas as pd
 from io import BytesIO
-from .models import Societe, Chauffeur, Agent, Affectation, HeureTransport, Course, Reservation
+from .models import Societe, Chauffeur, Agent, Affectation, HeureTransport, Course, Reservation, PlanningShift, PlanningImport
+from .geolocalisation.file_geocodage import planifier_geocodage
 @admin.register(Societe)
 class SocieteAdmin(admin.ModelAdmin):
     list_display = ['nom', 'matricule_fiscale', 'telephone', 'email', 'get_agents_count', 'created_at']
@@ -39,7 +40,7 @@ class ChauffeurAdmin(admin.ModelAdmin):
             'description': "Pour l'interface mobile des chauffeurs"
         }),
         ('Véhicule', {
-            'fields': ('numero_identite', 'numero_voiture', 'societe')
+            'fields': ('numero_identite', 'numero_voiture', 'nombre_places', 'societe')
         }),
         ('Tarif', {
             'fields': ('prix_course_par_defaut',)
@@ -64,6 +65,20 @@ class HeureTransportAdmin(admin.ModelAdmin):
     list_editable = ['active', 'ordre']
     ordering = ['type_transport', 'ordre']
 
+@admin.register(PlanningShift)
+class PlanningShiftAdmin(admin.ModelAdmin):
+    list_display = ['agent', 'jour', 'date_reelle', 'heure_debut', 'heure_fin', 'source_upload']
+    list_filter = ['jour', 'date_reelle']
+    search_fields = ['agent__nom']
+    raw_id_fields = ['agent']
+
+@admin.register(PlanningImport)
+class PlanningImportAdmin(admin.ModelAdmin):
+    list_display = ['nom_fichier', 'statut', 'etape', 'lignes_lues', 'agents_resolus', 'utilisateur', 'created_at', 'termine_at']
+    list_filter = ['statut']
+    search_fields = ['nom_fichier', 'planning_id']
+    readonly_fields = ['created_at', 'updated_at', 'termine_at']
+
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
     list_display = ['chauffeur', 'type_transport', 'heure', 'jour', 'date_reelle', 'prix_total', 'statut', 'get_nb_agents', 'demande_validation_at', 'validee_at']
@@ -155,8 +170,9 @@ class ReservationAdmin(admin.ModelAdmin):
 class AgentAdmin(admin.ModelAdmin):
     list_display = ['nom', 'get_societe_display', 'telephone', 'voiture_personnelle', 'est_complet', 'created_at']
     list_filter = ['societe', 'voiture_personnelle', 'created_at']
-    search_fields = ['nom', 'adresse', 'telephone']
+    search_fields = ['nom', 'adresse', 'adresse_normalisee', 'telephone']
     list_editable = ['voiture_personnelle']
+    readonly_fields = ['adresse_normalisee', 'geohash']
     
     def get_societe_display(self, obj):
         return obj.get_societe_display()
@@ -212,6 +228,7 @@ class AgentAdmin(admin.ModelAdmin):
                     df = pd.read_excel(fichier)
                     agents_crees = 0
                     agents_modifies = 0
+                    a_geocoder = []
                     
                     for index, row in df.iterrows():
                         nom = row.get('voyant', '')
@@ -228,14 +245,19 @@ class AgentAdmin(admin.ModelAdmin):
                             
                             if created:
                                 agents_crees += 1
+                                a_geocoder.append(agent)
                             else:
+                                ancienne_adresse = agent.adresse
                                 agent.adresse = row.get('adresse', agent.adresse)
                                 agent.telephone = str(row.get('Mobile', agent.telephone))
                                 agent.societe_texte = row.get('societe', agent.societe_texte)
                                 agent.voiture_personnelle = row.get('voiture', '').lower() in ['oui', 'yes', 'true', '1']
                                 agent.save()
                                 agents_modifies += 1
+                                if agent.adresse != ancienne_adresse or agent.latitude is None:
+                                    a_geocoder.append(agent)
                     
+                    planifier_geocodage(a_geocoder)
                     self.message_user(request, f"{agents_crees} agents créés, {agents_modifies} agents modifiés avec succès!")
                     return
                     
@@ -0,0 +1,196 @@
+# Banc d'essai du pipeline planning
+# Génère des fichiers EMS.xlsx synthétiques (même forme que l'export réel :
+# ligne "EMS", ligne d'en-tête avec les dates, Salarié + 7 jours + Qualification)
+# et mesure les étapes coûteuses : chargement, extraction des dates,
+# traiter_donnees pour chaque combinaison de filtres et agents non affectés.
+# Chaque mesure rapporte le temps, le pic mémoire (tracemalloc) et le nombre
+# de requêtes SQL. Tout est exécuté dans une transaction annulée et dans un
+# MEDIA_ROOT temporaire : la base et les versions publiées ne sont pas modifiées.
+
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import openpyxl
+from django.core.files import File
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from .forms import FiltreForm
+from .models import PlanningShift
+from .planning import JOURS_SEMAINE
+
+TAILLES_DEFAUT = [500, 5000, 50000]
+
+# Horaires observés dans les exports réels, avec leur fréquence relative
+HORAIRES_TYPES = [
+    ('REPOS', 30), ('16h-1h', 8), ('15h-0h', 8), ('14h-23h', 6), ('6H-14H', 5),
+    ('6h-15h', 5), ('13h-22h', 5), ('8h-17h', 4), ('9h-18h', 4), ('18h-3h', 4),
+    ('7h-16h', 4), ('17h-2h', 3), ('22H-6H', 2), ('23h-7h', 2), ('12h-21h', 2),
+    ('8h-16h', 2), ('ABSENCE', 5), ('CONGÉ PAYÉ', 2), ('CONGÉ MATERNITÉ', 1),
+    ('MALADIE', 1), ('OFF', 1), ('8h30-18h', 1), ('7h30-15h30', 1),
+    ('21h30-6h30', 1), ('CH 10h-17h R 10h-17h', 1), ('F 8h-17h 8h-17h', 1),
+    ('15h-0h R 0h-2h', 1),
+]
+
+PRENOMS = [
+    'Aalya', 'Abby', 'Adam', 'Amel', 'Amine', 'Asma', 'Aziz', 'Dorra', 'Emna', 'Farah',
+    'Hamza', 'Hela', 'Ines', 'Karim', 'Leila', 'Mariem', 'Mehdi', 'Nour', 'Omar', 'Rania',
+    'Sami', 'Sarra', 'Walid', 'Yasmine', 'Youssef', 'Zied',
+]
+NOMS = [
+    'BEN ALI', 'BOUAZIZ', 'CHERIF', 'DRIDI', 'GHARBI', 'GUIZENI', 'HAMDI', 'JEBALI',
+    'KHALFA', 'MEJRI', 'MZOUGHI', 'SAID', 'SASSI', 'TRABELSI', 'ZOUARI',
+]
+
+# Heures utilisées pour mesurer get_agents_non_affectes (les plus fréquentes des exports)
+HEURES_NON_AFFECTES = {'ramassage': 8, 'depart': 17}
+
+
+def generer_planning_ems(chemin, nb_agents, lundi=None, graine=0):
+    "Écrit un planning EMS.xlsx synthétique de nb_agents lignes ; retourne le chemin"
+    aleatoire = random.Random(graine)
+    if lundi is None:
+        aujourd_hui = date.today()
+        lundi = aujourd_hui + timedelta(days=7 - aujourd_hui.weekday())
+
+    horaires = [horaire for horaire, _ in HORAIRES_TYPES]
+    poids = [poids for _, poids in HORAIRES_TYPES]
+
+    classeur = openpyxl.Workbook()
+    feuille = classeur.active
+    feuille.append(['EMS'])
+    feuille.append(['Salarié'] + [
+        f"{jour} {(lundi + timedelta(days=i)).strftime('%d/%m')}"
+        for i, jour in enumerate(JOURS_SEMAINE)
+    ] + ['Qualification'])
+
+    for i in range(nb_agents):
+        prenom = aleatoire.choice(PRENOMS)
+        nom = f"{prenom} ({aleatoire.choice(PRENOMS)} {aleatoire.choice(NOMS)} {i:05d})"
+        # Comme dans les exports réels, un agent garde en général le même horaire sur la semaine
+        horaire_semaine = aleatoire.choices(horaires, poids)[0]
+        jours = [
+            horaire_semaine if aleatoire.random() < 0.7 else aleatoire.choices(horaires, poids)[0]
+            for _ in JOURS_SEMAINE
+        ]
+        feuille.append([nom] + jours + ['Téléconseiller'])
+
+    classeur.save(chemin)
+    return chemin
+
+
+def _mesurer(resultats, etape, taille, fonction, memoire=True):
+    "Exécute fonction() et ajoute temps / pic mémoire / requêtes SQL aux résultats"
+    if memoire:
+        tracemalloc.start()
+    with CaptureQueriesContext(connection) as requetes:
+        debut = time.perf_counter()
+        valeur = fonction()
+        duree = time.perf_counter() - debut
+    pic = None
+    if memoire:
+        _, pic = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    resultats.append({
+        'etape': etape,
+        'taille': taille,
+        'secondes': round(duree, 4),
+        'pic_memoire_mo': round(pic / 1024 / 1024, 2) if pic is not None else None,
+        'requetes': len(requetes.captured_queries),
+    })
+    return valeur
+
+
+def combinaisons_filtres(tous_les_jours=False):
+    "Combinaisons (jour, type, heure d'été, filtre agents) du formulaire de la liste des transports"
+    jours = ['Tous'] + (JOURS_SEMAINE if tous_les_jours else JOURS_SEMAINE[:1])
+    return list(itertools.product(
+        jours,
+        ['tous', 'ramassage', 'depart'],
+        [False, True],
+        ['tous', 'complets', 'incomplets'],
+    ))
+
+
+def _formulaire(jour, type_transport, heure_ete, filtre_agents):
+    data = {'jour': jour, 'type_transport': type_transport, 'filtre_agents': filtre_agents}
+    if heure_ete:
+        data['heure_ete'] = 'on'
+    formulaire = FiltreForm(data)
+    if not formulaire.is_valid():
+        raise ValueError(f"Filtre invalide: {formulaire.errors}")
+    return formulaire
+
+
+def benchmark_taille(nb_agents, dossier, tous_les_jours=False, memoire=True, graine=0):
+    "Mesure le pipeline sur un planning synthétique de nb_agents lignes"
+    # Import local : évite un import circulaire utils -> models au chargement de l'app
+    from .utils import GestionnaireTransport
+
+    resultats = []
+    chemin = os.path.join(dossier, f"EMS_{nb_agents}.xlsx")
+    _mesurer(resultats, 'generation', nb_agents, lambda: generer_planning_ems(chemin, nb_agents, graine=graine), memoire=False)
+
+    gestionnaire = GestionnaireTransport()
+    gestionnaire.dossier_instantanes = os.path.join(dossier, f"snapshots_{nb_agents}")
+
+    with open(chemin, 'rb') as f:
+        charge = _mesurer(resultats, 'charger_planning', nb_agents,
+                          lambda: gestionnaire.charger_planning(File(f, name=os.path.basename(chemin))), memoire)
+    if not charge:
+        raise RuntimeError(f"Chargement du planning synthétique impossible: {gestionnaire.erreur_chargement}")
+
+    _mesurer(resultats, 'extraire_dates_reelles', nb_agents,
+             lambda: gestionnaire.extraire_dates_reelles(gestionnaire.temp_path), memoire)
+
+    def gestionnaire_requete():
+        # Comme dans les vues : un gestionnaire neuf par requête, rechargé depuis la version
+        nouveau = GestionnaireTransport()
+        nouveau.dossier_instantanes = gestionnaire.dossier_instantanes
+        nouveau.recharger_planning_depuis_session(gestionnaire.planning_id)
+        return nouveau
+
+    _mesurer(resultats, 'recharger_planning', nb_agents, gestionnaire_requete, memoire)
+
+    for jour, type_transport, heure_ete, filtre_agents in combinaisons_filtres(tous_les_jours):
+        formulaire = _formulaire(jour, type_transport, heure_ete, filtre_agents)
+        requete = gestionnaire_requete()
+        etape = f"traiter_donnees[{jour},{type_transport},{'ete' if heure_ete else 'hiver'},{filtre_agents}]"
+        _mesurer(resultats, etape, nb_agents, lambda: requete.traiter_donnees(formulaire), memoire)
+
+    for jour in (JOURS_SEMAINE if tous_les_jours else JOURS_SEMAINE[:1]):
+        date_reelle = gestionnaire.dates_par_jour.get(jour)
+        for type_transport, heure in HEURES_NON_AFFECTES.items():
+            requete = gestionnaire_requete()
+            _mesurer(resultats, f"get_agents_non_affectes[{jour},{type_transport},{heure}h]", nb_agents,
+                     lambda: requete.get_agents_non_affectes(jour, type_transport, heure, date_reelle), memoire)
+            date_obj = datetime.strptime(date_reelle, "%d/%m/%Y").date()
+            _mesurer(resultats, f"PlanningShift.non_affectes[{jour},{type_transport},{heure}h]", nb_agents,
+                     lambda: list(PlanningShift.non_affectes(date_obj, type_transport, [heure])), memoire)
+
+    return resultats
+
+
+def executer_benchmark(tailles=None, tous_les_jours=False, memoire=True, graine=0):
+    """Lance le banc d'essai pour chaque taille et retourne la liste des mesures.
+
+    Les écritures en base (agents à compléter, shifts) sont annulées à la fin.
+    """
+    tailles = tailles or TAILLES_DEFAUT
+    resultats = []
+    dossier = tempfile.mkdtemp(prefix='benchmark_planning_')
+    try:
+        for nb_agents in tailles:
+            # Un MEDIA_ROOT par taille : chaque chargement est un premier upload (pas de diff)
+            with override_settings(MEDIA_ROOT=os.path.join(dossier, f"media_{nb_agents}")), transaction.atomic():
+                resultats.extend(benchmark_taille(nb_agents, dossier, tous_les_jours, memoire, graine))
+                transaction.set_rollback(True)
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+    return resultats
@@ -0,0 +1,21 @@
+from django.contrib import admin
+from .models import GeocodeCache, GeocodageAgent, TrajetCache
+
+@admin.register(GeocodeCache)
+class GeocodeCacheAdmin(admin.ModelAdmin):
+    list_display = ['adresse', 'source', 'latitude', 'longitude', 'confidence', 'updated_at', 'expire_at']
+    list_filter = ['source', 'success']
+    search_fields = ['adresse', 'adresse_formatee']
+    readonly_fields = ['cle', 'created_at', 'updated_at']
+
+@admin.register(GeocodageAgent)
+class GeocodageAgentAdmin(admin.ModelAdmin):
+    list_display = ['agent', 'adresse', 'tentatives', 'prochaine_tentative', 'derniere_erreur']
+    search_fields = ['agent__nom', 'adresse']
+    raw_id_fields = ['agent']
+
+@admin.register(TrajetCache)
+class TrajetCacheAdmin(admin.ModelAdmin):
+    list_display = ['origine', 'destination', 'profil', 'distance_km', 'duree_s', 'created_at']
+    list_filter = ['profil']
+    search_fields = ['origine', 'destination']
@@ -0,0 +1,54 @@
+# Normalisation des adresses agents
+# Beaucoup d'agents partagent une adresse (même cité, même immeuble) écrite de
+# façons différentes : "Cité Riadh 2, Rue 12" / "riadh2 r. 12 sousse 4000".
+# normaliser_adresse() en calcule une clé canonique (sans accents, abréviations
+# développées, quartier remplacé par son nom dans le gazetteer, ville, pays et
+# code postal retirés). La clé est stockée sur Agent.adresse_normalisee
+# (indexée) et sert à regrouper les agents : un seul géocodage, un seul arrêt
+# et une seule position sur la carte par adresse.
+
+from .file_geocodage import adresse_geocodable
+from .gazetteer import MOTS_GENERIQUES, gazetteer, replier
+
+LONGUEUR_MAX = 255
+
+ABREVIATIONS = {
+    'av': 'avenue', 'ave': 'avenue',
+    'bd': 'boulevard', 'blvd': 'boulevard',
+    'r': 'rue', 'rte': 'route',
+    'imm': 'immeuble', 'immb': 'immeuble',
+    'res': 'residence', 'resid': 'residence',
+    'cte': 'cite', 'ct': 'cite',
+    'app': 'appartement', 'appt': 'appartement', 'apt': 'appartement',
+    'n': 'numero', 'no': 'numero', 'num': 'numero',
+    'etg': 'etage', 'blc': 'bloc', 'esc': 'escalier',
+    'sd': 'sidi', 'st': 'saint',
+}
+
+# Retirés de la clé : articles, ville et pays (toutes les adresses sont à Sousse)
+MOTS_VIDES = {'de', 'du', 'des', 'la', 'le', 'les', 'd', 'l', 'sousse', 'tunisie', 'tunisia', 'tn'}
+
+
+def _est_code_postal(mot):
+    return len(mot) == 4 and mot.isdigit() and mot.startswith('4')
+
+
+def normaliser_adresse(adresse):
+    "Clé canonique de l'adresse ('' pour une adresse à compléter)"
+    if not adresse_geocodable(adresse):
+        return ''
+    
+    mots = [ABREVIATIONS.get(mot, mot) for mot in replier(adresse).split()]
+    texte = f" {' '.join(mot for mot in mots if mot not in MOTS_GENERIQUES)} "
+    
+    # Le quartier est cherché avant de retirer "sousse" (Hammam Sousse, Médina Sousse)
+    quartier = ''
+    trouve = gazetteer().correspondance(texte)
+    if trouve:
+        debut, fin, infos = trouve
+        quartier = replier(infos['nom']).strip()
+        texte = f"{texte[:debut]} {texte[fin:]}"
+    
+    reste = ' '.join(mot for mot in texte.split() if mot not in MOTS_VIDES and not _est_code_postal(mot))
+    cle = f"{quartier}|{reste}" if quartier else reste
+    return cle[:LONGUEUR_MAX]
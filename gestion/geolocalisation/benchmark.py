@@ -0,0 +1,101 @@
+# Banc d'essai du géocodage et du routage, hors ligne
+# Utilise le fournisseur de rejeu (réponses enregistrées, latence et échecs
+# simulés) à la place des API réelles : les mesures sont reproductibles pour
+# une graine donnée et ne consomment aucun quota. Le limiteur de débit, les
+# disjoncteurs, le cache négatif et les fallbacks sont ceux de la production ;
+# le cache persistant est désactivé et les limiteurs utilisent un dossier
+# temporaire pour ne pas fausser les créneaux des workers en cours.
+
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.test.utils import override_settings
+
+from .cache import cache_negatif
+from .disjoncteurs import metriques_disjoncteurs, reinitialiser_disjoncteurs
+from .fournisseurs import FournisseurRejeu, utiliser_fournisseur
+from .gazetteer import gazetteer
+from .limites import DEBITS_DEFAUT, metriques_limiteurs, reinitialiser_limiteurs
+
+RUES = [
+    'Rue de Rabat', 'Avenue Habib Bourguiba', 'Rue Ibn Khaldoun', 'Avenue de la République',
+    'Rue Farhat Hached', 'Boulevard du 14 Janvier', 'Rue Ali Belhouane', 'Avenue Léopold Senghor',
+]
+
+
+def generer_adresses(nombre, part_quartiers=0.5, graine=0):
+    "Adresses synthétiques : une part dans un quartier connu du gazetteer, le reste en rue seule"
+    aleatoire = random.Random(graine)
+    quartiers = [quartier['nom'] for quartier in gazetteer().quartiers if quartier.get('latitude') is not None]
+    adresses = []
+    for _ in range(nombre):
+        rue = f"{aleatoire.randint(1, 120)} {aleatoire.choice(RUES)}"
+        if aleatoire.random() < part_quartiers:
+            adresses.append(f"{rue}, {aleatoire.choice(quartiers)}, Sousse")
+        else:
+            adresses.append(f"{rue}, Sousse")
+    return adresses
+
+
+def executer_benchmark_geocodage(nb_adresses=200, nb_trajets=20, fichier_rejeu=None, debits=None,
+                                 part_quartiers=0.5, graine=0):
+    "Géocode nb_adresses adresses puis estime nb_trajets trajets avec le fournisseur de rejeu ; retourne les mesures"
+    from .utils import GeolocalisationManager
+
+    fichier_rejeu = fichier_rejeu or getattr(settings, 'GEOCODAGE_REJEU_FICHIER', None)
+    fournisseur = FournisseurRejeu(fichier_rejeu, graine=graine)
+    dossier = tempfile.mkdtemp(prefix='benchmark_geocodage_')
+    precedent = utiliser_fournisseur(fournisseur)
+    try:
+        with override_settings(GEOCODAGE_DOSSIER_LIMITES=dossier,
+                               GEOCODAGE_DEBITS=dict(DEBITS_DEFAUT, **(debits or {}))):
+            reinitialiser_limiteurs()
+            reinitialiser_disjoncteurs()
+            cache_negatif.vider()
+
+            geo_manager = GeolocalisationManager()
+            geo_manager.cache_enabled = False
+            adresses = generer_adresses(nb_adresses, part_quartiers, graine)
+
+            debut = time.perf_counter()
+            resultats = geo_manager.batch_geocode_adresses(adresses)
+            duree_geocodage = time.perf_counter() - debut
+            appels_geocodage = fournisseur.appels
+
+            aleatoire = random.Random(graine)
+            positions = [(r['latitude'], r['longitude']) for r in resultats] or [(35.8256, 10.6415)]
+            debut = time.perf_counter()
+            trajets = [
+                geo_manager.obtenir_temps_trajet_estime(aleatoire.choice(positions), aleatoire.choice(positions))
+                for _ in range(nb_trajets)
+            ]
+            duree_routage = time.perf_counter() - debut
+
+            return {
+                'fichier_rejeu': fichier_rejeu,
+                'graine': graine,
+                'geocodage': {
+                    'adresses': nb_adresses,
+                    'secondes': round(duree_geocodage, 3),
+                    'appels_fournisseurs': appels_geocodage,
+                    'sources': dict(Counter(r.get('source', 'inconnu') for r in resultats)),
+                },
+                'routage': {
+                    'trajets': nb_trajets,
+                    'secondes': round(duree_routage, 3),
+                    'appels_fournisseurs': fournisseur.appels - appels_geocodage,
+                    'sources': dict(Counter(t['source'] for t in trajets)),
+                },
+                'limiteurs': metriques_limiteurs(),
+                'disjoncteurs': metriques_disjoncteurs(),
+            }
+    finally:
+        utiliser_fournisseur(precedent)
+        reinitialiser_limiteurs()
+        reinitialiser_disjoncteurs()
+        cache_negatif.vider()
+        shutil.rmtree(dossier, ignore_errors=True)
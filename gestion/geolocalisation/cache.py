@@ -0,0 +1,177 @@
+# Cache de géocodage persistant
+# Les résultats sont stockés en base (GeocodeCache) pour être partagés entre
+# tous les workers et survivre aux redémarrages ; un petit LRU en mémoire évite
+# une requête SQL pour les adresses relues dans le même processus.
+
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .adresses import normaliser_adresse
+from .models import GeocodeCache
+
+# Durée de validité par source (secondes), surchargée par settings.GEOCODE_CACHE_TTL.
+# La position approximative au centre de Sousse (aucun fournisseur n'a trouvé
+# l'adresse) est gardée peu de temps : l'adresse sera retentée ensuite.
+TTL_PAR_SOURCE = {
+    'positionstack': 90 * 86400,
+    'nominatim': 90 * 86400,
+    'fallback_centre': 3600,
+}
+
+# "Le fournisseur n'a rien trouvé" : mémorisé peu de temps, par fournisseur
+TTL_NEGATIF_DEFAUT = 3600
+
+
+def cle_adresse(adresse_nettoyee):
+    "Clé de cache d'une adresse déjà passée par nettoyer_adresse : les variantes d'une même adresse partagent l'entrée"
+    return hashlib.md5((normaliser_adresse(adresse_nettoyee) or adresse_nettoyee).encode()).hexdigest()
+
+
+def cle_adresse_v1(adresse_nettoyee):
+    "Ancienne clé (adresse nettoyée seule), celle des entrées écrites avant la clé normalisée"
+    return hashlib.md5(adresse_nettoyee.encode()).hexdigest()
+
+
+def ttl_source(source):
+    ttl = dict(TTL_PAR_SOURCE, **getattr(settings, 'GEOCODE_CACHE_TTL', {}))
+    return ttl.get(source, getattr(settings, 'CACHE_TIMEOUT_GEOCODING', 86400))
+
+
+class CacheGeocodage:
+    "LRU en mémoire (par processus) devant la table GeocodeCache"
+
+    def __init__(self, taille_max=None):
+        self.taille_max = taille_max or getattr(settings, 'GEOCODE_CACHE_LRU_TAILLE', 2048)
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def _lru_get(self, cle, approximatif):
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is None:
+                return None
+            resultat, expire_at = entree
+            if expire_at <= timezone.now():
+                del self._entrees[cle]
+                return None
+            if not approximatif and not resultat.get('success'):
+                return None
+            self._entrees.move_to_end(cle)
+            return resultat
+
+    def _lru_set(self, cle, resultat, expire_at):
+        with self._verrou:
+            self._entrees[cle] = (resultat, expire_at)
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+
+    def get(self, adresse_nettoyee, approximatif=True):
+        """Résultat en cache (copie) ou None s'il est absent ou expiré.
+
+        approximatif=False : seulement un résultat d'un fournisseur (pas le centre de Sousse).
+        """
+        cle = cle_adresse(adresse_nettoyee)
+        resultat = self._lru_get(cle, approximatif)
+        if resultat is not None:
+            return dict(resultat)
+
+        try:
+            entrees = GeocodeCache.objects.filter(cle=cle, expire_at__gt=timezone.now())
+            if not approximatif:
+                entrees = entrees.filter(success=True)
+            entree = entrees.first()
+            if entree is None:
+                entree = self._reprendre_ancienne_cle(adresse_nettoyee, cle)
+        except Exception as e:
+            print(f"⚠️ Cache géocodage indisponible: {e}")
+            return None
+        if entree is None:
+            return None
+        self._lru_set(cle, entree.resultat, entree.expire_at)
+        return dict(entree.resultat)
+
+    def _reprendre_ancienne_cle(self, adresse_nettoyee, cle):
+        "Entrée encore rangée sous l'ancienne clé : passée sous la clé normalisée au premier accès"
+        ancienne_cle = cle_adresse_v1(adresse_nettoyee)
+        if ancienne_cle == cle:
+            return None
+        entree = GeocodeCache.objects.filter(cle=ancienne_cle, success=True, expire_at__gt=timezone.now()).first()
+        if entree is None:
+            return None
+        try:
+            with transaction.atomic():
+                GeocodeCache.objects.filter(pk=entree.pk).update(cle=cle)
+        except IntegrityError:
+            # Une entrée (expirée) existe déjà sous la nouvelle clé : l'ancienne reste lisible
+            pass
+        return entree
+
+    def set(self, adresse_nettoyee, resultat, ttl=None):
+        "Enregistre un résultat (en base et dans le LRU) avec la durée de validité de sa source"
+        source = resultat.get('source', '')
+        expire_at = timezone.now() + timedelta(seconds=ttl if ttl is not None else ttl_source(source))
+        cle = cle_adresse(adresse_nettoyee)
+        try:
+            GeocodeCache.objects.update_or_create(
+                cle=cle,
+                defaults={
+                    'adresse': adresse_nettoyee,
+                    'latitude': resultat['latitude'],
+                    'longitude': resultat['longitude'],
+                    'adresse_formatee': resultat.get('adresse_formatee', ''),
+                    'source': source,
+                    'confidence': resultat.get('confidence') or 0,
+                    'success': bool(resultat.get('success')),
+                    'resultat': resultat,
+                    'expire_at': expire_at,
+                }
+            )
+        except Exception as e:
+            print(f"⚠️ Cache géocodage non enregistré: {e}")
+        self._lru_set(cle, dict(resultat), expire_at)
+
+
+cache_geocodage = CacheGeocodage()
+
+
+class CacheNegatif:
+    "Adresses pour lesquelles un fournisseur n'a rien retourné récemment (mémoire du processus)"
+
+    def __init__(self, taille_max=None):
+        self.taille_max = taille_max or getattr(settings, 'GEOCODE_CACHE_LRU_TAILLE', 2048)
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def contient(self, fournisseur, adresse_nettoyee):
+        cle = (fournisseur, cle_adresse(adresse_nettoyee))
+        with self._verrou:
+            expire_at = self._entrees.get(cle)
+            if expire_at is None:
+                return False
+            if expire_at <= timezone.now():
+                del self._entrees[cle]
+                return False
+            return True
+
+    def ajouter(self, fournisseur, adresse_nettoyee):
+        ttl = getattr(settings, 'GEOCODE_CACHE_NEGATIF_TTL', TTL_NEGATIF_DEFAUT)
+        cle = (fournisseur, cle_adresse(adresse_nettoyee))
+        with self._verrou:
+            self._entrees[cle] = timezone.now() + timedelta(seconds=ttl)
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+
+    def vider(self):
+        with self._verrou:
+            self._entrees.clear()
+
+
+cache_negatif = CacheNegatif()
@@ -0,0 +1,129 @@
+# Disjoncteurs des fournisseurs externes (géocodage, routage)
+# Quand Nominatim ou PositionStack est lent ou en panne, chaque adresse
+# attendrait le timeout complet avant de passer au fournisseur suivant. Après
+# seuil_echecs échecs consécutifs (timeout, erreur réseau, HTTP 429/5xx) le
+# disjoncteur s'ouvre : le fournisseur est ignoré immédiatement. Passé le délai
+# d'ouverture, une seule requête d'essai est autorisée (semi-ouvert) : succès,
+# le disjoncteur se referme ; échec, il se rouvre pour un délai doublé.
+# L'état est gardé en mémoire, partagé par les threads du processus.
+
+import threading
+import time
+
+from django.conf import settings
+
+from .limites import DEBITS_DEFAUT
+
+PARAMETRES_DEFAUT = {
+    'seuil_echecs': 3,        # échecs consécutifs avant ouverture
+    'delai_ouverture': 30,    # secondes avant la première requête d'essai
+    'delai_max': 600,         # plafond du délai après des essais ratés
+}
+
+FERME = 'ferme'
+OUVERT = 'ouvert'
+SEMI_OUVERT = 'semi_ouvert'
+
+
+def parametres_disjoncteur():
+    return dict(PARAMETRES_DEFAUT, **getattr(settings, 'GEOCODAGE_DISJONCTEUR', {}))
+
+
+class Disjoncteur:
+    "Disjoncteur d'un fournisseur : autoriser() avant l'appel, puis succes() ou echec()"
+
+    def __init__(self, fournisseur, seuil_echecs=None, delai_ouverture=None, delai_max=None):
+        parametres = parametres_disjoncteur()
+        self.fournisseur = fournisseur
+        self.seuil_echecs = seuil_echecs or parametres['seuil_echecs']
+        self.delai_ouverture = delai_ouverture or parametres['delai_ouverture']
+        self.delai_max = delai_max or parametres['delai_max']
+        self._verrou = threading.Lock()
+        self.etat = FERME
+        self.echecs_consecutifs = 0
+        self.delai_courant = self.delai_ouverture
+        self.reouverture = 0.0
+        self._essai_en_cours = False
+        self.appels_ignores = 0
+        self.ouvertures = 0
+
+    def autoriser(self):
+        "True si la requête peut partir ; en semi-ouvert, une seule requête d'essai à la fois"
+        with self._verrou:
+            if self.etat == OUVERT and time.monotonic() >= self.reouverture:
+                self.etat = SEMI_OUVERT
+                self._essai_en_cours = False
+            if self.etat == FERME:
+                return True
+            if self.etat == SEMI_OUVERT and not self._essai_en_cours:
+                self._essai_en_cours = True
+                print(f"🔌 Disjoncteur {self.fournisseur}: requête d'essai")
+                return True
+            self.appels_ignores += 1
+            return False
+
+    def succes(self):
+        with self._verrou:
+            if self.etat != FERME:
+                print(f"✅ Disjoncteur {self.fournisseur}: refermé")
+            self.etat = FERME
+            self.echecs_consecutifs = 0
+            self.delai_courant = self.delai_ouverture
+            self._essai_en_cours = False
+
+    def abandonner(self):
+        "La requête autorisée n'a pas été envoyée (budget épuisé) : libère la requête d'essai"
+        with self._verrou:
+            self._essai_en_cours = False
+
+    def echec(self):
+        with self._verrou:
+            self.echecs_consecutifs += 1
+            if self.etat == SEMI_OUVERT:
+                # Essai raté : on rouvre plus longtemps
+                self.delai_courant = min(self.delai_courant * 2, self.delai_max)
+                self._ouvrir()
+            elif self.etat == FERME and self.echecs_consecutifs >= self.seuil_echecs:
+                self._ouvrir()
+
+    def _ouvrir(self):
+        self.etat = OUVERT
+        self.reouverture = time.monotonic() + self.delai_courant
+        self._essai_en_cours = False
+        self.ouvertures += 1
+        print(f"⛔ Disjoncteur {self.fournisseur}: ouvert pour {self.delai_courant:.0f}s "
+              f"({self.echecs_consecutifs} échec(s) consécutif(s))")
+
+    def metriques(self):
+        with self._verrou:
+            return {
+                'fournisseur': self.fournisseur,
+                'etat': self.etat,
+                'echecs_consecutifs': self.echecs_consecutifs,
+                'reouverture_dans_s': round(max(self.reouverture - time.monotonic(), 0), 1) if self.etat == OUVERT else 0,
+                'ouvertures': self.ouvertures,
+                'appels_ignores': self.appels_ignores,
+            }
+
+
+_disjoncteurs = {}
+_verrou_disjoncteurs = threading.Lock()
+
+
+def disjoncteur(fournisseur):
+    "Disjoncteur du fournisseur (créé au premier appel)"
+    with _verrou_disjoncteurs:
+        if fournisseur not in _disjoncteurs:
+            _disjoncteurs[fournisseur] = Disjoncteur(fournisseur)
+        return _disjoncteurs[fournisseur]
+
+
+def reinitialiser_disjoncteurs():
+    "Referme tous les disjoncteurs (banc d'essai)"
+    with _verrou_disjoncteurs:
+        _disjoncteurs.clear()
+
+
+def metriques_disjoncteurs():
+    "État des disjoncteurs de tous les fournisseurs connus"
+    return [disjoncteur(fournisseur).metriques() for fournisseur in DEBITS_DEFAUT]
@@ -0,0 +1,240 @@
+# File d'attente du géocodage des agents
+# Les agents sont géocodés quand ils sont créés ou que leur adresse change
+# (formulaires, API, imports Excel), jamais pendant l'affichage d'une carte ou
+# le calcul d'un itinéraire : ces vues lisent uniquement Agent.latitude /
+# Agent.longitude. Un worker (un thread du processus, ou la commande
+# geocoder_agents) vide la file en respectant les limites des fournisseurs.
+# Une position approximative (centre du quartier connu) est enregistrée mais
+# l'entrée reste dans la file : un fournisseur la remplacera au prochain essai.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .index_spatial import encoder_geohash, invalider_index_agents
+from .models import GeocodageAgent
+
+# Adresses provisoires : géocodées seulement une fois complétées
+ADRESSES_A_COMPLETER = {'', 'Adresse à compléter', 'Adresse non renseignee'}
+
+TAILLE_LOT = 50
+MAX_TENTATIVES = 5
+
+_executeur = ThreadPoolExecutor(max_workers=1, thread_name_prefix='geocodage_agents')
+# Raffinements à part : ils ne doivent pas attendre la fin d'un vidage de la file
+# (lots de 50 adresses à 1 requête/s) ; le limiteur de débit reste commun
+_executeur_raffinements = ThreadPoolExecutor(max_workers=1, thread_name_prefix='raffinement_geocodage')
+_verrou = threading.Lock()
+_en_cours = False
+# Adresses dont le résultat provisoire (budget épuisé) attend d'être affiné
+_raffinements = set()
+
+
+def adresse_geocodable(adresse):
+    return bool(adresse) and str(adresse).strip() not in ADRESSES_A_COMPLETER
+
+
+def planifier_geocodage(agents, lancer=True):
+    """Ajoute les agents à la file (adresse actuelle) et réveille le worker après le commit ; retourne le nombre planifié.
+
+    Appelé pour les agents nouveaux ou dont l'adresse a changé : l'ancienne position est effacée.
+    """
+    agents = [agent for agent in agents if agent.pk and adresse_geocodable(agent.adresse)]
+    _effacer_positions(agents)
+    agents = _reutiliser_coordonnees(agents)
+    if not agents:
+        return 0
+    
+    with transaction.atomic():
+        GeocodageAgent.objects.filter(agent_id__in=[agent.pk for agent in agents]).delete()
+        GeocodageAgent.objects.bulk_create([
+            GeocodageAgent(agent_id=agent.pk, adresse=agent.adresse)
+            for agent in agents
+        ])
+    print(f"🗺️ {len(agents)} agent(s) en attente de géocodage")
+    if lancer:
+        transaction.on_commit(lancer_worker)
+    return len(agents)
+
+
+def _effacer_positions(agents):
+    "Adresse changée : la position de l'ancien domicile ne doit plus servir (cartes, itinéraires, répartition)"
+    from gestion.models import Agent
+    
+    a_effacer = [agent for agent in agents if agent.latitude is not None or agent.longitude is not None]
+    if not a_effacer:
+        return
+    Agent.objects.filter(pk__in=[agent.pk for agent in a_effacer]).update(
+        latitude=None,
+        longitude=None,
+        geohash='',
+        adresse_geocodee=None,
+        derniere_geolocalisation=None,
+        corrige_manuellement=False
+    )
+    for agent in a_effacer:
+        agent.latitude = agent.longitude = agent.adresse_geocodee = agent.derniere_geolocalisation = None
+        agent.geohash = ''
+        agent.corrige_manuellement = False
+    transaction.on_commit(invalider_index_agents)
+    print(f"🧹 {len(a_effacer)} position(s) effacée(s) en attendant le géocodage de la nouvelle adresse")
+
+
+def _reutiliser_coordonnees(agents):
+    "Recopie les coordonnées d'un agent déjà géocodé à la même adresse ; retourne les agents restant à géocoder"
+    from gestion.models import Agent
+    
+    cles = {agent.adresse_normalisee for agent in agents if agent.adresse_normalisee}
+    if not cles:
+        return agents
+    
+    # Une position corrigée à la main est la plus fiable, puis la plus récente
+    references = {}
+    candidats = Agent.objects.filter(
+        adresse_normalisee__in=cles, latitude__isnull=False, longitude__isnull=False
+    ).exclude(pk__in=[agent.pk for agent in agents]).order_by('-corrige_manuellement', '-derniere_geolocalisation')
+    for reference in candidats.only('latitude', 'longitude', 'adresse_geocodee', 'adresse_normalisee'):
+        references.setdefault(reference.adresse_normalisee, reference)
+    
+    restants = []
+    for agent in agents:
+        reference = references.get(agent.adresse_normalisee)
+        if reference is None:
+            restants.append(agent)
+            continue
+        Agent.objects.filter(pk=agent.pk, adresse=agent.adresse, corrige_manuellement=False).update(
+            latitude=reference.latitude,
+            longitude=reference.longitude,
+            geohash=encoder_geohash(reference.latitude, reference.longitude),
+            adresse_geocodee=reference.adresse_geocodee,
+            derniere_geolocalisation=timezone.now(),
+            corrige_manuellement=False
+        )
+        GeocodageAgent.objects.filter(agent_id=agent.pk).delete()
+    
+    if len(restants) < len(agents):
+        transaction.on_commit(invalider_index_agents)
+        print(f"♻️ {len(agents) - len(restants)} agent(s) placé(s) à une adresse déjà géocodée")
+    return restants
+
+
+def lancer_worker():
+    "Démarre le vidage de la file en arrière-plan s'il n'est pas déjà en cours"
+    global _en_cours
+    with _verrou:
+        if _en_cours:
+            return
+        _en_cours = True
+    _executeur.submit(_worker)
+
+
+def _worker():
+    global _en_cours
+    try:
+        vider_file()
+    except Exception as e:
+        print(f"❌ Erreur worker géocodage: {e}")
+    finally:
+        with _verrou:
+            _en_cours = False
+        connection.close()
+
+
+def planifier_raffinement(adresse):
+    "Géocode l'adresse en arrière-plan, sans limite de temps, pour remplacer un résultat provisoire (mis en cache)"
+    if not adresse_geocodable(adresse):
+        return
+    with _verrou:
+        if adresse in _raffinements:
+            return
+        _raffinements.add(adresse)
+    _executeur_raffinements.submit(_raffiner, adresse)
+
+
+def _raffiner(adresse):
+    from .utils import GeolocalisationManager
+    try:
+        result = GeolocalisationManager().geocode_adresse(adresse, precis=True)
+        print(f"🔁 Raffinement {'réussi' if result.get('success') else 'sans résultat'}: {adresse[:50]}")
+    except Exception as e:
+        print(f"❌ Erreur raffinement géocodage: {e}")
+    finally:
+        with _verrou:
+            _raffinements.discard(adresse)
+        connection.close()
+
+
+def _reporter(entree, erreur):
+    "Échec : nouvelle tentative plus tard (délai croissant), abandon après MAX_TENTATIVES"
+    tentatives = entree.tentatives + 1
+    if tentatives >= MAX_TENTATIVES:
+        GeocodageAgent.objects.filter(pk=entree.pk, adresse=entree.adresse).delete()
+        print(f"  ❌ Géocodage abandonné après {tentatives} tentatives: {entree.adresse[:50]}")
+        return
+    delai = min(timedelta(minutes=5 * 2 ** entree.tentatives), timedelta(days=1))
+    GeocodageAgent.objects.filter(pk=entree.pk, adresse=entree.adresse).update(
+        tentatives=tentatives,
+        prochaine_tentative=timezone.now() + delai,
+        derniere_erreur=erreur
+    )
+
+
+def vider_file(limite=None):
+    "Géocode les entrées échues de la file, par lots ; retourne (géocodés, échecs)"
+    from gestion.models import Agent
+    from .utils import GeolocalisationManager
+    
+    geo_manager = GeolocalisationManager()
+    geocodes = 0
+    echecs = 0
+    
+    while limite is None or geocodes + echecs < limite:
+        taille = TAILLE_LOT if limite is None else min(TAILLE_LOT, limite - geocodes - echecs)
+        lot = list(GeocodageAgent.objects.filter(prochaine_tentative__lte=timezone.now())[:taille])
+        if not lot:
+            break
+        
+        try:
+            resultats = geo_manager.batch_geocode_adresses([entree.adresse for entree in lot], precis=True)
+        except Exception as e:
+            print(f"❌ Erreur géocodage du lot: {e}")
+            for entree in lot:
+                _reporter(entree, str(e))
+            echecs += len(lot)
+            continue
+        
+        for entree, result in zip(lot, resultats):
+            if not result.get('success'):
+                # Centre-ville approximatif : pas de coordonnées enregistrées, on retentera
+                _reporter(entree, f"Aucun résultat ({result.get('source', 'inconnu')})")
+                echecs += 1
+                continue
+            
+            # L'adresse a pu changer (ou la position être corrigée à la main) pendant le géocodage :
+            # ne pas écrire de coordonnées obsolètes
+            mis_a_jour = Agent.objects.filter(
+                pk=entree.agent_id, adresse=entree.adresse, corrige_manuellement=False
+            ).update(
+                latitude=result['latitude'],
+                longitude=result['longitude'],
+                geohash=encoder_geohash(result['latitude'], result['longitude']),
+                adresse_geocodee=result.get('adresse_formatee', entree.adresse),
+                derniere_geolocalisation=timezone.now(),
+                corrige_manuellement=False
+            )
+            if result.get('provisoire'):
+                # Centre du quartier : la position sert en attendant, l'entrée reste dans la file
+                _reporter(entree, f"Position approximative ({result.get('source', 'inconnu')})")
+            else:
+                GeocodageAgent.objects.filter(pk=entree.pk, adresse=entree.adresse).delete()
+            if mis_a_jour:
+                geocodes += 1
+    
+    if geocodes:
+        invalider_index_agents()
+    if geocodes or echecs:
+        print(f"✅ File géocodage: {geocodes} agent(s) géocodé(s), {echecs} échec(s)")
+    return geocodes, echecs
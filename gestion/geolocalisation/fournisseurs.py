@@ -0,0 +1,229 @@
+# Accès aux fournisseurs externes (PositionStack, Nominatim, OSRM)
+# GeolocalisationManager n'appelle plus requests.get directement mais le
+# fournisseur configuré par GEOCODAGE_FOURNISSEUR :
+#   - 'http'  : requêtes réelles ; si GEOCODAGE_ENREGISTREMENT_FICHIER est
+#               défini, chaque réponse est ajoutée à ce fichier (JSON lines)
+#   - 'rejeu' : réponses enregistrées lues dans GEOCODAGE_REJEU_FICHIER, avec
+#               latence et taux d'échec configurables, sans aucun accès réseau
+# Le limiteur de débit, les disjoncteurs et le décodage des réponses restent
+# les mêmes dans les deux cas : on peut mesurer le géocodage batch et les
+# fallbacks de routage hors ligne, de façon reproductible (graine fixe).
+
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+
+from .gazetteer import replier
+
+# Sans fichier de rejeu : pas de latence, pas d'échec, aucun résultat de géocodage
+PARAMETRES_REJEU_DEFAUT = {
+    'latence': [0.0, 0.0],       # secondes, tirée uniformément dans [min, max]
+    'taux_timeout': 0.0,         # part des requêtes qui finissent en timeout
+    'taux_erreur': 0.0,          # part des réponses HTTP 503
+    'taux_429': 0.0,             # part des réponses HTTP 429
+}
+
+VITESSE_ROUTE_SYNTHETIQUE = 40  # km/h, trajets OSRM non enregistrés
+DETOUR_ROUTE_SYNTHETIQUE = 1.3  # distance routière / distance à vol d'oiseau
+
+
+def _distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(a))
+
+
+def cle_requete(fournisseur, url, params=None):
+    "Clé d'une requête enregistrée : adresse repliée pour le géocodage, chemin de l'URL pour OSRM"
+    params = params or {}
+    requete = params.get('query') or params.get('q')
+    if requete:
+        return replier(requete).strip()
+    return urlsplit(url).path.strip('/')
+
+
+class ReponseEnregistree:
+    "Réponse rejouée, avec l'interface utilisée de requests.Response"
+
+    def __init__(self, status_code, contenu):
+        self.status_code = status_code
+        self._contenu = contenu
+
+    def json(self):
+        return json.loads(json.dumps(self._contenu))
+
+
+class FournisseurHTTP:
+    "Requêtes réelles, enregistrées dans un fichier si demandé"
+
+    def __init__(self, fichier_enregistrement=None):
+        self.fichier_enregistrement = fichier_enregistrement
+        self._verrou = threading.Lock()
+
+    def get(self, fournisseur, url, params=None, headers=None, timeout=5):
+        response = requests.get(url, params=params, headers=headers, timeout=timeout)
+        if self.fichier_enregistrement:
+            self._enregistrer(fournisseur, url, params, response)
+        return response
+
+    def _enregistrer(self, fournisseur, url, params, response):
+        try:
+            contenu = response.json()
+        except ValueError:
+            return
+        ligne = json.dumps({
+            'fournisseur': fournisseur,
+            'cle': cle_requete(fournisseur, url, params),
+            'status': response.status_code,
+            'json': contenu,
+        }, ensure_ascii=False)
+        try:
+            with self._verrou, open(self.fichier_enregistrement, 'a', encoding='utf-8') as f:
+                f.write(ligne + '\n')
+        except OSError as e:
+            print(f"⚠️ Enregistrement {fournisseur} impossible: {e}")
+
+
+class FournisseurRejeu:
+    """Réponses enregistrées, sans réseau.
+
+    Le fichier est soit un JSON {"graine", "fournisseurs": {nom: paramètres}, "reponses": [...]},
+    soit directement un enregistrement JSON lines produit par FournisseurHTTP.
+    """
+
+    def __init__(self, fichier=None, graine=None):
+        config = self._charger(fichier) if fichier else {}
+        self.parametres = config.get('fournisseurs', {})
+        self.reponses = {}
+        for entree in config.get('reponses', []):
+            self.reponses[(entree['fournisseur'], entree['cle'])] = (entree.get('status', 200), entree.get('json'))
+        self._aleatoire = random.Random(graine if graine is not None else config.get('graine', 0))
+        self._verrou = threading.Lock()
+        self.appels = 0
+        print(f"📼 Fournisseur de rejeu: {len(self.reponses)} réponse(s) enregistrée(s)")
+
+    @staticmethod
+    def _charger(fichier):
+        with open(fichier, encoding='utf-8') as f:
+            if fichier.endswith('.jsonl'):
+                return {'reponses': [json.loads(ligne) for ligne in f if ligne.strip()]}
+            return json.load(f)
+
+    def _parametres(self, fournisseur):
+        return dict(PARAMETRES_REJEU_DEFAUT, **self.parametres.get(fournisseur, {}))
+
+    def get(self, fournisseur, url, params=None, headers=None, timeout=5):
+        parametres = self._parametres(fournisseur)
+        with self._verrou:
+            self.appels += 1
+            latence = self._aleatoire.uniform(*parametres['latence'])
+            tirage = self._aleatoire.random()
+
+        if tirage < parametres['taux_timeout'] or latence > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.Timeout(f"{fournisseur}: timeout simulé")
+        time.sleep(latence)
+        tirage -= parametres['taux_timeout']
+        if tirage < parametres['taux_erreur']:
+            return ReponseEnregistree(503, {})
+        tirage -= parametres['taux_erreur']
+        if tirage < parametres['taux_429']:
+            return ReponseEnregistree(429, {})
+
+        cle = cle_requete(fournisseur, url, params)
+        if (fournisseur, cle) in self.reponses:
+            return ReponseEnregistree(*self.reponses[(fournisseur, cle)])
+        if 'defaut' in parametres:
+            return ReponseEnregistree(parametres['defaut'].get('status', 200), parametres['defaut'].get('json'))
+        return self._reponse_synthetique(fournisseur, cle, params or {})
+
+    def _reponse_synthetique(self, fournisseur, cle, params):
+        "Requête non enregistrée : aucun résultat pour le géocodage, trajet ou matrice estimés pour OSRM"
+        if fournisseur == 'positionstack':
+            return ReponseEnregistree(200, {'data': []})
+        if fournisseur == 'osrm' and cle.startswith('route/'):
+            return ReponseEnregistree(200, self._route_synthetique(cle))
+        if fournisseur == 'osrm' and cle.startswith('table/'):
+            return ReponseEnregistree(200, self._table_synthetique(cle, params))
+        return ReponseEnregistree(200, [])
+
+    @staticmethod
+    def _points(cle):
+        "Coordonnées (lon, lat) du chemin d'une URL OSRM ; None si invalides"
+        try:
+            return [tuple(map(float, coords.split(','))) for coords in cle.split('/')[-1].split(';')]
+        except ValueError:
+            return None
+
+    @classmethod
+    def _table_synthetique(cls, cle, params):
+        points = cls._points(cle)
+        if points is None:
+            return {'code': 'InvalidQuery'}
+        try:
+            sources = [int(i) for i in params['sources'].split(';')] if params.get('sources') else range(len(points))
+            destinations = ([int(i) for i in params['destinations'].split(';')]
+                            if params.get('destinations') else range(len(points)))
+        except ValueError:
+            return {'code': 'InvalidQuery'}
+        distances = [[_distance_km(points[i][1], points[i][0], points[j][1], points[j][0]) * DETOUR_ROUTE_SYNTHETIQUE
+                      for j in destinations] for i in sources]
+        return {
+            'code': 'Ok',
+            'distances': [[d * 1000 for d in ligne] for ligne in distances],
+            'durations': [[d / VITESSE_ROUTE_SYNTHETIQUE * 3600 for d in ligne] for ligne in distances],
+        }
+
+    @classmethod
+    def _route_synthetique(cls, cle):
+        points = cls._points(cle)
+        if points is None:
+            return {'code': 'InvalidQuery'}
+        distance_km = sum(
+            _distance_km(lat1, lon1, lat2, lon2)
+            for (lon1, lat1), (lon2, lat2) in zip(points, points[1:])
+        ) * DETOUR_ROUTE_SYNTHETIQUE
+        return {
+            'code': 'Ok',
+            'routes': [{
+                'distance': distance_km * 1000,
+                'duration': distance_km / VITESSE_ROUTE_SYNTHETIQUE * 3600,
+            }],
+        }
+
+
+_fournisseur = None
+_verrou_fournisseur = threading.Lock()
+
+
+def creer_fournisseur():
+    "Fournisseur décrit par les settings (GEOCODAGE_FOURNISSEUR)"
+    mode = getattr(settings, 'GEOCODAGE_FOURNISSEUR', 'http')
+    if mode == 'rejeu':
+        return FournisseurRejeu(getattr(settings, 'GEOCODAGE_REJEU_FICHIER', None))
+    if mode != 'http':
+        raise ValueError(f"GEOCODAGE_FOURNISSEUR inconnu: {mode}")
+    return FournisseurHTTP(getattr(settings, 'GEOCODAGE_ENREGISTREMENT_FICHIER', None))
+
+
+def fournisseur_externe():
+    "Fournisseur partagé, créé au premier appel"
+    global _fournisseur
+    with _verrou_fournisseur:
+        if _fournisseur is None:
+            _fournisseur = creer_fournisseur()
+        return _fournisseur
+
+
+def utiliser_fournisseur(fournisseur):
+    "Remplace le fournisseur partagé (banc d'essai) ; retourne le précédent"
+    global _fournisseur
+    with _verrou_fournisseur:
+        precedent, _fournisseur = _fournisseur, fournisseur
+        return precedent
@@ -0,0 +1,153 @@
+# Gazetteer hors ligne des quartiers de Sousse
+# Un seul jeu de données (data/gazetteer_sousse.json) remplace les tables de
+# quartiers codées en dur. Les alias sont compilés dans un automate
+# Aho-Corasick : une adresse est parcourue une seule fois quel que soit le
+# nombre d'alias, et la correspondance la plus longue l'emporte ("riadh 2"
+# plutôt que "riadh"). Les comparaisons se font sans accents ni majuscules,
+# sur des mots entiers ("lac" ne correspond pas à "place").
+
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import deque
+
+from django.conf import settings
+
+FICHIER_DEFAUT = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer_sousse.json')
+
+# Mots ignorés pour la comparaison : "Cité Riadh 2" doit correspondre à "riadh 2", pas à "cite riadh"
+MOTS_GENERIQUES = {'cite', 'hay', 'quartier', 'residence', 'res'}
+
+
+def replier(texte):
+    "Texte sans accents, en minuscules, mots séparés par un seul espace et entouré d'espaces"
+    texte = unicodedata.normalize('NFKD', str(texte or ''))
+    texte = ''.join(c for c in texte if not unicodedata.combining(c)).lower()
+    return f" {' '.join(re.findall(r'[a-z0-9]+', texte))} "
+
+
+def cle_recherche(texte):
+    "Forme repliée sans les mots génériques, utilisée pour les alias et les adresses"
+    return f" {' '.join(mot for mot in replier(texte).split() if mot not in MOTS_GENERIQUES)} "
+
+
+def jitter_deterministe(graine, rayon):
+    "Décalage (dlat, dlon) dans [-rayon, rayon], toujours le même pour une graine donnée"
+    empreinte = hashlib.md5(str(graine).encode('utf-8')).digest()
+    u1 = int.from_bytes(empreinte[:8], 'big') / 2 ** 64
+    u2 = int.from_bytes(empreinte[8:], 'big') / 2 ** 64
+    return (2 * u1 - 1) * rayon, (2 * u2 - 1) * rayon
+
+
+class AhoCorasick:
+    "Automate multi-motifs ; rechercher() retourne les (debut, fin, valeur) de toutes les occurrences"
+
+    def __init__(self, motifs):
+        self._transitions = [{}]
+        self._echec = [0]
+        self._sorties = [[]]
+        for motif, valeur in motifs:
+            self._ajouter(motif, valeur)
+        self._compiler()
+
+    def _ajouter(self, motif, valeur):
+        etat = 0
+        for caractere in motif:
+            suivant = self._transitions[etat].get(caractere)
+            if suivant is None:
+                suivant = len(self._transitions)
+                self._transitions.append({})
+                self._echec.append(0)
+                self._sorties.append([])
+                self._transitions[etat][caractere] = suivant
+            etat = suivant
+        self._sorties[etat].append((len(motif), valeur))
+
+    def _compiler(self):
+        file = deque(self._transitions[0].values())
+        while file:
+            etat = file.popleft()
+            for caractere, suivant in self._transitions[etat].items():
+                file.append(suivant)
+                echec = self._echec[etat]
+                while echec and caractere not in self._transitions[echec]:
+                    echec = self._echec[echec]
+                self._echec[suivant] = self._transitions[echec].get(caractere, 0)
+                self._sorties[suivant] = self._sorties[suivant] + self._sorties[self._echec[suivant]]
+
+    def rechercher(self, texte):
+        etat = 0
+        for position, caractere in enumerate(texte):
+            while etat and caractere not in self._transitions[etat]:
+                etat = self._echec[etat]
+            etat = self._transitions[etat].get(caractere, 0)
+            for longueur, valeur in self._sorties[etat]:
+                yield position + 1 - longueur, position + 1, valeur
+
+
+class Gazetteer:
+    "Quartiers connus : recherche du quartier d'une adresse et position (avec décalage stable)"
+
+    def __init__(self, quartiers):
+        self.quartiers = quartiers
+        motifs = []
+        for quartier in quartiers:
+            for alias in dict.fromkeys([quartier['nom']] + quartier.get('alias', [])):
+                motif = cle_recherche(alias)
+                if motif.strip():
+                    motifs.append((motif, quartier))
+        self._automate = AhoCorasick(motifs)
+
+    @classmethod
+    def charger(cls, chemin=None):
+        with open(chemin or FICHIER_DEFAUT, encoding='utf-8') as f:
+            return cls(json.load(f)['quartiers'])
+
+    def correspondance(self, adresse):
+        """Meilleure correspondance (alias le plus long, puis le plus à gauche) : (debut, fin, quartier) ou None.
+
+        Les positions portent sur cle_recherche(adresse).
+        """
+        meilleur = None
+        for debut, fin, quartier in self._automate.rechercher(cle_recherche(adresse)):
+            cle = (fin - debut, -debut)
+            if meilleur is None or cle > meilleur[0]:
+                meilleur = (cle, (debut, fin, quartier))
+        return meilleur[1] if meilleur else None
+
+    def rechercher(self, adresse):
+        "Quartier correspondant à l'adresse ou None"
+        trouve = self.correspondance(adresse)
+        return trouve[2] if trouve else None
+
+    def localiser(self, adresse, graine=None, rayon=0.002):
+        """Position du quartier de l'adresse, décalée de façon stable pour la graine (id agent, adresse...).
+
+        Retourne None si aucun quartier géolocalisé ne correspond.
+        """
+        quartier = self.rechercher(adresse)
+        if quartier is None or quartier.get('latitude') is None:
+            return None
+        dlat, dlon = jitter_deterministe(graine if graine is not None else replier(adresse), rayon) if rayon else (0, 0)
+        return {
+            'latitude': quartier['latitude'] + dlat,
+            'longitude': quartier['longitude'] + dlon,
+            'quartier': quartier['nom'],
+            'adresse': quartier['adresse'],
+        }
+
+
+_gazetteer = None
+_verrou = threading.Lock()
+
+
+def gazetteer():
+    "Gazetteer partagé, chargé au premier appel (fichier GAZETTEER_FICHIER ou jeu de données fourni)"
+    global _gazetteer
+    with _verrou:
+        if _gazetteer is None:
+            _gazetteer = Gazetteer.charger(getattr(settings, 'GAZETTEER_FICHIER', None))
+        return _gazetteer
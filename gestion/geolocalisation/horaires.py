@@ -0,0 +1,222 @@
+# Horaires de passage d'une course
+# Ramassage : Course.heure est le début du poste, une heure d'arrivée
+# impérative au site (point de départ fixe). On remonte le temps depuis
+# l'arrivée (moins une marge) : trajet jusqu'au site, temps d'arrêt à chaque
+# adresse, trajet depuis l'arrêt précédent... ce qui donne l'heure de prise
+# en charge de chaque agent et l'heure de départ du chauffeur.
+# L'itinéraire optimisé est un chemin ouvert qui part du site ; le ramassage
+# le parcourt à l'envers (arrêt le plus éloigné d'abord, fin au site).
+# Départ : le véhicule quitte le site après la fin du poste (plus une marge) ;
+# on avance dans l'itinéraire pour estimer l'heure de dépose de chaque agent.
+# L'heure d'un départ est la fin du poste ramenée sur 0-23h, à la date du
+# poste : pour un poste de nuit (fin à 24h ou plus), elle tombe le lendemain.
+# Les durées viennent de la matrice routière (mode 'routier', trajets en
+# cache) ou sont estimées à 40 km/h. Une course est signalée non réalisable
+# quand un agent reste à bord plus de trajet_max_minutes, ou quand elle
+# commence avant la fin de la course précédente du même chauffeur.
+
+from datetime import datetime, time as heure_du_jour, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .distances import matrice_points, mode_distance_defaut
+from .matrices import VITESSE_ESTIMATION, matrice_routiere
+
+PARAMETRES_DEFAUT = {
+    'arret_minutes': 2,            # temps d'arrêt par adresse (montée / descente des agents)
+    'marge_arrivee_minutes': 5,    # ramassage : arrivée au site avant le début du poste
+    'marge_depart_minutes': 5,     # départ : sortie du site après la fin du poste
+    'trajet_max_minutes': 60,      # temps à bord maximum d'un agent
+    'heure_max_fin_nuit': 7,       # départ sans shift connu : avant cette heure, fin d'un poste de nuit
+}
+
+
+def parametres_horaires():
+    return dict(PARAMETRES_DEFAUT, **getattr(settings, 'HORAIRES_COURSE', {}))
+
+
+def _format(moment):
+    return timezone.localtime(moment).strftime('%H:%M')
+
+
+def matrice_durees(points, mode_distance=None):
+    "Matrice n x n des durées de trajet (s) entre des points {'latitude', 'longitude'}"
+    if (mode_distance or mode_distance_defaut()) == 'routier':
+        return matrice_routiere([(p['latitude'], p['longitude']) for p in points])['durees_s'], 'routier'
+    return matrice_points(points, mode_distance) / VITESSE_ESTIMATION * 3600, 'estimation'
+
+
+def depart_de_nuit(type_transport, date_reelle, heure, agent_ids=()):
+    "Départ en fin de poste de nuit : l'heure de la course (0-23h) tombe le lendemain de date_reelle"
+    if type_transport != 'depart':
+        return False
+    from gestion.models import PlanningShift
+    fins = list(PlanningShift.objects.filter(
+        agent_id__in=list(agent_ids), date_reelle=date_reelle, heure_depart=heure
+    ).values_list('heure_fin', flat=True)) if agent_ids else []
+    if fins:
+        return max(fins) >= 24
+    return heure < parametres_horaires()['heure_max_fin_nuit']
+
+
+def heure_reference(date_reelle, heure, nuit=False):
+    "Début (ramassage) ou fin (départ) du poste : date de la course (lendemain si nuit) à Course.heure"
+    return timezone.make_aware(
+        datetime.combine(date_reelle, heure_du_jour()) + timedelta(days=1 if nuit else 0, hours=heure)
+    )
+
+
+def planifier_horaires(itineraire, type_transport, date_reelle, heure, mode_distance=None, nuit=None):
+    """Horaires de passage d'un itinéraire (le premier point est le site / point de départ fixe).
+
+    nuit : départ en fin de poste de nuit (None : déduit des shifts des agents, voir depart_de_nuit).
+    Retourne l'heure de départ du chauffeur, les arrêts dans l'ordre de passage avec leur heure
+    (prise en charge ou dépose) et le temps à bord, et les alertes (course non réalisable).
+    """
+    parametres = parametres_horaires()
+    arret = timedelta(minutes=parametres['arret_minutes'])
+    if nuit is None:
+        agent_ids = [a['agent_id'] for point in itineraire[1:] for a in point.get('agents', [])] \
+            or [point['agent_id'] for point in itineraire[1:] if point.get('agent_id')]
+        nuit = depart_de_nuit(type_transport, date_reelle, heure, agent_ids)
+    reference = heure_reference(date_reelle, heure, nuit)
+    durees, source_durees = matrice_durees(itineraire, mode_distance)
+
+    def trajet(i, j):
+        return timedelta(seconds=float(durees[i, j]))
+
+    # Ordre de passage (indices dans l'itinéraire) ; 0 : le site
+    ramassage = type_transport == 'ramassage'
+    ordre = list(range(len(itineraire) - 1, 0, -1)) if ramassage else list(range(1, len(itineraire)))
+    passages = {}
+    if ramassage:
+        arrivee_site = reference - timedelta(minutes=parametres['marge_arrivee_minutes'])
+        suivant, moment = 0, arrivee_site
+        for indice in reversed(ordre):
+            moment = moment - trajet(indice, suivant) - arret
+            passages[indice] = moment
+            suivant = indice
+        depart_chauffeur = moment - trajet(0, ordre[0]) if ordre else arrivee_site
+        fin = arrivee_site
+    else:
+        depart_chauffeur = reference + timedelta(minutes=parametres['marge_depart_minutes'])
+        precedent, moment = 0, depart_chauffeur
+        for indice in ordre:
+            moment = moment + trajet(precedent, indice)
+            passages[indice] = moment
+            moment = moment + arret
+            precedent = indice
+        fin = moment
+
+    arrets = []
+    alertes = []
+    for rang, indice in enumerate(ordre, start=1):
+        point = itineraire[indice]
+        passage = passages[indice]
+        a_bord = (fin - passage) if ramassage else (passage - depart_chauffeur)
+        a_bord_minutes = round(a_bord.total_seconds() / 60, 1)
+        if a_bord_minutes > parametres['trajet_max_minutes']:
+            alertes.append(f"{point.get('nom', 'Arrêt')}: {a_bord_minutes:.0f} min à bord "
+                           f"(maximum {parametres['trajet_max_minutes']} min)")
+        arrets.append({
+            'ordre_passage': rang,
+            'nom': point.get('nom'),
+            'arret': point.get('arret'),
+            'agents': [{'agent_id': a['agent_id'], 'nom': a['nom']} for a in point.get('agents', [])]
+                      or [{'agent_id': point.get('agent_id'), 'nom': point.get('nom')}],
+            'heure': _format(passage),
+            'horodatage': passage.isoformat(),
+            'temps_a_bord_minutes': a_bord_minutes,
+        })
+
+    return {
+        'type_transport': type_transport,
+        'heure_poste': _format(reference),
+        'date_poste': timezone.localtime(reference).date().isoformat(),
+        'poste_de_nuit': nuit,
+        'heure_depart_chauffeur': _format(depart_chauffeur),
+        'horodatage_depart_chauffeur': depart_chauffeur.isoformat(),
+        'heure_fin': _format(fin),
+        'horodatage_fin': fin.isoformat(),
+        'duree_minutes': round((fin - depart_chauffeur).total_seconds() / 60, 1),
+        'arrets': arrets,
+        'realisable': not alertes,
+        'alertes': alertes,
+        'source_durees': source_durees,
+        'parametres': parametres,
+    }
+
+
+def horaires_par_agent(horaires):
+    "{agent_id: arrêt} pour reporter les heures de passage sur les agents"
+    return {agent['agent_id']: arret for arret in horaires['arrets'] for agent in arret['agents']}
+
+
+def horaires_course(course, geo_manager=None, affectations=None, mode_distance=None):
+    """Horaires d'une course à partir des positions connues de ses agents (sans géocodage).
+
+    affectations : celles de la course si déjà chargées (avec leur agent) ; mode_distance : voir
+    optimiser_itineraire ('haversine' pour une liste, sans appel au service de routage).
+    Les agents sans coordonnées sont listés dans 'agents_sans_position', sans heure de passage.
+    """
+    from gestion.models import Affectation
+
+    from .repartition import depot_par_defaut
+    from .utils import geolocalisation_manager
+
+    geo_manager = geo_manager or geolocalisation_manager
+    latitude_defaut, longitude_defaut = depot_par_defaut()
+    site = {
+        'nom': course.point_depart_adresse or 'Point de départ',
+        'latitude': course.point_depart_latitude or latitude_defaut,
+        'longitude': course.point_depart_longitude or longitude_defaut,
+    }
+    # Un arrêt par adresse, comme sur la carte de la course
+    groupes = {}
+    sans_position = []
+    if affectations is None:
+        affectations = Affectation.objects.filter(course=course).select_related('agent')
+    agents_course = [affectation.agent for affectation in affectations]
+    for agent in agents_course:
+        if agent.latitude is None or agent.longitude is None:
+            sans_position.append({'agent_id': agent.id, 'nom': agent.nom})
+            continue
+        groupes.setdefault(agent.adresse_normalisee or f"agent:{agent.id}", []).append(agent)
+    arrets = [{
+        'nom': ' / '.join(agent.nom for agent in agents),
+        'arret': cle_arret,
+        'latitude': agents[0].latitude,
+        'longitude': agents[0].longitude,
+        'agents': [{'agent_id': agent.id, 'nom': agent.nom} for agent in agents],
+    } for cle_arret, agents in groupes.items()]
+
+    itineraire = geo_manager.optimiser_itineraire(arrets, mode_distance=mode_distance, depart=site)['itineraire'] \
+        if arrets else [site]
+    nuit = depart_de_nuit(course.type_transport, course.date_reelle, course.heure, [agent.id for agent in agents_course])
+    horaires = planifier_horaires(itineraire, course.type_transport, course.date_reelle, course.heure,
+                                  mode_distance=mode_distance, nuit=nuit)
+    horaires['agents_sans_position'] = sans_position
+    if sans_position:
+        horaires['alertes'].append(f"{len(sans_position)} agent(s) sans position : horaires incomplets")
+    return horaires
+
+
+def verifier_enchainement(horaires_courses):
+    """Alerte les courses d'un chauffeur qui commencent avant la fin d'une course précédente ([(course, horaires)]).
+
+    Les courses sont comparées dans l'ordre des horaires (un départ de nuit passe après les courses du soir).
+    """
+    precedente = None
+    for course, horaires in sorted(horaires_courses, key=lambda c: datetime.fromisoformat(c[1]['horodatage_depart_chauffeur'])):
+        debut = datetime.fromisoformat(horaires['horodatage_depart_chauffeur'])
+        if precedente is not None and debut < datetime.fromisoformat(precedente[1]['horodatage_fin']):
+            horaires['realisable'] = False
+            horaires['alertes'].append(
+                f"Départ à {horaires['heure_depart_chauffeur']} avant la fin de la course "
+                f"{precedente[0].id} ({precedente[1]['heure_fin']})"
+            )
+        # Course qui finit le plus tard parmi les précédentes
+        if precedente is None or datetime.fromisoformat(horaires['horodatage_fin']) > \
+                datetime.fromisoformat(precedente[1]['horodatage_fin']):
+            precedente = (course, horaires)
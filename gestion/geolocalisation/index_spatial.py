@@ -0,0 +1,253 @@
+# Index spatial des agents
+# Deux niveaux :
+#   - Agent.geohash (colonne indexée) : recherche par préfixe en base, utile
+#     sans index mémoire (agents_proches_base) ;
+#   - IndexAgents : grille régulière en mémoire (tableaux numpy triés par
+#     cellule) sur les agents géolocalisés, pour les requêtes "agents à moins
+#     de X km" et "k plus proches" en quelques millisecondes sur des dizaines
+#     de milliers d'agents.
+# L'index est reconstruit à la demande quand des coordonnées ont changé :
+# Agent.save() et les écritures du géocodage en arrière-plan appellent
+# invalider_index_agents(), qui touche un fichier de version partagé par tous
+# les processus (même dossier que les limiteurs de débit).
+
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .limites import dossier_limites
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION_GEOHASH = 9  # cellule d'environ 5 m x 5 m
+
+RAYON_TERRE_KM = 6371.0
+KM_PAR_DEGRE = math.pi * RAYON_TERRE_KM / 180
+
+# Côté d'une cellule de la grille mémoire, en degrés (~1,1 km en latitude à Sousse)
+TAILLE_CELLULE_DEFAUT = 0.01
+
+
+def encoder_geohash(latitude, longitude, precision=PRECISION_GEOHASH):
+    "Geohash de la position ('' si elle est incomplète)"
+    if latitude is None or longitude is None:
+        return ''
+    intervalle_lat = [-90.0, 90.0]
+    intervalle_lon = [-180.0, 180.0]
+    caracteres = []
+    bits = 0
+    nb_bits = 0
+    longitude_suivante = True
+    while len(caracteres) < precision:
+        intervalle, valeur = (intervalle_lon, longitude) if longitude_suivante else (intervalle_lat, latitude)
+        milieu = (intervalle[0] + intervalle[1]) / 2
+        bits <<= 1
+        if valeur >= milieu:
+            bits |= 1
+            intervalle[0] = milieu
+        else:
+            intervalle[1] = milieu
+        longitude_suivante = not longitude_suivante
+        nb_bits += 1
+        if nb_bits == 5:
+            caracteres.append(BASE32[bits])
+            bits = 0
+            nb_bits = 0
+    return ''.join(caracteres)
+
+
+def _dimensions_cellule_geohash(precision):
+    "Hauteur et largeur (degrés) d'une cellule geohash de la précision donnée"
+    bits_lon = math.ceil(5 * precision / 2)
+    bits_lat = math.floor(5 * precision / 2)
+    return 180.0 / 2 ** bits_lat, 360.0 / 2 ** bits_lon
+
+
+def prefixes_voisins(latitude, longitude, rayon_km):
+    "Préfixes geohash (cellule du point et ses 8 voisines) couvrant le cercle de rayon rayon_km"
+    precision = 1
+    for candidate in range(PRECISION_GEOHASH, 0, -1):
+        hauteur, largeur = _dimensions_cellule_geohash(candidate)
+        if (hauteur * KM_PAR_DEGRE >= rayon_km
+                and largeur * KM_PAR_DEGRE * math.cos(math.radians(latitude)) >= rayon_km):
+            precision = candidate
+            break
+    hauteur, largeur = _dimensions_cellule_geohash(precision)
+    return sorted({
+        encoder_geohash(latitude + dlat * hauteur, longitude + dlon * largeur, precision)
+        for dlat in (-1, 0, 1) for dlon in (-1, 0, 1)
+    })
+
+
+def distances_km(latitude, longitude, latitudes, longitudes):
+    "Distances haversine (km) entre un point et des tableaux de positions"
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - math.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class IndexAgents:
+    "Grille en mémoire sur les positions des agents : requêtes par rayon et k plus proches"
+
+    def __init__(self, ids, latitudes, longitudes, taille_cellule=TAILLE_CELLULE_DEFAUT):
+        self.taille_cellule = taille_cellule
+        lignes = np.floor(np.asarray(latitudes, dtype=np.float64) / taille_cellule).astype(np.int64)
+        colonnes = np.floor(np.asarray(longitudes, dtype=np.float64) / taille_cellule).astype(np.int64)
+        # Tri par cellule : chaque cellule devient une tranche contiguë des tableaux
+        ordre = np.lexsort((colonnes, lignes))
+        self.ids = np.asarray(ids, dtype=np.int64)[ordre]
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)[ordre]
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)[ordre]
+        lignes, colonnes = lignes[ordre], colonnes[ordre]
+        self.cellules = {}
+        if len(self.ids):
+            debuts = np.flatnonzero(np.r_[True, (lignes[1:] != lignes[:-1]) | (colonnes[1:] != colonnes[:-1])])
+            fins = np.r_[debuts[1:], len(self.ids)]
+            for debut, fin in zip(debuts, fins):
+                self.cellules[(int(lignes[debut]), int(colonnes[debut]))] = (int(debut), int(fin))
+            self._lignes = (int(lignes.min()), int(lignes.max()))
+            self._colonnes = (int(colonnes.min()), int(colonnes.max()))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidats(self, ligne, colonne, demi_largeur_lignes, demi_largeur_colonnes):
+        "Indices des agents dans le carré de cellules autour de (ligne, colonne)"
+        lignes = range(max(ligne - demi_largeur_lignes, self._lignes[0]), min(ligne + demi_largeur_lignes, self._lignes[1]) + 1)
+        colonnes = range(max(colonne - demi_largeur_colonnes, self._colonnes[0]), min(colonne + demi_largeur_colonnes, self._colonnes[1]) + 1)
+        if len(lignes) * len(colonnes) <= len(self.cellules):
+            tranches = [self.cellules.get((i, j)) for i in lignes for j in colonnes]
+        else:
+            # Carré plus grand que la grille occupée : parcourir les cellules non vides
+            tranches = [tranche for (i, j), tranche in self.cellules.items() if i in lignes and j in colonnes]
+        tranches = [np.arange(*tranche) for tranche in tranches if tranche]
+        return np.concatenate(tranches) if tranches else np.empty(0, dtype=np.int64)
+
+    def _filtrer(self, indices, exclure):
+        if exclure:
+            indices = indices[~np.isin(self.ids[indices], np.fromiter(exclure, dtype=np.int64))]
+        return indices
+
+    def _cellules_pour(self, latitude, rayon_km):
+        "Nombre de cellules (lignes, colonnes) à parcourir de chaque côté pour couvrir rayon_km"
+        km_ligne = self.taille_cellule * KM_PAR_DEGRE
+        km_colonne = km_ligne * max(math.cos(math.radians(latitude)), 1e-6)
+        return int(math.ceil(rayon_km / km_ligne)), int(math.ceil(rayon_km / km_colonne))
+
+    def rayon(self, latitude, longitude, rayon_km, exclure=None):
+        "Agents à moins de rayon_km du point : liste de (id, distance_km) triée par distance"
+        if not len(self.ids):
+            return []
+        ligne = int(math.floor(latitude / self.taille_cellule))
+        colonne = int(math.floor(longitude / self.taille_cellule))
+        indices = self._filtrer(self._candidats(ligne, colonne, *self._cellules_pour(latitude, rayon_km)), exclure)
+        distances = distances_km(latitude, longitude, self.latitudes[indices], self.longitudes[indices])
+        garde = distances <= rayon_km
+        indices, distances = indices[garde], distances[garde]
+        ordre = np.argsort(distances, kind='stable')
+        return [(int(self.ids[i]), float(d)) for i, d in zip(indices[ordre], distances[ordre])]
+
+    def plus_proches(self, latitude, longitude, k, rayon_max_km=None, exclure=None):
+        "k agents les plus proches (éventuellement limités à rayon_max_km) : liste de (id, distance_km)"
+        if not len(self.ids) or k <= 0:
+            return []
+        ligne = int(math.floor(latitude / self.taille_cellule))
+        colonne = int(math.floor(longitude / self.taille_cellule))
+        km_cellule = self.taille_cellule * KM_PAR_DEGRE * max(math.cos(math.radians(latitude)), 1e-6)
+        etendue = max(self._lignes[1] - self._lignes[0], self._colonnes[1] - self._colonnes[0],
+                      abs(ligne - self._lignes[0]), abs(ligne - self._lignes[1]),
+                      abs(colonne - self._colonnes[0]), abs(colonne - self._colonnes[1])) + 1
+        anneau = 1
+        while True:
+            # Le carré de demi-largeur "anneau" cellules contient tout point à moins de anneau * km_cellule
+            indices = self._filtrer(self._candidats(ligne, colonne, anneau, anneau), exclure)
+            distances = distances_km(latitude, longitude, self.latitudes[indices], self.longitudes[indices])
+            couvert_km = anneau * km_cellule
+            complet = anneau >= etendue or (rayon_max_km is not None and couvert_km >= rayon_max_km)
+            if len(indices) >= k:
+                kieme = np.partition(distances, k - 1)[k - 1]
+                if kieme <= couvert_km:
+                    complet = True
+            if complet:
+                break
+            anneau *= 2
+        if rayon_max_km is not None:
+            garde = distances <= rayon_max_km
+            indices, distances = indices[garde], distances[garde]
+        ordre = np.argsort(distances, kind='stable')[:k]
+        return [(int(self.ids[i]), float(distances[i])) for i in ordre]
+
+
+def fichier_version():
+    return os.path.join(dossier_limites(), 'index_agents.version')
+
+
+def _version_partagee():
+    try:
+        return os.stat(fichier_version()).st_mtime_ns
+    except OSError:
+        return None
+
+
+_index = None
+_version_index = None
+_version_locale = 0
+_verrou = threading.Lock()
+
+
+def invalider_index_agents():
+    "Signale un changement de coordonnées : l'index sera reconstruit à la prochaine requête, dans chaque processus"
+    global _version_locale
+    with _verrou:
+        _version_locale += 1
+    try:
+        os.makedirs(dossier_limites(), exist_ok=True)
+        with open(fichier_version(), 'a'):
+            pass
+        os.utime(fichier_version(), ns=(time.time_ns(), time.time_ns()))
+    except OSError as e:
+        print(f"⚠️ Index agents: version partagée non mise à jour ({e})")
+
+
+def index_agents():
+    "Index des agents géolocalisés, reconstruit si des coordonnées ont changé depuis sa construction"
+    global _index, _version_index
+    from gestion.models import Agent
+
+    version = (_version_locale, _version_partagee())
+    with _verrou:
+        if _index is not None and _version_index == version:
+            return _index
+        debut = time.perf_counter()
+        lignes = list(Agent.objects.filter(latitude__isnull=False, longitude__isnull=False)
+                      .values_list('id', 'latitude', 'longitude'))
+        ids, latitudes, longitudes = zip(*lignes) if lignes else ((), (), ())
+        _index = IndexAgents(ids, latitudes, longitudes,
+                             getattr(settings, 'INDEX_AGENTS_TAILLE_CELLULE', TAILLE_CELLULE_DEFAUT))
+        _version_index = version
+        print(f"🧭 Index agents reconstruit: {len(_index)} agent(s) en {(time.perf_counter() - debut) * 1000:.0f} ms")
+        return _index
+
+
+def agents_proches_base(latitude, longitude, rayon_km, exclure=None):
+    "Comme IndexAgents.rayon, mais en base via les préfixes geohash (sans index mémoire)"
+    from django.db.models import Q
+    from gestion.models import Agent
+
+    filtre = Q()
+    for prefixe in prefixes_voisins(latitude, longitude, rayon_km):
+        filtre |= Q(geohash__startswith=prefixe)
+    lignes = [ligne for ligne in Agent.objects.filter(filtre, latitude__isnull=False, longitude__isnull=False)
+              .values_list('id', 'latitude', 'longitude') if not exclure or ligne[0] not in exclure]
+    if not lignes:
+        return []
+    ids, latitudes, longitudes = (np.asarray(colonne) for colonne in zip(*lignes))
+    distances = distances_km(latitude, longitude, latitudes.astype(np.float64), longitudes.astype(np.float64))
+    ordre = np.argsort(distances, kind='stable')
+    return [(int(ids[i]), float(distances[i])) for i in ordre if distances[i] <= rayon_km]
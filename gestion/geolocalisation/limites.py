@@ -0,0 +1,163 @@
+# Limitation du débit des appels externes (géocodage, routage)
+# Le débit est partagé entre tous les threads et tous les processus de la
+# machine : l'état de chaque fournisseur (prochain créneau libre + métriques)
+# est stocké dans un petit fichier JSON protégé par un verrou fcntl. Chaque
+# appel réserve le prochain créneau sous le verrou puis attend hors verrou,
+# ce qui espace les requêtes de 1/débit secondes quel que soit le worker.
+# Sans fcntl (Windows) ou si le dossier n'est pas accessible, on retombe sur
+# un état en mémoire, partagé seulement par les threads du processus.
+
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Requêtes par seconde autorisées par fournisseur (Nominatim et le serveur OSRM de démo : 1 req/s)
+DEBITS_DEFAUT = {
+    'nominatim': 1.0,
+    'positionstack': 2.0,
+    'osrm': 1.0,
+}
+
+ETAT_INITIAL = {'prochain': 0.0, 'appels': 0, 'attente_totale': 0.0, 'attente_max': 0.0}
+
+
+def debit_fournisseur(fournisseur):
+    debits = dict(DEBITS_DEFAUT, **getattr(settings, 'GEOCODAGE_DEBITS', {}))
+    return debits.get(fournisseur, 1.0)
+
+
+def dossier_limites():
+    return getattr(settings, 'GEOCODAGE_DOSSIER_LIMITES', os.path.join(settings.BASE_DIR, 'rate_limits'))
+
+
+class LimiteurPartage:
+    "Limiteur de débit d'un fournisseur, partagé entre processus via un fichier verrouillé"
+
+    def __init__(self, fournisseur, debit=None, dossier=None):
+        self.fournisseur = fournisseur
+        self.debit = debit or debit_fournisseur(fournisseur)
+        self.chemin = os.path.join(dossier or dossier_limites(), f"{fournisseur}.json")
+        self._verrou = threading.Lock()
+        self._etat_local = dict(ETAT_INITIAL)
+        self._partage = fcntl is not None
+        if self._partage:
+            try:
+                os.makedirs(os.path.dirname(self.chemin), exist_ok=True)
+            except OSError as e:
+                print(f"⚠️ Limiteur {fournisseur}: dossier inaccessible ({e}), limitation par processus")
+                self._partage = False
+
+    def _reserver(self, etat, attente_max=None):
+        "Réserve le prochain créneau dans l'état ; retourne l'attente nécessaire (None si elle dépasse attente_max)"
+        maintenant = time.time()
+        creneau = max(maintenant, etat['prochain'])
+        attente = creneau - maintenant
+        if attente_max is not None and attente > attente_max:
+            return None
+        etat['prochain'] = creneau + 1.0 / self.debit
+        etat['appels'] += 1
+        etat['attente_totale'] += attente
+        etat['attente_max'] = max(etat['attente_max'], attente)
+        return attente
+
+    def _reserver_fichier(self, attente_max=None):
+        with open(self.chemin, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                contenu = f.read()
+                try:
+                    etat = dict(ETAT_INITIAL, **json.loads(contenu)) if contenu else dict(ETAT_INITIAL)
+                except ValueError:
+                    etat = dict(ETAT_INITIAL)
+                attente = self._reserver(etat, attente_max)
+                if attente is not None:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(etat))
+                    f.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return attente
+
+    def acquerir(self, attente_max=None):
+        """Bloque jusqu'au créneau réservé ; retourne le temps attendu en secondes.
+
+        Si le prochain créneau est à plus de attente_max secondes, rien n'est réservé et None est retourné.
+        """
+        if self._partage:
+            try:
+                attente = self._reserver_fichier(attente_max)
+            except OSError as e:
+                print(f"⚠️ Limiteur {self.fournisseur}: fichier inaccessible ({e}), limitation par processus")
+                self._partage = False
+        if not self._partage:
+            with self._verrou:
+                attente = self._reserver(self._etat_local, attente_max)
+        if attente is None:
+            return None
+        if attente > 0:
+            time.sleep(attente)
+        return attente
+
+    def metriques(self):
+        "Compteurs cumulés (tous processus si le fichier partagé est utilisé)"
+        etat = self._etat_local
+        if self._partage:
+            try:
+                with open(self.chemin, encoding='utf-8') as f:
+                    etat = dict(ETAT_INITIAL, **json.loads(f.read() or '{}'))
+            except (OSError, ValueError):
+                etat = dict(ETAT_INITIAL)
+        appels = etat['appels']
+        return {
+            'fournisseur': self.fournisseur,
+            'debit_max': self.debit,
+            'partage_entre_processus': self._partage,
+            'appels': appels,
+            'attente_totale_s': round(etat['attente_totale'], 3),
+            'attente_moyenne_s': round(etat['attente_totale'] / appels, 3) if appels else 0,
+            'attente_max_s': round(etat['attente_max'], 3),
+        }
+
+
+_limiteurs = {}
+_verrou_limiteurs = threading.Lock()
+
+
+def limiteur_fournisseur(fournisseur):
+    "Limiteur du fournisseur (créé au premier appel avec le débit configuré)"
+    with _verrou_limiteurs:
+        if fournisseur not in _limiteurs:
+            _limiteurs[fournisseur] = LimiteurPartage(fournisseur)
+        return _limiteurs[fournisseur]
+
+
+def reinitialiser_limiteurs():
+    "Oublie les limiteurs créés (ils seront recréés avec les settings courants)"
+    with _verrou_limiteurs:
+        _limiteurs.clear()
+
+
+def attendre_fournisseur(fournisseur, attente_max=None):
+    "À appeler juste avant chaque requête HTTP vers un fournisseur ; None si le créneau est trop loin (attente_max)"
+    attente = limiteur_fournisseur(fournisseur).acquerir(attente_max)
+    if attente is None:
+        print(f"⏳ Rate limiting {fournisseur}: prochain créneau au-delà de {attente_max:.2f}s, requête abandonnée")
+        return None
+    if attente > 0.05:
+        print(f"⏳ Rate limiting {fournisseur}: attente de {attente:.2f}s")
+    return attente
+
+
+def metriques_limiteurs():
+    "Métriques d'attente de tous les fournisseurs connus"
+    return [limiteur_fournisseur(fournisseur).metriques() for fournisseur in DEBITS_DEFAUT]
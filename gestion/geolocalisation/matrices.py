@@ -0,0 +1,170 @@
+# Matrice des distances et durées routières (service OSRM /table)
+# Une requête /table donne toutes les paires d'un ensemble de points, au lieu
+# d'un appel /route par paire. Les résultats sont gardés en base (TrajetCache)
+# par paire de cellules geohash : une position déjà vue (même agent, même
+# immeuble) n'est plus jamais redemandée. Au-delà de ROUTAGE_TAILLE_TABLE
+# points, la matrice est demandée par blocs (sources x destinations).
+# Le service passe par le fournisseur externe (http ou rejeu), le limiteur de
+# débit et le disjoncteur 'osrm' ; si le service est indisponible ou le budget
+# épuisé, les paires manquantes sont estimées (haversine, 40 km/h), sans être
+# mises en cache.
+
+import time
+
+import numpy as np
+import requests
+from django.conf import settings
+
+from .disjoncteurs import disjoncteur
+from .distances import matrice_distances
+from .fournisseurs import fournisseur_externe
+from .index_spatial import encoder_geohash
+from .limites import attendre_fournisseur
+from .models import TrajetCache
+
+PRECISION_GEOHASH_DEFAUT = 8   # cellule d'environ 38 m x 19 m
+TAILLE_TABLE_DEFAUT = 100      # coordonnées par requête (max-table-size par défaut d'OSRM)
+BUDGET_DEFAUT = 3.0            # secondes pour toutes les requêtes d'une matrice
+VITESSE_ESTIMATION = 40        # km/h, paires sans réponse du service
+TIMEOUT_OSRM = 5
+
+
+def _parametre(nom, defaut):
+    return getattr(settings, nom, defaut)
+
+
+def _blocs(indices, taille):
+    return [indices[debut:debut + taille] for debut in range(0, len(indices), taille)]
+
+
+def _interroger_table(positions, sources, destinations, profil, echeance):
+    """Une requête /table sur positions[sources] x positions[destinations].
+
+    Retourne (distances_km, durees_s) (None pour une paire sans route) ou None si le service n'a pas répondu.
+    """
+    disjoncteur_osrm = disjoncteur('osrm')
+    restant = echeance - time.monotonic()
+    if restant < 0.5:
+        print("  ⏱️  OSRM table: budget épuisé, estimation")
+        return None
+    if not disjoncteur_osrm.autoriser():
+        print("  ⛔ OSRM table: disjoncteur ouvert, estimation")
+        return None
+
+    points = list(dict.fromkeys(list(sources) + list(destinations)))
+    rang = {indice: i for i, indice in enumerate(points)}
+    coordonnees = ';'.join(f"{positions[i][1]},{positions[i][0]}" for i in points)
+    url = f"{_parametre('OSRM_BASE_URL', 'http://router.project-osrm.org')}/table/v1/{profil}/{coordonnees}"
+    params = {
+        'sources': ';'.join(str(rang[i]) for i in sources),
+        'destinations': ';'.join(str(rang[i]) for i in destinations),
+        'annotations': 'duration,distance',
+    }
+    try:
+        if attendre_fournisseur('osrm', max(restant - 0.5, 0)) is None:
+            disjoncteur_osrm.abandonner()
+            return None
+        timeout = max(min(TIMEOUT_OSRM, echeance - time.monotonic()), 0.1)
+        response = fournisseur_externe().get('osrm', url, params=params, timeout=timeout)
+        if response.status_code != 200:
+            print(f"  ❌ OSRM table: erreur HTTP {response.status_code}")
+            disjoncteur_osrm.echec()
+            return None
+        data = response.json()
+        if data.get('code') != 'Ok' or 'durations' not in data:
+            # Requête refusée (trop de points, coordonnées invalides) : le service répond, pas d'échec
+            print(f"  ❌ OSRM table: {data.get('code')} {data.get('message', '')}")
+            disjoncteur_osrm.succes()
+            return None
+        disjoncteur_osrm.succes()
+        distances = data.get('distances')
+        if distances is None:
+            print("  ⚠️  OSRM table: pas de distances (annotations non supportées), estimation")
+            return None
+        return (
+            [[d / 1000 if d is not None else None for d in ligne] for ligne in distances],
+            data['durations'],
+        )
+    except requests.exceptions.Timeout:
+        print("  ⏱️  OSRM table: timeout")
+        disjoncteur_osrm.echec()
+    except Exception as e:
+        print(f"  ❌ OSRM table erreur: {e}")
+        disjoncteur_osrm.echec()
+    return None
+
+
+def matrice_routiere(positions, profil='driving', budget=None):
+    """Distances (km) et durées (s) routières entre toutes les positions [(lat, lon), ...].
+
+    Retourne {'distances_km', 'durees_s' (tableaux n x n), 'sources': {'cache', 'osrm', 'estimation'} (paires)}.
+    """
+    debut = time.perf_counter()
+    echeance = time.monotonic() + (budget if budget is not None else _parametre('ROUTAGE_BUDGET', BUDGET_DEFAUT))
+    precision = _parametre('ROUTAGE_PRECISION_GEOHASH', PRECISION_GEOHASH_DEFAUT)
+    geohashes = [encoder_geohash(lat, lon, precision) for lat, lon in positions]
+    cellules = list(dict.fromkeys(geohashes))
+    rang = {cellule: i for i, cellule in enumerate(cellules)}
+    # Une position représentative par cellule
+    representants = {}
+    for position, cellule in zip(positions, geohashes):
+        representants.setdefault(cellule, position)
+    points = [representants[cellule] for cellule in cellules]
+
+    n = len(cellules)
+    distances = np.full((n, n), np.nan)
+    durees = np.full((n, n), np.nan)
+    np.fill_diagonal(distances, 0)
+    np.fill_diagonal(durees, 0)
+    sources = {'cache': 0, 'osrm': 0, 'estimation': 0}
+
+    # 1. Paires déjà connues
+    if n > 1:
+        for origine, destination, distance_km, duree_s in TrajetCache.objects.filter(
+            profil=profil, origine__in=cellules, destination__in=cellules
+        ).values_list('origine', 'destination', 'distance_km', 'duree_s'):
+            distances[rang[origine], rang[destination]] = distance_km
+            durees[rang[origine], rang[destination]] = duree_s
+    manquantes = np.isnan(distances)
+    sources['cache'] = n * (n - 1) - int(manquantes.sum())
+
+    # 2. Paires manquantes : requêtes /table par blocs
+    if manquantes.any():
+        taille = max(_parametre('ROUTAGE_TAILLE_TABLE', TAILLE_TABLE_DEFAUT) // 2, 1)
+        lignes = [int(i) for i in np.flatnonzero(manquantes.any(axis=1))]
+        colonnes = [int(j) for j in np.flatnonzero(manquantes.any(axis=0))]
+        nouveaux = []
+        for bloc_sources in _blocs(lignes, taille):
+            for bloc_destinations in _blocs(colonnes, taille):
+                if not manquantes[np.ix_(bloc_sources, bloc_destinations)].any():
+                    continue
+                reponse = _interroger_table(points, bloc_sources, bloc_destinations, profil, echeance)
+                if reponse is None:
+                    continue
+                for i, ligne_distances, ligne_durees in zip(bloc_sources, *reponse):
+                    for j, distance_km, duree_s in zip(bloc_destinations, ligne_distances, ligne_durees):
+                        if i == j or distance_km is None or duree_s is None or not manquantes[i, j]:
+                            continue
+                        distances[i, j], durees[i, j] = distance_km, duree_s
+                        manquantes[i, j] = False
+                        sources['osrm'] += 1
+                        nouveaux.append(TrajetCache(profil=profil, origine=cellules[i], destination=cellules[j],
+                                                    distance_km=distance_km, duree_s=duree_s))
+        if nouveaux:
+            TrajetCache.objects.bulk_create(nouveaux, batch_size=500, ignore_conflicts=True)
+            print(f"  💾 {len(nouveaux)} trajet(s) mis en cache")
+
+    # 3. Service indisponible : estimation à vol d'oiseau
+    if manquantes.any():
+        estimation = matrice_distances([p[0] for p in points], [p[1] for p in points], 'precis')
+        distances[manquantes] = estimation[manquantes]
+        durees[manquantes] = estimation[manquantes] / VITESSE_ESTIMATION * 3600
+        sources['estimation'] = int(manquantes.sum())
+
+    indices = np.array([rang[cellule] for cellule in geohashes], dtype=np.int64)
+    print(f"🛣️  Matrice routière {len(positions)} point(s): {sources} en {(time.perf_counter() - debut) * 1000:.0f} ms")
+    return {
+        'distances_km': distances[np.ix_(indices, indices)],
+        'durees_s': durees[np.ix_(indices, indices)],
+        'sources': sources,
+    }
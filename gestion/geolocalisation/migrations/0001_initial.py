@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle', models.CharField(max_length=64, unique=True, verbose_name="Clé de l'adresse normalisée")),
+                ('adresse', models.TextField(verbose_name='Adresse normalisée')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('adresse_formatee', models.TextField(blank=True)),
+                ('source', models.CharField(db_index=True, max_length=50)),
+                ('confidence', models.FloatField(default=0)),
+                ('success', models.BooleanField(default=True)),
+                ('resultat', models.JSONField(default=dict, verbose_name='Résultat complet du géocodage')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('expire_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Cache géocodage',
+                'verbose_name_plural': 'Cache géocodage',
+                'ordering': ['-updated_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0017_planningimport'),
+        ('geolocalisation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodageAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('adresse', models.TextField(verbose_name='Adresse à géocoder')),
+                ('tentatives', models.PositiveIntegerField(default=0)),
+                ('prochaine_tentative', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('derniere_erreur', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('agent', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='geocodage_en_attente', to='gestion.agent')),
+            ],
+            options={
+                'verbose_name': 'Géocodage en attente',
+                'verbose_name_plural': 'Géocodages en attente',
+                'ordering': ['prochaine_tentative'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geolocalisation', '0002_geocodageagent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrajetCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profil', models.CharField(default='driving', max_length=20)),
+                ('origine', models.CharField(max_length=12, verbose_name="Geohash d'origine")),
+                ('destination', models.CharField(max_length=12, verbose_name='Geohash de destination')),
+                ('distance_km', models.FloatField()),
+                ('duree_s', models.FloatField(verbose_name='Durée (secondes)')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Cache trajet',
+                'verbose_name_plural': 'Cache trajets',
+                'unique_together': {('profil', 'origine', 'destination')},
+            },
+        ),
+    ]
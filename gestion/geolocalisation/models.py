@@ -0,0 +1,66 @@
+from django.db import models
+from django.utils import timezone
+
+
+class GeocodeCache(models.Model):
+    "Résultat de géocodage partagé par tous les workers (clé : adresse normalisée par nettoyer_adresse)"
+    cle = models.CharField(max_length=64, unique=True, verbose_name="Clé de l'adresse normalisée")
+    adresse = models.TextField(verbose_name="Adresse normalisée")
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    adresse_formatee = models.TextField(blank=True)
+    source = models.CharField(max_length=50, db_index=True)
+    confidence = models.FloatField(default=0)
+    success = models.BooleanField(default=True)
+    resultat = models.JSONField(default=dict, verbose_name="Résultat complet du géocodage")
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    expire_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        verbose_name = "Cache géocodage"
+        verbose_name_plural = "Cache géocodage"
+        ordering = ['-updated_at']
+    
+    def __str__(self):
+        return f"{self.adresse[:60]} ({self.source})"
+    
+    @property
+    def est_expire(self):
+        return self.expire_at <= timezone.now()
+
+
+class GeocodageAgent(models.Model):
+    "File d'attente du géocodage des agents : alimentée à l'écriture d'un agent, vidée par un worker"
+    agent = models.OneToOneField('gestion.Agent', on_delete=models.CASCADE, related_name='geocodage_en_attente')
+    adresse = models.TextField(verbose_name="Adresse à géocoder")
+    tentatives = models.PositiveIntegerField(default=0)
+    prochaine_tentative = models.DateTimeField(default=timezone.now, db_index=True)
+    derniere_erreur = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Géocodage en attente"
+        verbose_name_plural = "Géocodages en attente"
+        ordering = ['prochaine_tentative']
+    
+    def __str__(self):
+        return f"{self.agent.nom} - {self.adresse[:60]}"
+
+
+class TrajetCache(models.Model):
+    "Distance et durée routières entre deux positions (cellules geohash), obtenues du service OSRM /table"
+    profil = models.CharField(max_length=20, default='driving')
+    origine = models.CharField(max_length=12, verbose_name="Geohash d'origine")
+    destination = models.CharField(max_length=12, verbose_name="Geohash de destination")
+    distance_km = models.FloatField()
+    duree_s = models.FloatField(verbose_name="Durée (secondes)")
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Cache trajet"
+        verbose_name_plural = "Cache trajets"
+        unique_together = [['profil', 'origine', 'destination']]
+    
+    def __str__(self):
+        return f"{self.origine} → {self.destination} ({self.distance_km:.2f} km, {self.duree_s / 60:.1f} min)"
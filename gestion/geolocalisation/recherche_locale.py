@@ -0,0 +1,150 @@
+# Amélioration d'un ordre de visite par recherche locale
+# Après la construction (plus proche voisin), on applique sur la matrice de
+# distances les meilleurs mouvements tant qu'ils raccourcissent le parcours :
+#   - 2-opt  : inverser un tronçon du parcours (supprime les croisements) ;
+#   - Or-opt : déplacer un tronçon de 1 à 3 points ailleurs, éventuellement
+#              inversé.
+# Le parcours est un chemin ouvert : le premier point (dépôt) est fixe, le
+# dernier est libre. On ajoute pour cela un point virtuel à distance nulle de
+# tous les autres, fixé en fin de parcours. Chaque passe évalue tous les
+# mouvements d'un type en une opération numpy ; la recherche s'arrête à un
+# optimum local ou quand le budget (temps ou itérations) est épuisé.
+
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .distances import distances_etapes
+
+PARAMETRES_DEFAUT = {
+    'budget_s': 0.5,          # temps maximum de la recherche locale
+    'max_iterations': 5000,   # mouvements appliqués au maximum
+}
+LONGUEUR_MAX_OR_OPT = 3
+GAIN_MIN = 1e-9
+
+
+def parametres_amelioration():
+    return dict(PARAMETRES_DEFAUT, **getattr(settings, 'ITINERAIRE_AMELIORATION', {}))
+
+
+def longueur_parcours(distances, ordre):
+    "Longueur (km) d'un chemin ouvert"
+    if len(ordre) < 2:
+        return 0.0
+    return float(distances_etapes(distances, ordre).sum())
+
+
+def _meilleur_deux_opt(d, o):
+    "Meilleur 2-opt : (gain, i, j) pour l'inversion de o[i..j]"
+    n = len(o) - 1  # dernier point : virtuel
+    if n < 3:
+        return 0.0, None, None
+    i = np.arange(1, n - 1)
+    j = np.arange(2, n)
+    a, b, c, e = o[i - 1], o[i], o[j], o[j + 1]
+    gains = d[a, b][:, None] + d[c, e][None, :] - d[np.ix_(a, c)] - d[np.ix_(b, e)]
+    gains[j[None, :] <= i[:, None]] = -np.inf
+    k = int(np.argmax(gains))
+    ligne, colonne = divmod(k, len(j))
+    return float(gains[ligne, colonne]), int(i[ligne]), int(j[colonne])
+
+
+def _meilleur_or_opt(d, o):
+    "Meilleur Or-opt : (gain, i, longueur, p, inverse) pour déplacer o[i:i+longueur] après o[p]"
+    n = len(o) - 1
+    meilleur = (0.0, None, None, None, False)
+    p = np.arange(0, n)
+    u, v = o[p], o[p + 1]
+    cout_arete = d[u, v]
+    for longueur in range(1, LONGUEUR_MAX_OR_OPT + 1):
+        if n - longueur < 1:
+            break
+        i = np.arange(1, n - longueur + 1)
+        debut, fin = o[i], o[i + longueur - 1]
+        precedent, suivant = o[i - 1], o[i + longueur]
+        retrait = d[precedent, debut] + d[fin, suivant] - d[precedent, suivant]
+        insertion = d[np.ix_(u, debut)].T + d[np.ix_(fin, v)] - cout_arete[None, :]
+        insertion_inverse = d[np.ix_(u, fin)].T + d[np.ix_(debut, v)] - cout_arete[None, :]
+        inverse = insertion_inverse < insertion
+        gains = retrait[:, None] - np.where(inverse, insertion_inverse, insertion)
+        # Positions d'insertion touchant le tronçon lui-même
+        gains[(p[None, :] >= i[:, None] - 1) & (p[None, :] <= i[:, None] + longueur - 1)] = -np.inf
+        k = int(np.argmax(gains))
+        ligne, colonne = divmod(k, len(p))
+        if gains[ligne, colonne] > meilleur[0]:
+            meilleur = (float(gains[ligne, colonne]), int(i[ligne]), longueur, int(p[colonne]),
+                        bool(inverse[ligne, colonne]))
+    return meilleur
+
+
+def _deplacer(o, i, longueur, p, inverse):
+    troncon = o[i:i + longueur]
+    if inverse:
+        troncon = troncon[::-1]
+    if p < i:
+        return np.concatenate([o[:p + 1], troncon, o[p + 1:i], o[i + longueur:]])
+    return np.concatenate([o[:i], o[i + longueur:p + 1], troncon, o[p + 1:]])
+
+
+def ameliorer_parcours(distances, ordre, budget_s=None, max_iterations=None):
+    """Améliore un chemin ouvert (premier point fixe) par 2-opt puis Or-opt.
+
+    Retourne (nouvel ordre, statistiques). Le résultat n'est jamais plus long que l'ordre reçu.
+    """
+    parametres = parametres_amelioration()
+    budget_s = parametres['budget_s'] if budget_s is None else budget_s
+    max_iterations = parametres['max_iterations'] if max_iterations is None else max_iterations
+    debut = time.perf_counter()
+    ordre = [int(i) for i in ordre]
+    distance_avant = longueur_parcours(distances, ordre)
+    statistiques = {
+        'methode': '2-opt + or-opt',
+        'distance_avant': round(distance_avant, 3),
+        'distance_apres': round(distance_avant, 3),
+        'iterations': 0,
+        'mouvements_2opt': 0,
+        'mouvements_or_opt': 0,
+        'interrompu': False,
+        'duree_ms': 0.0,
+    }
+    n = len(ordre)
+    if n < 3:
+        return ordre, statistiques
+
+    # Recherche sur une matrice symétrique (les inversions de tronçon la supposent) ;
+    # le résultat est ensuite vérifié sur la vraie matrice
+    d = np.asarray(distances, dtype=np.float64)
+    if not np.allclose(d, d.T):
+        d = (d + d.T) / 2
+    taille = len(d)
+    d_virtuel = np.zeros((taille + 1, taille + 1))
+    d_virtuel[:taille, :taille] = d
+    o = np.array(ordre + [taille], dtype=np.int64)
+
+    while True:
+        if statistiques['iterations'] >= max_iterations or time.perf_counter() - debut >= budget_s:
+            statistiques['interrompu'] = True
+            break
+        gain, i, j = _meilleur_deux_opt(d_virtuel, o)
+        if gain > GAIN_MIN:
+            o[i:j + 1] = o[i:j + 1][::-1]
+            statistiques['mouvements_2opt'] += 1
+            statistiques['iterations'] += 1
+            continue
+        gain, i, longueur, p, inverse = _meilleur_or_opt(d_virtuel, o)
+        if gain > GAIN_MIN:
+            o = _deplacer(o, i, longueur, p, inverse)
+            statistiques['mouvements_or_opt'] += 1
+            statistiques['iterations'] += 1
+            continue
+        break
+
+    nouvel_ordre = [int(i) for i in o[:-1]]
+    distance_apres = longueur_parcours(distances, nouvel_ordre)
+    if distance_apres > distance_avant:
+        nouvel_ordre, distance_apres = ordre, distance_avant
+    statistiques['distance_apres'] = round(distance_apres, 3)
+    statistiques['duree_ms'] = round((time.perf_counter() - debut) * 1000, 1)
+    return nouvel_ordre, statistiques
@@ -0,0 +1,291 @@
+# Répartition automatique des agents d'un créneau entre les chauffeurs
+# Pour un créneau (date, type de transport, heure), propose les courses :
+#   1. les agents à la même adresse (clé normalisée) forment un arrêt ;
+#   2. balayage angulaire autour du dépôt : les arrêts, triés par angle, remplissent
+#      les véhicules du plus grand au plus petit (nombre_places) ; un arrêt qui ne
+#      tient pas dans les places restantes déborde sur le véhicule suivant. Peu de
+#      véhicules, chacun sur un secteur compact ;
+#   3. chaque tournée est ordonnée (plus proche voisin puis 2-opt / Or-opt, chemin
+#      ouvert depuis le dépôt) ;
+#   4. le balayage est répété depuis plusieurs angles de départ ; on garde la proposition
+#      avec le moins d'agents non placés, puis le moins de véhicules, puis le moins de km.
+# Distances à vol d'oiseau, ou routières (ITINERAIRE_MODE_DISTANCE = 'routier').
+# Les essais sont indépendants : ils peuvent tourner dans un pool de processus.
+# La proposition est ensuite acceptée en bloc (Course + Affectation).
+
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .distances import matrice_distances, mode_distance_defaut, plus_proche_voisin
+from .matrices import matrice_routiere
+from .recherche_locale import ameliorer_parcours, longueur_parcours
+
+PARAMETRES_DEFAUT = {
+    'essais': 12,              # angles de départ du balayage
+    'processus': 0,            # 0 : essais dans le processus courant ; plafonné au nombre de CPU
+    'budget_route_s': 0.05,    # recherche locale par tournée
+}
+
+
+def parametres_repartition():
+    return dict(PARAMETRES_DEFAUT, **getattr(settings, 'REPARTITION', {}))
+
+
+def _arrets(agents):
+    "Arrêts (latitude, longitude, [ids]) : agents regroupés par adresse"
+    groupes = {}
+    for agent in agents:
+        cle = agent.get('cle') or f"agent:{agent['id']}"
+        groupes.setdefault(cle, []).append(agent)
+    return [(membres[0]['latitude'], membres[0]['longitude'], [a['id'] for a in membres])
+            for membres in groupes.values()]
+
+
+# Données partagées par les essais (copiées une fois par processus du pool)
+_contexte = {}
+
+
+def _initialiser(distances, rotation, demandes, capacites, budget_route_s):
+    _contexte.update(distances=distances, rotation=rotation, demandes=demandes,
+                     capacites=capacites, budget_route_s=budget_route_s)
+
+
+def _ordonner(distances, arrets, budget_route_s):
+    "Ordre de visite des arrêts (indices) depuis le dépôt (indice 0 de la matrice) et longueur en km"
+    noeuds = [0] + [arret + 1 for arret in arrets]
+    sous_matrice = distances[np.ix_(noeuds, noeuds)]
+    ordre, _ = ameliorer_parcours(sous_matrice, plus_proche_voisin(sous_matrice, 0), budget_s=budget_route_s)
+    return [arrets[k - 1] for k in ordre[1:]], longueur_parcours(sous_matrice, ordre)
+
+
+def _essai(decalage):
+    """Balayage à partir de la position decalage de l'ordre angulaire.
+
+    Retourne (routes, non placés, distance) ; un morceau d'arrêt est (arrêt, début, fin) dans sa liste d'agents.
+    """
+    rotation = [int(arret) for arret in np.roll(_contexte['rotation'], -decalage)]
+    demandes, capacites = _contexte['demandes'], _contexte['capacites']
+
+    groupes = []
+    non_places = []
+    vehicule, restant, courant = 0, capacites[0], []
+    for arret in rotation:
+        debut, demande = 0, int(demandes[arret])
+        while debut < demande and vehicule < len(capacites):
+            if restant == 0:
+                groupes.append((vehicule, courant))
+                vehicule, courant = vehicule + 1, []
+                if vehicule == len(capacites):
+                    break
+                restant = capacites[vehicule]
+            pris = min(restant, demande - debut)
+            courant.append((arret, debut, debut + pris))
+            debut += pris
+            restant -= pris
+        if debut < demande:
+            non_places.append((arret, debut, demande))
+    if courant:
+        groupes.append((vehicule, courant))
+
+    routes = []
+    distance_totale = 0.0
+    for vehicule, morceaux in groupes:
+        par_arret = {morceau[0]: morceau for morceau in morceaux}
+        ordre, distance = _ordonner(_contexte['distances'], list(par_arret), _contexte['budget_route_s'])
+        routes.append((vehicule, [par_arret[arret] for arret in ordre], distance))
+        distance_totale += distance
+    return routes, non_places, distance_totale
+
+
+def repartir(agents, vehicules, depot, essais=None, processus=None, budget_route_s=None, mode_distance=None):
+    """Répartit des agents géolocalisés entre des véhicules.
+
+    agents : [{'id', 'latitude', 'longitude', 'cle' (adresse normalisée, optionnelle)}]
+    vehicules : [{'id', 'capacite'}] ; depot : (latitude, longitude).
+    Retourne {'routes': [{'vehicule', 'capacite', 'agents' (ordre de visite), 'distance_km'}], 'non_places', ...}.
+    """
+    parametres = parametres_repartition()
+    essais = essais or parametres['essais']
+    processus = parametres['processus'] if processus is None else processus
+    processus = min(processus, os.cpu_count() or 1)
+    budget_route_s = parametres['budget_route_s'] if budget_route_s is None else budget_route_s
+    debut = time.perf_counter()
+
+    vehicules = sorted((v for v in vehicules if v['capacite'] > 0), key=lambda v: (-v['capacite'], v['id']))
+    resultat = {
+        'routes': [],
+        'non_places': [agent['id'] for agent in agents] if not vehicules else [],
+        'nombre_vehicules': 0,
+        'distance_totale_km': 0.0,
+        'essais': 0,
+        'duree_ms': 0.0,
+    }
+    if not agents or not vehicules:
+        return resultat
+
+    capacites = [v['capacite'] for v in vehicules]
+    arrets = _arrets(agents)
+    latitudes = np.array([depot[0]] + [a[0] for a in arrets])
+    longitudes = np.array([depot[1]] + [a[1] for a in arrets])
+    if (mode_distance or mode_distance_defaut()) == 'routier':
+        # Une requête /table pour le dépôt et tous les arrêts (trajets en cache)
+        distances = np.asarray(matrice_routiere([(float(lat), float(lon)) for lat, lon in zip(latitudes, longitudes)])['distances_km'], dtype=np.float64)
+    else:
+        distances = matrice_distances(latitudes, longitudes, mode_distance)
+    demandes = np.array([len(a[2]) for a in arrets])
+
+    # Ordre angulaire des arrêts autour du dépôt (projection locale)
+    angles = np.arctan2(latitudes[1:] - depot[0], (longitudes[1:] - depot[1]) * math.cos(math.radians(depot[0])))
+    rotation = np.argsort(angles, kind='stable')
+    essais = max(1, min(essais, len(arrets)))
+    decalages = [int(k * len(arrets) / essais) for k in range(essais)]
+
+    contexte = (distances, rotation, demandes, capacites, budget_route_s)
+    if processus and processus > 1 and essais > 1:
+        with ProcessPoolExecutor(max_workers=processus, initializer=_initialiser, initargs=contexte) as executeur:
+            candidats = list(executeur.map(_essai, decalages))
+    else:
+        _initialiser(*contexte)
+        candidats = [_essai(decalage) for decalage in decalages]
+    _contexte.clear()
+
+    routes, non_places, distance_totale = min(
+        candidats, key=lambda c: (sum(fin - debut for _, debut, fin in c[1]), len(c[0]), c[2])
+    )
+    for vehicule, ordre, distance in routes:
+        ids = [agent_id for arret, debut, fin in ordre for agent_id in arrets[arret][2][debut:fin]]
+        resultat['routes'].append({
+            'vehicule': vehicules[vehicule]['id'],
+            'capacite': vehicules[vehicule]['capacite'],
+            'agents': ids,
+            'nombre_agents': len(ids),
+            'arrets': len(ordre),
+            'distance_km': round(distance, 2),
+        })
+    resultat.update(
+        non_places=[agent_id for arret, debut, fin in non_places for agent_id in arrets[arret][2][debut:fin]],
+        nombre_vehicules=len(routes),
+        distance_totale_km=round(distance_totale, 2),
+        essais=len(decalages),
+        duree_ms=round((time.perf_counter() - debut) * 1000, 1),
+    )
+    return resultat
+
+
+def depot_par_defaut():
+    "Point de départ des courses (valeurs par défaut de Course)"
+    from gestion.models import Course
+    return (Course._meta.get_field('point_depart_latitude').default,
+            Course._meta.get_field('point_depart_longitude').default)
+
+
+def chauffeurs_disponibles(date_reelle, type_transport, heure, chauffeur_ids=None):
+    "Chauffeurs actifs sans course sur le créneau"
+    from gestion.models import Chauffeur, Course
+    chauffeurs = Chauffeur.objects.filter(actif=True).exclude(
+        id__in=Course.objects.filter(date_reelle=date_reelle, type_transport=type_transport, heure=heure)
+        .values('chauffeur_id')
+    )
+    if chauffeur_ids:
+        chauffeurs = chauffeurs.filter(id__in=chauffeur_ids)
+    return list(chauffeurs)
+
+
+def proposer_repartition(date_reelle, type_transport, heure, chauffeur_ids=None):
+    "Proposition de courses pour les agents planifiés et pas encore affectés sur le créneau"
+    from gestion.models import PlanningShift
+    from .file_geocodage import planifier_geocodage
+
+    shifts = list(PlanningShift.non_affectes(date_reelle, type_transport, [heure]))
+    agents = {shift.agent_id: shift.agent for shift in shifts}
+    jour = shifts[0].jour if shifts else ''
+    sans_coordonnees = [a for a in agents.values() if a.latitude is None or a.longitude is None]
+    planifier_geocodage(sans_coordonnees)
+
+    chauffeurs = {c.id: c for c in chauffeurs_disponibles(date_reelle, type_transport, heure, chauffeur_ids)}
+    print(f"🚐 Répartition {date_reelle} {type_transport} {heure}h: {len(agents)} agent(s), {len(chauffeurs)} chauffeur(s)")
+    resultat = repartir(
+        [{'id': a.id, 'latitude': a.latitude, 'longitude': a.longitude, 'cle': a.adresse_normalisee}
+         for a in agents.values() if a.latitude is not None and a.longitude is not None],
+        [{'id': c.id, 'capacite': c.nombre_places} for c in chauffeurs.values()],
+        depot_par_defaut(),
+    )
+
+    for route in resultat['routes']:
+        chauffeur = chauffeurs[route['vehicule']]
+        route.update(
+            chauffeur_id=chauffeur.id,
+            chauffeur=chauffeur.nom,
+            agents=[{'id': agent_id, 'nom': agents[agent_id].nom, 'adresse': agents[agent_id].adresse}
+                    for agent_id in route['agents']],
+        )
+        del route['vehicule']
+    resultat.update(
+        date=date_reelle.strftime('%Y-%m-%d'),
+        jour=jour,
+        type_transport=type_transport,
+        heure=heure,
+        non_places=[{'id': agent_id, 'nom': agents[agent_id].nom} for agent_id in resultat['non_places']],
+        sans_coordonnees=[{'id': a.id, 'nom': a.nom} for a in sans_coordonnees],
+    )
+    print(f"✅ Répartition proposée: {resultat['nombre_vehicules']} course(s), {resultat['distance_totale_km']} km "
+          f"en {resultat['duree_ms']} ms")
+    return resultat
+
+
+def accepter_repartition(date_reelle, jour, type_transport, heure, routes):
+    """Crée les courses et affectations d'une proposition (routes : [{'chauffeur_id', 'agents': [ids]}]).
+
+    Les agents déjà affectés ce jour-là et les chauffeurs déjà pris sur le créneau sont ignorés.
+    """
+    from gestion.models import Affectation, Agent, Chauffeur, Course
+
+    courses_creees = 0
+    affectations_creees = 0
+    erreurs = []
+    with transaction.atomic():
+        deja_affectes = set(Affectation.objects.filter(date_reelle=date_reelle).values_list('agent_id', flat=True))
+        chauffeurs = Chauffeur.objects.in_bulk([route.get('chauffeur_id') for route in routes])
+        agents = Agent.objects.in_bulk([agent_id for route in routes for agent_id in route.get('agents', [])])
+        for route in routes:
+            chauffeur = chauffeurs.get(route.get('chauffeur_id'))
+            if chauffeur is None:
+                erreurs.append(f"Chauffeur {route.get('chauffeur_id')} introuvable")
+                continue
+            membres = [agents[i] for i in dict.fromkeys(route.get('agents', [])) if i in agents and i not in deja_affectes]
+            if not membres:
+                continue
+            if len(membres) > chauffeur.nombre_places:
+                erreurs.append(f"{chauffeur.nom}: {len(membres)} agents pour {chauffeur.nombre_places} places")
+                continue
+            if Course.objects.filter(chauffeur=chauffeur, heure=heure, type_transport=type_transport,
+                                     jour=jour, date_reelle=date_reelle).exists():
+                erreurs.append(f"{chauffeur.nom}: course déjà existante sur ce créneau")
+                continue
+
+            prix = Course(chauffeur=chauffeur).get_prix_course()
+            course = Course.objects.create(
+                chauffeur=chauffeur, type_transport=type_transport, heure=heure,
+                jour=jour, date_reelle=date_reelle, prix_total=prix
+            )
+            # Même calcul que Affectation.save() : prix de la course partagé entre les sociétés
+            societes = {a.get_societe_display() for a in membres} - {'Non spécifié', ''}
+            prix_societe = round(float(prix) / len(societes), 3) if societes and prix else 0.0
+            Affectation.objects.bulk_create([
+                Affectation(course=course, chauffeur=chauffeur, heure=heure, agent=agent,
+                            type_transport=type_transport, jour=jour, date_reelle=date_reelle,
+                            prix_course=prix, prix_societe=prix_societe)
+                for agent in membres
+            ])
+            deja_affectes.update(agent.id for agent in membres)
+            courses_creees += 1
+            affectations_creees += len(membres)
+
+    print(f"✅ Répartition acceptée: {courses_creees} course(s), {affectations_creees} affectation(s)")
+    return {'courses_creees': courses_creees, 'affectations_creees': affectations_creees, 'erreurs': erreurs}
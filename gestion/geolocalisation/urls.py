@@ -7,4 +7,8 @@ urlpatterns = [
     path('geocoder/', views.geocoder_adresses, name='geocoder_adresses'),
     path('rapport/', views.rapport_optimisation, name='rapport_optimisation'),
     path('statistiques/', views.statistiques_geolocalisation, name='statistiques_geolocalisation'),
+    path('api/limites/', views.api_metriques_limites, name='api_metriques_limites'),
+    path('api/agents/proches/', views.api_agents_proches, name='api_agents_proches'),
+    path('api/repartition/proposer/', views.api_proposer_repartition, name='api_proposer_repartition'),
+    path('api/repartition/accepter/', views.api_accepter_repartition, name='api_accepter_repartition'),
 ]
@@ -12,10 +12,32 @@ from django.conf import settings
 from math import radians, sin, cos, sqrt, atan2
 import numpy as np
 import time
-from django.core.cache import cache
-import hashlib
 import re
 from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+
+from .cache import cache_geocodage, cache_negatif, cle_adresse
+from .disjoncteurs import disjoncteur
+from .distances import distances_etapes, matrice_points, mode_distance_defaut, plus_proche_voisin
+from .matrices import matrice_routiere
+from .recherche_locale import ameliorer_parcours
+from .fournisseurs import fournisseur_externe
+from .gazetteer import gazetteer
+from .limites import attendre_fournisseur
+
+TIMEOUT_FOURNISSEUR = 5  # secondes, requête HTTP sans budget
+# En dessous de ce temps restant, une requête externe n'a guère de chance d'aboutir : elle n'est pas envoyée
+BUDGET_MIN_APPEL_DEFAUT = 0.5
+
+
+def budget_min_appel() -> float:
+    return getattr(settings, 'GEOCODAGE_BUDGET_MIN_APPEL', BUDGET_MIN_APPEL_DEFAUT)
+
+
+def _temps_restant(echeance: Optional[float]) -> Optional[float]:
+    "Secondes restantes avant l'échéance (time.monotonic), None sans échéance"
+    return None if echeance is None else echeance - time.monotonic()
 
 class GeolocalisationManager:
     def __init__(self):
@@ -35,70 +57,131 @@ class GeolocalisationManager:
         
         print(f"Configuration géolocalisation - PositionStack: {'OK' if self.positionstack_api_key else 'KO'}")
     
-    def geocode_adresse(self, adresse: str) -> Dict[str, Any]:
-   
+    def geocode_adresse(self, adresse: str, budget: Optional[float] = None, precis: bool = False) -> Dict[str, Any]:
+        """Géocode une adresse (cache, quartier connu, fournisseurs, centre de Sousse).
+
+        budget : temps maximum en secondes. Les fournisseurs qui ne peuvent pas répondre
+        dans le temps restant sont ignorés ; le résultat approximatif est alors marqué
+        'provisoire' et l'adresse est regéocodée en arrière-plan sans limite de temps.
+        Le centre du quartier connu est lui aussi provisoire (regéocodé en arrière-plan).
+        precis : fournisseurs interrogés avant le quartier (file de géocodage, raffinements).
+        """
+        echeance = time.monotonic() + budget if budget is not None else None
         adresse_nettoyee = self.nettoyer_adresse(adresse)
      
         if self.cache_enabled:
-            cache_key = f"geocode_{hashlib.md5(adresse_nettoyee.encode()).hexdigest()}"
-            cached_result = cache.get(cache_key)
+            # Mode précis : le centre de Sousse mis en cache ne suffit pas, on réinterroge les fournisseurs
+            cached_result = cache_geocodage.get(adresse_nettoyee, approximatif=not precis)
             if cached_result:
                 print(f"⚡ Cache hit: {adresse_nettoyee[:50]}...")
                 return cached_result
     
+        return self._geocoder_sans_cache(adresse_nettoyee, echeance, precis)
+
+    def _geocoder_sans_cache(self, adresse_nettoyee: str, echeance: Optional[float] = None,
+                             precis: bool = False) -> Dict[str, Any]:
+        "Interroge les fournisseurs puis les fallbacks et met le résultat en cache"
         print(f"🌍 Géocodage: {adresse_nettoyee[:50]}...")
     
-        # ÉTAPE 1: RESPECTER LE RATE LIMITING
-        current_time = time.time()
-        if hasattr(self, 'last_request_time'):
-            time_since_last = current_time - self.last_request_time
-            if time_since_last < 1.0:  # 1 seconde minimum entre les requêtes
-                delay = 1.0 - time_since_last
-                print(f"⏳ Rate limiting: attente de {delay:.2f}s")
-                time.sleep(delay)
+        # Le rate limiting est appliqué par fournisseur, juste avant chaque requête HTTP
     
-        self.last_request_time = time.time()
+        # ÉTAPE 1: QUARTIER CONNU (gazetteer hors ligne, sans appel externe ni mise en cache)
+        # Réponse immédiate mais approximative : provisoire, les fournisseurs sont interrogés en arrière-plan
+        if not precis:
+            result = self._fallback_sousse_quartier(adresse_nettoyee)
+            if result['success']:
+                from .file_geocodage import planifier_raffinement
+                planifier_raffinement(adresse_nettoyee)
+                return result
     
-        # ÉTAPE 2: ESSAYER POSITIONSTACK (avec votre clé)
+        # ÉTAPES 2-3: FOURNISSEURS (PositionStack avec votre clé, puis Nominatim - gratuit)
+        fournisseurs = []
         if self.positionstack_api_key and self.positionstack_api_key != '88bcabc4997f720becd5cb84b44c7b6e':
-            result = self._geocode_positionstack(adresse_nettoyee)
+            fournisseurs.append(('positionstack', self._geocode_positionstack))
+        fournisseurs.append(('nominatim', self._geocode_nominatim))
+    
+        hors_budget = False
+        for fournisseur, geocoder in fournisseurs:
+            result = self._interroger_fournisseur(fournisseur, geocoder, adresse_nettoyee, echeance)
+            hors_budget = hors_budget or result.get('hors_budget', False)
             if result['success']:
                 # Mettre en cache
                 if self.cache_enabled:
-                    cache.set(cache_key, result, self.cache_timeout)
-                    print(f"  💾 Mis en cache (PositionStack)")
+                    cache_geocodage.set(adresse_nettoyee, result)
+                    print(f"  💾 Mis en cache ({fournisseur})")
                 return result
     
-        # ÉTAPE 3: ESSAYER NOMINATIM (OpenStreetMap - gratuit)
-        result = self._geocode_nominatim(adresse_nettoyee)
-        if result['success']:
-            # Mettre en cache
-            if self.cache_enabled:
-                cache.set(cache_key, result, self.cache_timeout)
-                print(f"  💾 Mis en cache (Nominatim)")
-            return result
-    
-        # ÉTAPE 4: FALLBACK PERSONNALISÉ (quartiers de Sousse)
-        result = self._fallback_sousse_quartier(adresse_nettoyee)
-        if result['success']:
-            # Mettre en cache même si fallback
-            if self.cache_enabled:
-                cache.set(cache_key, result, self.cache_timeout)
-                print(f"  💾 Mis en cache (Fallback quartier)")
-            return result
+        # Mode précis : le quartier connu ne sert qu'à défaut de résultat des fournisseurs
+        if precis:
+            result = self._fallback_sousse_quartier(adresse_nettoyee)
+            if result['success']:
+                return result
     
-        # ÉTAPE 5: FALLBACK AU CENTRE DE SOUSSE
+        # ÉTAPE 4: FALLBACK AU CENTRE DE SOUSSE
         result = self._fallback_sousse_centre(adresse_nettoyee)
-        # Mettre en cache même si fallback
-        if self.cache_enabled:
-            cache.set(cache_key, result, 86400)  # 24h pour les fallbacks
-            print(f"  💾 Mis en cache (Fallback centre)")
+        if hors_budget:
+            # Un fournisseur n'a pas pu être interrogé faute de temps : on termine le travail en arrière-plan
+            from .file_geocodage import planifier_raffinement
+            result['provisoire'] = True
+            planifier_raffinement(adresse_nettoyee)
+        elif self.cache_enabled:
+            # Aucun fournisseur n'a trouvé l'adresse : mis en cache peu de temps (TTL de 'fallback_centre')
+            cache_geocodage.set(adresse_nettoyee, result)
+        return result
+
+    def _interroger_fournisseur(self, fournisseur: str, geocoder, adresse_nettoyee: str,
+                                echeance: Optional[float] = None) -> Dict[str, Any]:
+        "Appelle un fournisseur sauf si son disjoncteur est ouvert, s'il n'a rien trouvé récemment ou si le budget est épuisé"
+        if cache_negatif.contient(fournisseur, adresse_nettoyee):
+            print(f"  🚫 {fournisseur}: aucun résultat récent pour cette adresse, ignoré")
+            return {'success': False}
+    
+        restant = _temps_restant(echeance)
+        if restant is not None and restant < budget_min_appel():
+            print(f"  ⏱️  {fournisseur}: budget épuisé ({max(restant, 0):.2f}s restantes), ignoré")
+            return {'success': False, 'hors_budget': True}
     
+        disjoncteur_fournisseur = disjoncteur(fournisseur)
+        if not disjoncteur_fournisseur.autoriser():
+            print(f"  ⛔ {fournisseur}: disjoncteur ouvert, ignoré")
+            return {'success': False}
+    
+        try:
+            result = geocoder(adresse_nettoyee, echeance)
+        except Exception as e:
+            print(f"  ❌ {fournisseur}: erreur inattendue: {e}")
+            result = {'success': False, 'erreur_fournisseur': True}
+    
+        if result.get('hors_budget'):
+            # Requête non envoyée ou coupée par le budget : rien à reprocher au fournisseur
+            disjoncteur_fournisseur.abandonner()
+        elif result.get('erreur_fournisseur'):
+            disjoncteur_fournisseur.echec()
+        else:
+            disjoncteur_fournisseur.succes()
+            if result.get('aucun_resultat'):
+                cache_negatif.ajouter(fournisseur, adresse_nettoyee)
         return result
 
-    def _geocode_positionstack(self, adresse: str) -> Dict[str, Any]:
+    @staticmethod
+    def _attente_max(echeance: Optional[float]) -> Optional[float]:
+        "Attente maximale sur le limiteur de débit pour garder budget_min_appel() avant l'échéance"
+        restant = _temps_restant(echeance)
+        return None if restant is None else max(restant - budget_min_appel(), 0)
+
+    @staticmethod
+    def _timeout(echeance: Optional[float]) -> float:
+        "Timeout HTTP : TIMEOUT_FOURNISSEUR, réduit au temps restant avant l'échéance"
+        restant = _temps_restant(echeance)
+        return TIMEOUT_FOURNISSEUR if restant is None else max(min(TIMEOUT_FOURNISSEUR, restant), 0.1)
+
+    def _geocode_positionstack(self, adresse: str, echeance: Optional[float] = None) -> Dict[str, Any]:
     
+        timeout = self._timeout(echeance)
         try:
+           if attendre_fournisseur('positionstack', self._attente_max(echeance)) is None:
+               return {'success': False, 'hors_budget': True}
+           timeout = self._timeout(echeance)
            params = {
                'access_key': self.positionstack_api_key,
                'query': adresse,
@@ -108,10 +191,11 @@ class GeolocalisationManager:
                'output': 'json'
            }
         
-           response = requests.get(
+           response = fournisseur_externe().get(
+               'positionstack',
                "http://api.positionstack.com/v1/forward",
                params=params,
-               timeout=5
+               timeout=timeout
            )
         
            if response.status_code == 200:
@@ -142,26 +226,30 @@ class GeolocalisationManager:
                    return result
                else:
                    print(f"  ❌ PositionStack: aucun résultat")
-                   return {'success': False}
+                   return {'success': False, 'aucun_resultat': True}
         
            elif response.status_code == 429:
                print(f"  ⚠️  PositionStack: rate limit atteint (429)")
-               return {'success': False, 'rate_limited': True}
+               return {'success': False, 'rate_limited': True, 'erreur_fournisseur': True}
         
            else:
                print(f"  ❌ PositionStack: erreur HTTP {response.status_code}")
-               return {'success': False}
+               return {'success': False, 'erreur_fournisseur': True}
             
         except requests.exceptions.Timeout:
+            if timeout < TIMEOUT_FOURNISSEUR:
+                print(f"  ⏱️  PositionStack: budget dépassé ({timeout:.2f}s)")
+                return {'success': False, 'hors_budget': True}
             print(f"  ⏱️  PositionStack: timeout")
-            return {'success': False}
+            return {'success': False, 'erreur_fournisseur': True}
         
         except requests.exceptions.RequestException as e:
             print(f"  ❌ PositionStack: erreur réseau: {e}")
-            return {'success': False}
+            return {'success': False, 'erreur_fournisseur': True}
 
-    def _geocode_nominatim(self, adresse: str) -> Dict[str, Any]:
+    def _geocode_nominatim(self, adresse: str, echeance: Optional[float] = None) -> Dict[str, Any]:
   
+        timeout = self._timeout(echeance)
         try:
             # Formater l'adresse pour Nominatim
             query = f"{adresse}, Sousse, Tunisie"
@@ -179,7 +267,10 @@ class GeolocalisationManager:
                 'User-Agent': 'GestionTransportApp/1.0 (contact@votreentreprise.com)'
             }
         
-            response = requests.get(url, params=params, headers=headers, timeout=5)
+            if attendre_fournisseur('nominatim', self._attente_max(echeance)) is None:
+                return {'success': False, 'hors_budget': True}
+            timeout = self._timeout(echeance)
+            response = fournisseur_externe().get('nominatim', url, params=params, headers=headers, timeout=timeout)
         
             if response.status_code == 200:
                 data = response.json()
@@ -208,82 +299,46 @@ class GeolocalisationManager:
                     return result
                 else:
                     print(f"  ❌ Nominatim: aucun résultat")
-                    return {'success': False}
+                    return {'success': False, 'aucun_resultat': True}
           
             elif response.status_code == 429:
-                print(f"  ⚠️  Nominatim: rate limit, on attend 1 seconde...")
-                time.sleep(1)
-                return {'success': False}
+                # Pas d'attente ici : l'échec est compté par le disjoncteur
+                print(f"  ⚠️  Nominatim: rate limit atteint (429)")
+                return {'success': False, 'rate_limited': True, 'erreur_fournisseur': True}
         
             else:
                 print(f"  ❌ Nominatim: erreur HTTP {response.status_code}")
-                return {'success': False}
+                return {'success': False, 'erreur_fournisseur': True}
+            
+        except requests.exceptions.Timeout:
+            if timeout < TIMEOUT_FOURNISSEUR:
+                print(f"  ⏱️  Nominatim: budget dépassé ({timeout:.2f}s)")
+                return {'success': False, 'hors_budget': True}
+            print(f"  ⏱️  Nominatim: timeout")
+            return {'success': False, 'erreur_fournisseur': True}
             
         except Exception as e:
             print(f"  ❌ Nominatim erreur: {e}")
-            return {'success': False}
+            return {'success': False, 'erreur_fournisseur': True}
 
     def _fallback_sousse_quartier(self, adresse: str) -> Dict[str, Any]:
+        "Position du quartier reconnu dans l'adresse (gazetteer hors ligne), décalée de façon stable"
+        position = gazetteer().localiser(adresse, rayon=0.003)
+        if position is None:
+            return {'success': False}
     
-    
-        quartiers_sousse = {
-            # Quartiers principaux
-            'Riadh 1' : (35.8085, 10.5920),
-            'Riadh 2' : (35.8110, 10.5880),
-            'Riadh 3' : (35.8050, 10.5850),
-            'Riadh 4' : (35.8020, 10.5800),
-            'Riadh 5' : (35.7980, 10.5750),
-            'Riadh El Andalous' : (35.8060, 10.5790),
-            'Zouhour 1' : (35.8180, 10.6050),
-            'Zouhour 2' : (35.8150, 10.6000),
-            'Zouhour 3' : (35.8125, 10.5960),
-            'Ghodrane' : (35.8120, 10.6120),
-            'El Habib' : (35.8100, 10.6050),
-            'Msaken Centre' : (35.7300, 10.5850),
-            'Msaken Ennour' : (35.7350, 10.5750),
-            'Msaken El Bassatine' : (35.7250, 10.5920),
-            'Sahloul 1' : (35.8350, 10.5960),
-            'Sahloul 2' : (35.8385, 10.5930),
-            'Sahloul 3' : (35.8410, 10.5880),
-            'Sahloul 4' : (35.8450, 10.5850),
-            'Khezama Est' : (35.8525, 10.6150),
-            'Khezama Ouest' : (35.8485, 10.6050),
-            'Jawhara' : (35.8256, 10.6084),
-            'Médina Sousse' : (35.8275, 10.6392),
-            'Boujaafar' : (35.8340, 10.6400),
-            'Taffala' : (35.8170, 10.6130),
-            'Sidi Abdelhamid' : (35.7950, 10.6350),
-            'Hammam Sousse' : (35.8580, 10.5980),
-            'Akouda' : (35.8680, 10.5650),
-            'Kalaa Kebira' : (35.8660, 10.5360),
-            'Kalaa Seghira' : (35.8200, 10.5600),
-            'Hergla' : (36.0312, 10.5091),
+        print(f"  🗺️  Gazetteer: trouvé {position['quartier']}")
+        return {
+            'latitude': position['latitude'],
+            'longitude': position['longitude'],
+            'adresse_formatee': f"{adresse} (quartier {position['quartier']})",
+            'success': True,
+            'source': 'gazetteer',
+            'provisoire': True,
+            'confidence': 0.6,
+            'dans_zone_sousse': True,
+            'quartier': position['quartier']
         }
-    
-        adresse_lower = adresse.lower()
-    
-        for quartier, coords in quartiers_sousse.items():
-            if quartier in adresse_lower:
-                # Ajouter un petit offset aléatoire pour éviter les points superposés
-                import random
-                offset_lat = random.uniform(-0.003, 0.003)
-                offset_lon = random.uniform(-0.003, 0.003)
-                
-                result = {
-                    'latitude': coords[0] + offset_lat,
-                    'longitude': coords[1] + offset_lon,
-                    'adresse_formatee': f"{adresse} (quartier {quartier})",
-                    'success': True,
-                    'source': 'fallback_quartier',
-                    'confidence': 0.6,
-                    'dans_zone_sousse': True,
-                    'quartier': quartier
-                }
-                
-                print(f"  🗺️  Fallback quartier: trouvé {quartier}")
-                return result
-    
-        return {'success': False}
 
     def _fallback_sousse_centre(self, adresse: str) -> Dict[str, Any]:
     
@@ -352,34 +407,62 @@ class GeolocalisationManager:
         return (zone_sousse['lat_min'] <= lat <= zone_sousse['lat_max'] and 
                 zone_sousse['lon_min'] <= lon <= zone_sousse['lon_max'])
     
-    def batch_geocode_adresses(self, adresses_list: List[str]) -> List[Dict[str, Any]]:
-       
+    def batch_geocode_adresses(self, adresses_list: List[str], budget: Optional[float] = None,
+                               precis: bool = False) -> List[Dict[str, Any]]:
+        """Géocode une liste d'adresses ; les résultats sont dans l'ordre de la liste.
+
+        Les adresses identiques (après nettoyage) ne sont géocodées qu'une fois,
+        les résultats en cache sont servis immédiatement et le reste est réparti
+        sur un pool de threads : chaque fournisseur limite lui-même son débit.
+        budget : temps maximum pour tout le lot, comme pour geocode_adresse ; precis : idem.
+        """
+        echeance = time.monotonic() + budget if budget is not None else None
         print(f"📦 Géocodage batch de {len(adresses_list)} adresses...")
         
-        resultats = []
-        succes = 0
-        echecs = 0
+        adresses_nettoyees = [self.nettoyer_adresse(adresse) for adresse in adresses_list]
+        # Regroupement par adresse canonique : "Cité Riadh 2 rue 12" et "riadh 2 r. 12" sont géocodées une fois
+        cles = [cle_adresse(adresse_nettoyee) for adresse_nettoyee in adresses_nettoyees]
+        uniques = dict(zip(cles, adresses_nettoyees))
         
-        for i, adresse in enumerate(adresses_list):
-            print(f"  [{i+1}/{len(adresses_list)}] {adresse[:50]}...")
-            
-            result = self.geocode_adresse(adresse)
-            result['adresse_origine'] = adresse
-            
-            if result['success']:
-                succes += 1
+        resultats_par_cle = {}
+        a_geocoder = []
+        for cle, adresse_nettoyee in uniques.items():
+            cached_result = cache_geocodage.get(adresse_nettoyee, approximatif=not precis) if self.cache_enabled else None
+            if cached_result:
+                resultats_par_cle[cle] = cached_result
             else:
-                echecs += 1
-            
+                a_geocoder.append(cle)
+        
+        print(f"  ⚡ {len(uniques) - len(a_geocoder)} en cache, {len(a_geocoder)} à géocoder "
+              f"({len(adresses_list) - len(uniques)} doublon(s))")
+        
+        if a_geocoder:
+            workers = min(getattr(settings, 'GEOCODAGE_BATCH_WORKERS', 4), len(a_geocoder))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='geocodage') as executeur:
+                adresses = [uniques[cle] for cle in a_geocoder]
+                geocodes = executeur.map(self._geocoder_sans_cache_thread, adresses,
+                                         [echeance] * len(adresses), [precis] * len(adresses))
+                for cle, result in zip(a_geocoder, geocodes):
+                    resultats_par_cle[cle] = result
+        
+        resultats = []
+        for adresse, cle in zip(adresses_list, cles):
+            result = dict(resultats_par_cle[cle])
+            result['adresse_origine'] = adresse
             resultats.append(result)
-            
-            # Respecter les limites d'API (1 requête/seconde)
-            if i < len(adresses_list) - 1:
-                time.sleep(0.2)  # 200ms entre les requêtes
         
-        print(f"✅ Batch terminé: {succes} succès, {echecs} échecs")
+        succes = sum(1 for result in resultats if result['success'])
+        print(f"✅ Batch terminé: {succes} succès, {len(resultats) - succes} échecs")
         return resultats
     
+    def _geocoder_sans_cache_thread(self, adresse_nettoyee: str, echeance: Optional[float] = None,
+                                    precis: bool = False) -> Dict[str, Any]:
+        try:
+            return self._geocoder_sans_cache(adresse_nettoyee, echeance, precis)
+        finally:
+            # Connexion base (cache géocodage) ouverte par le thread du pool
+            connection.close()
+    
     def calculer_distance(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
         
         try:
@@ -402,9 +485,21 @@ class GeolocalisationManager:
         return R * c
     
     def optimiser_itineraire(self, points: List[Dict[str, Any]], 
-                            point_depart_index: Optional[int] = 0) -> Dict[str, Any]:
-       
+                            point_depart_index: Optional[int] = 0,
+                            mode_distance: Optional[str] = None,
+                            depart: Optional[Dict[str, Any]] = None,
+                            budget_amelioration: Optional[float] = None) -> Dict[str, Any]:
+        """Ordre de visite : plus proche voisin puis recherche locale (2-opt, Or-opt).
+
+        depart : point fixe (dépôt) placé en tête de l'itinéraire et pris en compte dans l'optimisation ;
+        ordre_indices reste exprimé en indices de points. mode_distance : voir distances.MODES_DISTANCE,
+        ou 'routier' (distances et durées routières OSRM, matrices.matrice_routiere).
+        """
         print(f"🔄 Traitement de {len(points)} points...")
+        points_originaux = points
+        if depart is not None:
+            points = [depart] + list(points)
+            point_depart_index = 0
         
         # Si un seul point, retourner directement
         if len(points) < 2:
@@ -416,13 +511,14 @@ class GeolocalisationManager:
                 itineraire_ordonne.append({
                     **point,
                     'ordre_visite': idx + 1,
-                    'index_original': idx
+                    'index_original': None if depart is not None else idx
                 })
             
             return {
                 'itineraire': itineraire_ordonne,
-                'ordre_indices': list(range(len(points))),
+                'ordre_indices': list(range(len(points_originaux))),
                 'distance_totale': 0,
+                'distance_initiale': 0,
                 'distance_moyenne': 0,
                 'distance_max': 0,
                 'distance_min': 0,
@@ -436,58 +532,50 @@ class GeolocalisationManager:
         
         print(f"🔄 Optimisation itinéraire ({len(points)} points)...")
         
-        # Créer matrice de distances
+        # Matrice de distances (vectorisée, ou routière : une requête /table, trajets en cache)
         n = len(points)
-        distances = np.zeros((n, n))
-        
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    point1 = (points[i]['latitude'], points[i]['longitude'])
-                    point2 = (points[j]['latitude'], points[j]['longitude'])
-                    distances[i][j] = self.calculer_distance(point1, point2)
+        durees = None
+        sources_distances = None
+        if (mode_distance or mode_distance_defaut()) == 'routier':
+            matrice = matrice_routiere([(p['latitude'], p['longitude']) for p in points])
+            distances, durees, sources_distances = matrice['distances_km'], matrice['durees_s'], matrice['sources']
+        else:
+            distances = matrice_points(points, mode_distance)
         
         # Algorithme du plus proche voisin
         if point_depart_index is None:
             point_depart_index = 0
         
-        visite = [point_depart_index]
-        non_visite = list(range(n))
-        non_visite.remove(point_depart_index)
+        visite = plus_proche_voisin(distances, point_depart_index)
         
-        # Parcours des points
-        while non_visite:
-            dernier = visite[-1]
-            # Trouver le point le plus proche
-            plus_proche = min(non_visite, key=lambda x: distances[dernier][x])
-            visite.append(plus_proche)
-            non_visite.remove(plus_proche)
+        # Amélioration (2-opt, Or-opt) : chemin ouvert depuis le point de départ, fin libre
+        visite, amelioration = ameliorer_parcours(distances, visite, budget_s=budget_amelioration)
         
         # Calcul distance totale
-        distance_totale = 0
-        for i in range(len(visite)-1):
-            distance_totale += distances[visite[i]][visite[i+1]]
+        distances_parcours = distances_etapes(distances, visite)
+        distance_totale = float(distances_parcours.sum())
+        if durees is not None:
+            temps_minutes = float(distances_etapes(durees, visite).sum()) / 60
+        else:
+            temps_minutes = distance_totale / 40 * 60
         
         # Construire l'itinéraire ordonné
+        decalage = 1 if depart is not None else 0
         itineraire_ordonne = []
         for idx in visite:
             point = points[idx]
             itineraire_ordonne.append({
                 **point,
                 'ordre_visite': len(itineraire_ordonne) + 1,
-                'index_original': idx
+                'index_original': idx - decalage if idx >= decalage else None
             })
         
         # Calculer les statistiques
-        distances_etapes = []
-        for i in range(len(visite)-1):
-            distances_etapes.append(distances[visite[i]][visite[i+1]])
-        
         # Gérer le cas où il n'y a qu'un seul point ou aucune étape
-        if distances_etapes:
-            distance_moyenne = np.mean(distances_etapes)
-            distance_max = max(distances_etapes)
-            distance_min = min(distances_etapes)
+        if len(distances_parcours):
+            distance_moyenne = float(distances_parcours.mean())
+            distance_max = float(distances_parcours.max())
+            distance_min = float(distances_parcours.min())
         else:
             distance_moyenne = 0
             distance_max = 0
@@ -495,8 +583,9 @@ class GeolocalisationManager:
         
         resultat = {
             'itineraire': itineraire_ordonne,
-            'ordre_indices': visite,
+            'ordre_indices': [idx - decalage for idx in visite if idx >= decalage],
             'distance_totale': round(distance_totale, 2),
+            'distance_initiale': round(amelioration['distance_avant'], 2),
             'distance_moyenne': round(distance_moyenne, 2),
             'distance_max': round(distance_max, 2),
             'distance_min': round(distance_min, 2),
@@ -504,13 +593,17 @@ class GeolocalisationManager:
             'point_depart': points[visite[0]].get('nom', 'Point 1'),
             'point_arrivee': points[visite[-1]].get('nom', f'Point {n}'),
             'optimise': True if len(points) > 1 else False,
-            'economie_estimee': round(distance_totale * 0.15, 2) if len(points) > 1 else 0,
-            'temps_estime_minutes': round(distance_totale / 40 * 60, 1) if len(points) > 1 else 0
+            # Économie mesurée : distance du plus proche voisin moins distance après amélioration
+            'economie_estimee': round(amelioration['distance_avant'] - distance_totale, 2),
+            'amelioration': amelioration,
+            'temps_estime_minutes': round(temps_minutes, 1),
+            'sources_distances': sources_distances
         }
         
         if len(points) > 1:
             print(f"✅ Itinéraire optimisé: {resultat['distance_totale']} km "
-                  f"(économie: {resultat['economie_estimee']} km)")
+                  f"(avant amélioration: {resultat['distance_initiale']} km, "
+                  f"{amelioration['iterations']} mouvement(s) en {amelioration['duree_ms']} ms)")
         else:
             print(f"📍 {len(points)} point(s) affiché(s) sur la carte")
         
@@ -659,8 +752,9 @@ class GeolocalisationManager:
             }
     
     def generer_rapport_optimisation(self, agents_data: List[Dict[str, Any]], 
-                                    jour: str, type_transport: str, heure: str = None) -> Dict[str, Any]:
-        
+                                    jour: str, type_transport: str, heure: str = None,
+                                    budget: Optional[float] = None) -> Dict[str, Any]:
+        "Rapport d'itinéraire ; budget limite le temps de géocodage des agents sans coordonnées"
         print(f"📊 Génération rapport optimisation: {jour}, {type_transport}" + 
               (f", heure={heure}" if heure else ""))
         
@@ -704,9 +798,22 @@ class GeolocalisationManager:
                 print(f"⚠️  Heure invalide: {heure}, pas de filtrage")
                 agents_filtres = agents_data
         
-        # Géocoder les adresses des agents
-        adresses = [agent.get('adresse', '') for agent in agents_filtres]
-        geocodes = self.batch_geocode_adresses(adresses)
+        # Coordonnées déjà fournies (enregistrées sur l'agent) : ne géocoder que les autres
+        geocodes = [
+            {
+                'latitude': agent['latitude'],
+                'longitude': agent['longitude'],
+                'success': agent.get('geocode_success', True),
+                'source': agent.get('geocode_source', 'base'),
+            }
+            if agent.get('latitude') is not None and agent.get('longitude') is not None else None
+            for agent in agents_filtres
+        ]
+        manquants = [i for i, geocode in enumerate(geocodes) if geocode is None]
+        if manquants:
+            adresses = [agents_filtres[i].get('adresse', '') for i in manquants]
+            for i, geocode in zip(manquants, self.batch_geocode_adresses(adresses, budget=budget)):
+                geocodes[i] = geocode
         
         # Combiner avec les données agents
         points = []
@@ -769,24 +876,30 @@ class GeolocalisationManager:
                                    point2: Tuple[float, float], 
                                    mode: str = 'driving') -> Dict[str, Any]:
        
-        try:
-            # Utiliser OSRM pour une estimation précise
-            url = f"{self.osrm_base_url}/route/v1/{mode}/{point1[1]},{point1[0]};{point2[1]},{point2[0]}"
-            response = requests.get(url, timeout=5)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data['code'] == 'Ok':
-                    route = data['routes'][0]
-                    return {
-                        'duree_secondes': route['duration'],
-                        'duree_minutes': round(route['duration'] / 60, 1),
-                        'distance_metres': route['distance'],
-                        'distance_km': round(route['distance'] / 1000, 2),
-                        'source': 'osrm'
-                    }
-        except:
-            pass
+        disjoncteur_osrm = disjoncteur('osrm')
+        if disjoncteur_osrm.autoriser():
+            try:
+                # Utiliser OSRM pour une estimation précise
+                url = f"{self.osrm_base_url}/route/v1/{mode}/{point1[1]},{point1[0]};{point2[1]},{point2[0]}"
+                attendre_fournisseur('osrm')
+                response = fournisseur_externe().get('osrm', url, timeout=5)
+                
+                if response.status_code == 200:
+                    disjoncteur_osrm.succes()
+                    data = response.json()
+                    if data['code'] == 'Ok':
+                        route = data['routes'][0]
+                        return {
+                            'duree_secondes': route['duration'],
+                            'duree_minutes': round(route['duration'] / 60, 1),
+                            'distance_metres': route['distance'],
+                            'distance_km': round(route['distance'] / 1000, 2),
+                            'source': 'osrm'
+                        }
+                else:
+                    disjoncteur_osrm.echec()
+            except:
+                disjoncteur_osrm.echec()
         
         # Fallback: estimation simple (40 km/h en moyenne)
         distance_km = self.calculer_distance(point1, point2)
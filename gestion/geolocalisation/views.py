@@ -3,12 +3,19 @@ from django.shortcuts import render, redirect
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponse
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 import json
 from datetime import datetime, timedelta
 import os
+import time
 
 from .utils import GeolocalisationManager
+from .limites import metriques_limiteurs
+from .disjoncteurs import metriques_disjoncteurs
+from .index_spatial import IndexAgents, agents_proches_base, index_agents
+from .file_geocodage import planifier_geocodage
+from .repartition import accepter_repartition, proposer_repartition
 from gestion.models import Agent, Affectation, Course
 from gestion.utils import GestionnaireTransport
 
@@ -47,7 +54,7 @@ def optimiser_itineraire(request):
             
             # Charger les agents du planning
             gestionnaire = GestionnaireTransport()
-            if not gestionnaire.recharger_planning_depuis_session():
+            if not gestionnaire.recharger_planning_depuis_session(request.session.get('planning_id')):
                 return JsonResponse({'success': False, 'error': 'Planning non charge'})
             
             gestionnaire.dates_par_jour = request.session.get('gestionnaire_dates', {})
@@ -73,16 +80,46 @@ def optimiser_itineraire(request):
                     'error': f'Aucun agent trouve pour {jour} {type_transport} à {heure_str}'
                 })
             
-            # Géocoder les adresses
+            # Coordonnées enregistrées d'abord ; les adresses inconnues sont géocodées dans un budget
+            # de temps commun à toute la requête, au-delà la position reste provisoire
             geo_manager = GeolocalisationManager()
+            echeance = time.monotonic() + getattr(settings, 'GEOCODAGE_BUDGET_REQUETE', 2.0)
             agents_avec_coords = []
+            agents_db = Agent.objects.select_related('geocodage_en_attente').in_bulk(
+                [transport['agent_id'] for transport in liste_transports if transport.get('agent_id')]
+            )
+            sans_coordonnees = []
+            # Agents géocodés par adresse normalisée : un voisin de palier sans coordonnées prend les mêmes
+            agents_geocodes = {}
+            for agent in agents_db.values():
+                if agent.adresse_normalisee and agent.latitude is not None and agent.longitude is not None:
+                    agents_geocodes.setdefault(agent.adresse_normalisee, agent)
             
             for transport in liste_transports:
                 # L'heure de l'agent est déjà filtrée par traiter_donnees
                 # Donc tous les agents ici correspondent à l'heure
-                
-                # Géocoder l'adresse
-                result_geo = geo_manager.geocode_adresse(transport['adresse'])
+                agent = agents_db.get(transport.get('agent_id'))
+                if agent is not None and (agent.latitude is None or agent.longitude is None):
+                    reference = agents_geocodes.get(agent.adresse_normalisee)
+                else:
+                    reference = agent
+                if reference is not None:
+                    result_geo = {
+                        'latitude': reference.latitude,
+                        'longitude': reference.longitude,
+                        'success': True,
+                        'source': 'base',
+                        'adresse_formatee': reference.adresse_geocodee or transport['adresse'],
+                    }
+                    if reference is not agent:
+                        # Coordonnées recopiées en base par planifier_geocodage
+                        sans_coordonnees.append(agent)
+                else:
+                    # En attendant le worker : cache, quartier connu ou fournisseur si le budget le permet
+                    if agent is not None and not hasattr(agent, 'geocodage_en_attente'):
+                        sans_coordonnees.append(agent)
+                    result_geo = geo_manager.geocode_adresse(transport['adresse'],
+                                                             budget=max(echeance - time.monotonic(), 0))
                 
                 agent_data = {
                     'nom': transport['agent'],  # Changé de 'agent' à 'nom'
@@ -93,17 +130,22 @@ def optimiser_itineraire(request):
                     'telephone': transport['telephone'],
                     'heure': transport['heure'],  # Garder comme entier
                     'geocode_success': result_geo['success'],
+                    'geocode_source': result_geo['source'],
+                    'geocode_provisoire': result_geo.get('provisoire', False),
                     'adresse_formatee': result_geo.get('adresse_formatee', transport['adresse']),
                     'id': transport.get('agent_id')
                 }
                 agents_avec_coords.append(agent_data)
             
+            planifier_geocodage(sans_coordonnees)
+            
             # Optimiser l'itinéraire avec l'heure
             rapport = geo_manager.generer_rapport_optimisation(
                 agents_avec_coords,
                 jour,
                 type_transport,
-                heure_str  # Passer la chaîne pour l'affichage
+                heure_str,  # Passer la chaîne pour l'affichage
+                budget=max(echeance - time.monotonic(), 0)
             )
             
             if rapport:
@@ -183,3 +225,214 @@ def statistiques_geolocalisation(request):
         'taux_adresses': round((agents_avec_adresse / agents_total * 100), 1) if agents_total > 0 else 0,
     }
     return render(request, 'gestion/statistiques_geo.html', context)
+
+@login_required
+def api_metriques_limites(request):
+    "Métriques d'attente des limiteurs de débit et état des disjoncteurs (géocodage, routage)"
+    try:
+        return JsonResponse({
+            'success': True,
+            'limiteurs': metriques_limiteurs(),
+            'disjoncteurs': metriques_disjoncteurs()
+        })
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+RAYON_MAX_KM = 50
+LIMITE_MAX_AGENTS = 1000
+
+
+def _index_agents_chauffeur(chauffeur_id):
+    "Index limité aux agents géolocalisés des courses du chauffeur (à partir d'aujourd'hui)"
+    lignes = list(Agent.objects.filter(
+        affectation__chauffeur_id=chauffeur_id,
+        affectation__date_reelle__gte=timezone.localdate(),
+        latitude__isnull=False,
+        longitude__isnull=False
+    ).distinct().values_list('id', 'latitude', 'longitude'))
+    ids, latitudes, longitudes = zip(*lignes) if lignes else ((), (), ())
+    return IndexAgents(ids, latitudes, longitudes)
+
+
+def _rechercher_agents_proches(centres, rayon_km, k, exclure, index=None):
+    """Agents proches d'un ou plusieurs points (tracé) : {agent_id: distance_km au point le plus proche}.
+
+    index : index restreint (application chauffeur) ; par défaut tous les agents.
+    """
+    if index is None and getattr(settings, 'INDEX_AGENTS_MEMOIRE', True):
+        index = index_agents()
+    distances = {}
+    for latitude, longitude in centres:
+        if k:
+            if index is not None:
+                trouves = index.plus_proches(latitude, longitude, k, rayon_max_km=rayon_km, exclure=exclure)
+            else:
+                # Sans index mémoire : rayon élargi jusqu'à trouver k agents
+                rayon = min(1.0, rayon_km)
+                trouves = agents_proches_base(latitude, longitude, rayon, exclure)
+                while len(trouves) < k and rayon < rayon_km:
+                    rayon = min(rayon * 2, rayon_km)
+                    trouves = agents_proches_base(latitude, longitude, rayon, exclure)
+                trouves = trouves[:k]
+        elif index is not None:
+            trouves = index.rayon(latitude, longitude, rayon_km, exclure=exclure)
+        else:
+            trouves = agents_proches_base(latitude, longitude, rayon_km, exclure)
+        for agent_id, distance in trouves:
+            if distance < distances.get(agent_id, float('inf')):
+                distances[agent_id] = distance
+    return distances
+
+
+def api_agents_proches(request):
+    """Agents autour d'un point, d'un agent ou d'un tracé (rayon ou k plus proches).
+
+    Paramètres (GET ou JSON en POST, avec le jeton CSRF) : lat/lon, agent_id ou points [[lat, lon], ...] ;
+    rayon_km (2 par défaut, plafond en mode k), k, limite ; date (AAAA-MM-JJ) et type_transport pour
+    exclure les agents déjà affectés ce jour-là.
+    Depuis l'application chauffeur, seuls les agents des courses du chauffeur sont cherchés.
+    """
+    # Utilisable par le dispatch (utilisateur connecté) et l'application chauffeur (session mobile)
+    chauffeur_id = None if request.user.is_authenticated else request.session.get('chauffeur_id')
+    if not request.user.is_authenticated and not chauffeur_id:
+        return JsonResponse({'success': False, 'error': 'Non authentifié'}, status=401)
+    
+    try:
+        debut = time.perf_counter()
+        if request.method == 'POST':
+            data = json.loads(request.body or '{}')
+        else:
+            data = request.GET
+        
+        try:
+            # En mode k plus proches, le rayon est seulement un plafond
+            rayon_km = min(float(data.get('rayon_km') or (RAYON_MAX_KM if data.get('k') else 2)), RAYON_MAX_KM)
+            k = min(int(data['k']), LIMITE_MAX_AGENTS) if data.get('k') else None
+            limite = min(int(data.get('limite') or 100), LIMITE_MAX_AGENTS)
+            if rayon_km <= 0 or (k is not None and k <= 0) or limite <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False, 'error': 'rayon_km, k et limite doivent être des nombres positifs'})
+        
+        index = _index_agents_chauffeur(chauffeur_id) if chauffeur_id else None
+        
+        exclure = set()
+        if data.get('agent_id'):
+            agent = Agent.objects.filter(pk=data.get('agent_id')).first()
+            if agent is None or (index is not None and agent.pk not in index.ids):
+                return JsonResponse({'success': False, 'error': 'Agent introuvable'})
+            if agent.latitude is None or agent.longitude is None:
+                return JsonResponse({'success': False, 'error': "L'agent n'est pas encore géolocalisé"})
+            centres = [(agent.latitude, agent.longitude)]
+            exclure.add(agent.pk)
+        elif data.get('points'):
+            try:
+                centres = [(float(point[0]), float(point[1])) for point in data.get('points')]
+            except (TypeError, ValueError, IndexError):
+                return JsonResponse({'success': False, 'error': 'points doit être une liste de [lat, lon]'})
+        elif data.get('lat') and data.get('lon'):
+            try:
+                centres = [(float(data.get('lat')), float(data.get('lon')))]
+            except ValueError:
+                return JsonResponse({'success': False, 'error': 'Coordonnées invalides'})
+        else:
+            return JsonResponse({'success': False, 'error': 'Donnees manquantes: lat/lon, agent_id ou points'})
+        
+        if data.get('date'):
+            try:
+                date_obj = datetime.strptime(data.get('date'), '%Y-%m-%d').date()
+            except ValueError:
+                return JsonResponse({'success': False, 'error': 'Date invalide (AAAA-MM-JJ)'})
+            affectations = Affectation.objects.filter(date_reelle=date_obj)
+            if data.get('type_transport'):
+                affectations = affectations.filter(type_transport=data.get('type_transport'))
+            exclure.update(affectations.values_list('agent_id', flat=True))
+        
+        distances = _rechercher_agents_proches(centres, rayon_km, k, exclure, index)
+        plus_proches = sorted(distances.items(), key=lambda item: item[1])[:k or limite]
+        agents = Agent.objects.select_related('societe').in_bulk([agent_id for agent_id, _ in plus_proches])
+        
+        resultats = []
+        for agent_id, distance in plus_proches:
+            agent = agents.get(agent_id)
+            if agent is None:
+                # Supprimé depuis la construction de l'index
+                continue
+            resultats.append({
+                'id': agent.id,
+                'nom': agent.nom,
+                'adresse': agent.adresse,
+                'telephone': agent.telephone,
+                'societe': agent.get_societe_display(),
+                'latitude': agent.latitude,
+                'longitude': agent.longitude,
+                'distance_km': round(distance, 3),
+            })
+        
+        return JsonResponse({
+            'success': True,
+            'mode': 'k_plus_proches' if k else 'rayon',
+            'rayon_km': rayon_km,
+            'agents': resultats,
+            'nombre': len(resultats),
+            'duree_ms': round((time.perf_counter() - debut) * 1000, 2),
+        })
+    except Exception as e:
+        print(f"❌ Erreur recherche agents proches: {e}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+def _lire_creneau(data):
+    "date (AAAA-MM-JJ), type_transport et heure d'une requête de répartition ; ValueError si invalides"
+    date_reelle = datetime.strptime(data.get('date') or '', '%Y-%m-%d').date()
+    type_transport = data.get('type_transport')
+    if type_transport not in ('ramassage', 'depart'):
+        raise ValueError("type_transport doit être 'ramassage' ou 'depart'")
+    return date_reelle, type_transport, int(data.get('heure'))
+
+@login_required
+def api_proposer_repartition(request):
+    """Propose les courses d'un créneau (JSON en POST, avec le jeton CSRF) : date, type_transport, heure ;
+    chauffeurs (ids, optionnel : tous les chauffeurs actifs libres).
+    Le pool de processus vient de settings.REPARTITION uniquement."""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Methode non autorisee'})
+    
+    try:
+        data = json.loads(request.body or '{}')
+        try:
+            date_reelle, type_transport, heure = _lire_creneau(data)
+        except (TypeError, ValueError) as e:
+            return JsonResponse({'success': False, 'error': f'Créneau invalide: {e}'})
+        
+        proposition = proposer_repartition(date_reelle, type_transport, heure, chauffeur_ids=data.get('chauffeurs'))
+        return JsonResponse({'success': True, 'proposition': proposition})
+    
+    except Exception as e:
+        print(f"❌ Erreur proposition répartition: {e}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+@login_required
+def api_accepter_repartition(request):
+    """Crée en bloc les courses d'une proposition (JSON en POST, avec le jeton CSRF) : date, jour, type_transport, heure,
+    routes [{chauffeur_id, agents: [ids]}]."""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Methode non autorisee'})
+    
+    try:
+        data = json.loads(request.body or '{}')
+        try:
+            date_reelle, type_transport, heure = _lire_creneau(data)
+        except (TypeError, ValueError) as e:
+            return JsonResponse({'success': False, 'error': f'Créneau invalide: {e}'})
+        routes = data.get('routes') or []
+        if not data.get('jour') or not routes:
+            return JsonResponse({'success': False, 'error': 'Donnees manquantes: jour et routes'})
+        
+        resultat = accepter_repartition(date_reelle, data['jour'], type_transport, heure, routes)
+        return JsonResponse({'success': True, **resultat})
+    
+    except Exception as e:
+        print(f"❌ Erreur acceptation répartition: {e}")
+        return JsonResponse({'success': False, 'error': str(e)})
@@ -0,0 +1,168 @@
+# Imports du planning EMS en arrière-plan
+# Le parsing d'un gros EMS.xlsx et l'écriture des shifts prennent plusieurs
+# secondes : les exécuter dans la requête d'upload bloque un worker qui sert
+# aussi l'API mobile des chauffeurs. La vue d'upload se contente donc de
+# stocker la version et de créer un PlanningImport ; le travail est fait par un
+# pool de threads du processus, et la page d'upload interroge le statut en JSON.
+# Limites :
+#   - le parsing (openpyxl, pandas) est du calcul Python : dans un worker
+#     gunicorn, le thread d'import partage le GIL avec les requêtes de ce
+#     worker, qui restent servies mais plus lentement pendant l'import ;
+#   - le pool vit dans le processus : un redémarrage (déploiement) perd les
+#     imports en cours. Un import sans progression depuis
+#     PLANNING_IMPORT_DELAI_INTERROMPU minutes est marqué en erreur (voir
+#     marquer_imports_interrompus) ; il suffit de relancer l'upload.
+
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import PlanningImport
+
+# Un seul import à la fois par défaut : les imports écrivent les mêmes tables
+_executeur = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'PLANNING_IMPORT_WORKERS', 1),
+    thread_name_prefix='import_planning'
+)
+
+# Intervalle minimal entre deux écritures de progression en base
+INTERVALLE_PROGRESSION = 0.5
+# Minutes sans progression après lesquelles un import est considéré comme interrompu
+DELAI_INTERROMPU_DEFAUT = 10
+
+
+def lancer_import(planning_import):
+    "Soumet l'import au pool une fois la transaction courante validée (la ligne doit être visible du thread)"
+    import_id = planning_import.pk
+    transaction.on_commit(lambda: _executeur.submit(_executer_import, import_id))
+
+
+def limite_interruption():
+    "Date avant laquelle un import sans progression est considéré comme interrompu"
+    return timezone.now() - timedelta(minutes=getattr(settings, 'PLANNING_IMPORT_DELAI_INTERROMPU', DELAI_INTERROMPU_DEFAUT))
+
+
+def peut_etre_interrompu(planning_import):
+    "Import pas fini et sans progression depuis le délai : il faut vérifier les imports perdus"
+    return not planning_import.est_fini and planning_import.updated_at < limite_interruption()
+
+
+def marquer_imports_interrompus():
+    """Marque en erreur les imports perdus (processus redémarré) ; retourne leur nombre.
+
+    Un import en cours est perdu s'il n'a pas progressé depuis le délai ; un import en attente aussi,
+    sauf si un autre import progresse encore (il attend son tour dans le pool).
+    """
+    limite = limite_interruption()
+    interrompus = PlanningImport.objects.filter(statut='en_cours', updated_at__lt=limite)
+    if not PlanningImport.objects.filter(statut='en_cours', updated_at__gte=limite).exists():
+        interrompus = interrompus | PlanningImport.objects.filter(statut='en_attente', updated_at__lt=limite)
+    nombre = interrompus.update(
+        statut='erreur',
+        etape='Interrompu',
+        erreurs="Import interrompu (redémarrage du serveur ?) : veuillez recharger le fichier",
+        termine_at=timezone.now()
+    )
+    if nombre:
+        print(f"⚠️ {nombre} import(s) planning interrompu(s) marqué(s) en erreur")
+    return nombre
+
+
+def _suivi(import_id):
+    "Callback de progression : met à jour le PlanningImport, au plus toutes les INTERVALLE_PROGRESSION secondes"
+    derniere_ecriture = [0.0]
+    en_attente = {}
+
+    def signaler(**progression):
+        en_attente.update(progression)
+        maintenant = time.monotonic()
+        # Un changement d'étape est toujours écrit, les compteurs sont regroupés
+        if 'etape' not in progression and maintenant - derniere_ecriture[0] < INTERVALLE_PROGRESSION:
+            return
+        PlanningImport.objects.filter(pk=import_id).update(updated_at=timezone.now(), **en_attente)
+        en_attente.clear()
+        derniere_ecriture[0] = maintenant
+
+    def vider():
+        if en_attente:
+            PlanningImport.objects.filter(pk=import_id).update(updated_at=timezone.now(), **en_attente)
+            en_attente.clear()
+
+    signaler.vider = vider
+    return signaler
+
+
+def _executer_import(import_id):
+    "Exécute un import dans un thread du pool"
+    # Import local : utils importe les modèles et pandas, inutile au chargement des URLs
+    from .utils import GestionnaireTransport
+
+    close_old_connections()
+    try:
+        planning_import = PlanningImport.objects.get(pk=import_id)
+        # Déjà marqué interrompu pendant l'attente : ne pas le relancer
+        if not PlanningImport.objects.filter(pk=import_id, statut='en_attente').update(
+            statut='en_cours', etape='Démarrage', updated_at=timezone.now()
+        ):
+            print(f"⚠️ Import planning #{import_id} ignoré (statut {planning_import.statut})")
+            return
+        print(f"⏳ Import planning #{import_id} démarré ({planning_import.nom_fichier})")
+
+        gestionnaire = GestionnaireTransport()
+        suivi = _suivi(import_id)
+        gestionnaire.suivi_progression = suivi
+
+        if not gestionnaire.charger_planning_version(planning_import.planning_id):
+            suivi.vider()
+            # Version invalide : inutile de la conserver
+            chemin = gestionnaire.temp_path
+            if chemin and os.path.exists(chemin):
+                os.remove(chemin)
+            PlanningImport.objects.filter(pk=import_id).update(
+                statut='erreur',
+                etape='Fichier invalide',
+                erreurs=gestionnaire.erreur_chargement or 'Fichier invalide',
+                termine_at=timezone.now()
+            )
+            print(f"❌ Import planning #{import_id} en erreur: {gestionnaire.erreur_chargement}")
+            return
+
+        # Charger automatiquement le fichier agents par défaut s'il existe
+        agents_charges = False
+        info_path = os.path.join(settings.BASE_DIR, 'info.xlsx')
+        if os.path.exists(info_path):
+            suivi(etape='Chargement de info.xlsx')
+            agents_charges = bool(gestionnaire.charger_agents(info_path))
+        suivi.vider()
+
+        PlanningImport.objects.filter(pk=import_id).update(
+            statut='termine',
+            etape='Terminé',
+            nb_lignes=gestionnaire.infos_validation.get('nb_lignes', len(gestionnaire.df_planning)),
+            lignes_lues=gestionnaire.infos_validation.get('nb_lignes', len(gestionnaire.df_planning)),
+            agents_resolus=len(gestionnaire._infos_agents),
+            dates_par_jour=gestionnaire.dates_par_jour,
+            resume_modifications=gestionnaire.resume_modifications,
+            agents_charges=agents_charges,
+            termine_at=timezone.now()
+        )
+        print(f"✅ Import planning #{import_id} terminé")
+
+    except Exception as e:
+        print(f"❌ Erreur import planning #{import_id}: {e}")
+        traceback.print_exc()
+        PlanningImport.objects.filter(pk=import_id).update(
+            statut='erreur',
+            erreurs=str(e),
+            termine_at=timezone.now()
+        )
+    finally:
+        # Le thread est réutilisé par le pool : ne pas garder sa connexion ouverte
+        connection.close()
@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion.geolocalisation.benchmark import executer_benchmark_geocodage
+
+
+class Command(BaseCommand):
+    help = "Mesure le géocodage batch et le routage hors ligne avec le fournisseur de rejeu (réponses enregistrées)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--adresses', type=int, default=200, help="Nombre d'adresses synthétiques à géocoder")
+        parser.add_argument('--trajets', type=int, default=20, help="Nombre de trajets à estimer")
+        parser.add_argument('--fichier', help="Fichier de rejeu (.json ou enregistrement .jsonl) ; par défaut GEOCODAGE_REJEU_FICHIER")
+        parser.add_argument('--debit', action='append', default=[], metavar='FOURNISSEUR=REQ_S',
+                            help="Débit autorisé pour un fournisseur, ex. --debit nominatim=20")
+        parser.add_argument('--part-quartiers', type=float, default=0.5,
+                            help="Part des adresses dans un quartier connu du gazetteer (sans appel externe)")
+        parser.add_argument('--graine', type=int, default=0, help="Graine des adresses et des tirages du rejeu")
+        parser.add_argument('--json', dest='fichier_json', help="Écrire les mesures dans un fichier JSON")
+
+    def handle(self, *args, **options):
+        debits = {}
+        for debit in options['debit']:
+            fournisseur, _, valeur = debit.partition('=')
+            try:
+                debits[fournisseur] = float(valeur)
+            except ValueError:
+                raise CommandError(f"Débit invalide: {debit} (attendu FOURNISSEUR=REQ_S)")
+            if debits[fournisseur] <= 0:
+                raise CommandError(f"Débit invalide: {debit}")
+
+        mesures = executer_benchmark_geocodage(
+            nb_adresses=options['adresses'],
+            nb_trajets=options['trajets'],
+            fichier_rejeu=options['fichier'],
+            debits=debits,
+            part_quartiers=options['part_quartiers'],
+            graine=options['graine'],
+        )
+
+        for etape in ('geocodage', 'routage'):
+            mesure = mesures[etape]
+            self.stdout.write(
+                f"{etape:<10} {mesure['secondes']:>8.3f}s  appels: {mesure['appels_fournisseurs']:>5}  sources: {mesure['sources']}"
+            )
+        for limiteur in mesures['limiteurs']:
+            self.stdout.write(
+                f"limiteur {limiteur['fournisseur']:<14} appels: {limiteur['appels']:>5}  "
+                f"attente totale: {limiteur['attente_totale_s']:>7.2f}s  max: {limiteur['attente_max_s']:.2f}s"
+            )
+        for etat in mesures['disjoncteurs']:
+            self.stdout.write(
+                f"disjoncteur {etat['fournisseur']:<14} {etat['etat']:<12} ouvertures: {etat['ouvertures']:>3}  "
+                f"appels ignorés: {etat['appels_ignores']:>5}"
+            )
+
+        if options['fichier_json']:
+            with open(options['fichier_json'], 'w', encoding='utf-8') as f:
+                json.dump(mesures, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"✅ Mesures enregistrées dans {options['fichier_json']}"))
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion.benchmark import TAILLES_DEFAUT, executer_benchmark
+
+
+class Command(BaseCommand):
+    help = "Mesure le pipeline planning (temps, pic mémoire, requêtes SQL) sur des plannings EMS synthétiques"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tailles', type=int, nargs='+', default=TAILLES_DEFAUT,
+                            help="Nombres d'agents à générer (500 à 50000)")
+        parser.add_argument('--tous-les-jours', action='store_true',
+                            help="Mesurer chaque jour de la semaine (par défaut : Tous et Lundi)")
+        parser.add_argument('--sans-memoire', action='store_true',
+                            help="Désactiver tracemalloc (temps plus proches de la production)")
+        parser.add_argument('--graine', type=int, default=0, help="Graine du générateur")
+        parser.add_argument('--json', dest='fichier_json',
+                            help="Écrire les mesures dans un fichier JSON (comparaison entre commits)")
+
+    def handle(self, *args, **options):
+        for taille in options['tailles']:
+            if not 1 <= taille <= 50000:
+                raise CommandError(f"Taille invalide: {taille} (1 à 50000 agents)")
+
+        resultats = executer_benchmark(
+            tailles=options['tailles'],
+            tous_les_jours=options['tous_les_jours'],
+            memoire=not options['sans_memoire'],
+            graine=options['graine'],
+        )
+
+        self.stdout.write(f"{'Étape':<58} {'Agents':>7} {'Temps (s)':>10} {'Pic (Mo)':>9} {'Requêtes':>9}")
+        for mesure in resultats:
+            pic = '-' if mesure['pic_memoire_mo'] is None else f"{mesure['pic_memoire_mo']:.2f}"
+            self.stdout.write(
+                f"{mesure['etape']:<58} {mesure['taille']:>7} {mesure['secondes']:>10.4f} {pic:>9} {mesure['requetes']:>9}"
+            )
+
+        if options['fichier_json']:
+            with open(options['fichier_json'], 'w', encoding='utf-8') as f:
+                json.dump(resultats, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"✅ Mesures enregistrées dans {options['fichier_json']}"))
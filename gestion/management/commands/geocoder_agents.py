@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from gestion.geolocalisation.file_geocodage import planifier_geocodage, vider_file
+from gestion.models import Agent
+
+
+class Command(BaseCommand):
+    help = "Vide la file de géocodage des agents (à lancer aussi en tâche planifiée pour les nouvelles tentatives)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sans-coordonnees', action='store_true',
+                            help="Ajouter d'abord à la file tous les agents sans coordonnées")
+        parser.add_argument('--limite', type=int, default=None, help="Nombre maximal d'agents à traiter")
+
+    def handle(self, *args, **options):
+        if options['sans_coordonnees']:
+            agents = Agent.objects.filter(latitude__isnull=True, geocodage_en_attente__isnull=True)
+            self.stdout.write(f"🗺️ {planifier_geocodage(list(agents), lancer=False)} agent(s) ajouté(s) à la file")
+
+        geocodes, echecs = vider_file(limite=options['limite'])
+        self.stdout.write(self.style.SUCCESS(f"✅ {geocodes} agent(s) géocodé(s), {echecs} échec(s)"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from gestion.geolocalisation.adresses import normaliser_adresse
+from gestion.models import Agent
+
+
+class Command(BaseCommand):
+    help = ("Recalcule la clé d'adresse normalisée des agents (après la migration 0018 "
+            "ou une mise à jour du gazetteer)")
+
+    def handle(self, *args, **options):
+        agents = list(Agent.objects.only('id', 'adresse', 'adresse_normalisee'))
+        modifies = []
+        for agent in agents:
+            cle = normaliser_adresse(agent.adresse)
+            if cle != agent.adresse_normalisee:
+                agent.adresse_normalisee = cle
+                modifies.append(agent)
+        # bulk_update : Agent.save() n'est pas appelé, les coordonnées ne sont pas touchées
+        Agent.objects.bulk_update(modifies, ['adresse_normalisee'], batch_size=500)
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {len(modifies)} clé(s) d'adresse mise(s) à jour sur {len(agents)} agent(s)"
+        ))
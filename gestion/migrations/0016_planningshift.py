@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0015_alter_chauffeur_super_chauffeur'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanningShift',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_reelle', models.DateField()),
+                ('jour', models.CharField(max_length=20)),
+                ('heure_debut', models.IntegerField(verbose_name='Heure de début (ramassage)')),
+                ('heure_fin', models.IntegerField(verbose_name='Heure de fin (24h+ pour les shifts de nuit)')),
+                ('heure_depart', models.IntegerField(verbose_name='Heure de départ (fin ramenée sur 0-23h)')),
+                ('source_upload', models.CharField(db_index=True, max_length=64, verbose_name='Empreinte du planning uploadé')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('agent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gestion.agent')),
+            ],
+            options={
+                'verbose_name': 'Shift planning',
+                'verbose_name_plural': 'Shifts planning',
+                'ordering': ['date_reelle', 'heure_debut', 'agent__nom'],
+                'indexes': [models.Index(fields=['date_reelle', 'heure_debut'], name='shift_date_ramassage_idx'), models.Index(fields=['date_reelle', 'heure_depart'], name='shift_date_depart_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gestion', '0016_planningshift'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanningImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('planning_id', models.CharField(db_index=True, max_length=64, verbose_name='Version du planning')),
+                ('nom_fichier', models.CharField(max_length=255)),
+                ('taille', models.PositiveIntegerField(default=0)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('erreur', 'Erreur')], default='en_attente', max_length=20)),
+                ('etape', models.CharField(blank=True, max_length=100)),
+                ('lignes_lues', models.PositiveIntegerField(default=0)),
+                ('agents_resolus', models.PositiveIntegerField(default=0)),
+                ('nb_lignes', models.PositiveIntegerField(blank=True, null=True)),
+                ('erreurs', models.TextField(blank=True)),
+                ('dates_par_jour', models.JSONField(blank=True, default=dict)),
+                ('resume_modifications', models.JSONField(blank=True, null=True)),
+                ('agents_charges', models.BooleanField(default=False, verbose_name='info.xlsx chargé')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('termine_at', models.DateTimeField(blank=True, null=True)),
+                ('utilisateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Import planning',
+                'verbose_name_plural': 'Imports planning',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
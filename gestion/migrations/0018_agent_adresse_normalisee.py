@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:01
+
+from django.db import migrations, models
+
+# Les clés des agents existants sont calculées par la commande normaliser_adresses
+# (elle dépend du gazetteer, qui évolue : pas de code applicatif dans une migration)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0017_planningimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='adresse_normalisee',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='Adresse normalisée'),
+        ),
+    ]
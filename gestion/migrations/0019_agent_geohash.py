@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:08
+
+from django.db import migrations, models
+
+
+# Copie figée de index_spatial.encoder_geohash (précision 9) : la migration ne dépend pas du code applicatif
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encoder_geohash(latitude, longitude, precision=9):
+    intervalle_lat = [-90.0, 90.0]
+    intervalle_lon = [-180.0, 180.0]
+    caracteres = []
+    bits = 0
+    nb_bits = 0
+    longitude_suivante = True
+    while len(caracteres) < precision:
+        intervalle, valeur = (intervalle_lon, longitude) if longitude_suivante else (intervalle_lat, latitude)
+        milieu = (intervalle[0] + intervalle[1]) / 2
+        bits <<= 1
+        if valeur >= milieu:
+            bits |= 1
+            intervalle[0] = milieu
+        else:
+            intervalle[1] = milieu
+        longitude_suivante = not longitude_suivante
+        nb_bits += 1
+        if nb_bits == 5:
+            caracteres.append(BASE32[bits])
+            bits = 0
+            nb_bits = 0
+    return ''.join(caracteres)
+
+
+def remplir_geohash(apps, schema_editor):
+    Agent = apps.get_model('gestion', 'Agent')
+    agents = list(Agent.objects.filter(latitude__isnull=False, longitude__isnull=False).only('id', 'latitude', 'longitude'))
+    for agent in agents:
+        agent.geohash = encoder_geohash(agent.latitude, agent.longitude)
+    Agent.objects.bulk_update(agents, ['geohash'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0018_agent_adresse_normalisee'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=12, verbose_name='Geohash'),
+        ),
+        migrations.RunPython(remplir_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0019_agent_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chauffeur',
+            name='nombre_places',
+            field=models.PositiveSmallIntegerField(default=4, help_text='Agents transportés au maximum par course (répartition automatique)', verbose_name='Nombre de places'),
+        ),
+    ]
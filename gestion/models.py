@@ -43,6 +43,11 @@ class Chauffeur(models.Model):
     telephone = models.CharField(max_length=20)
     numero_identite = models.CharField(max_length=50, blank=True, null=True)
     numero_voiture = models.CharField(max_length=50, blank=True, null=True)
+    nombre_places = models.PositiveSmallIntegerField(
+        default=4,
+        verbose_name="Nombre de places",
+        help_text="Agents transportés au maximum par course (répartition automatique)"
+    )
     societe = models.CharField(max_length=100, blank=True, null=True)
     adresse = models.TextField(blank=True, null=True, verbose_name="Adresse complète")
     email = models.EmailField(blank=True, null=True, verbose_name="Adresse email")
@@ -207,6 +212,13 @@ class HeureTransport(models.Model):
 class Agent(models.Model):
     nom = models.CharField(max_length=200, unique=True)
     adresse = models.TextField()
+    adresse_normalisee = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        db_index=True,
+        verbose_name="Adresse normalisée"
+    )
     telephone = models.CharField(max_length=20)
     societe = models.ForeignKey(Societe, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Société")
     societe_texte = models.CharField(max_length=100, blank=True, null=True)
@@ -214,6 +226,7 @@ class Agent(models.Model):
     
     latitude = models.FloatField(null=True, blank=True, verbose_name="Latitude")
     longitude = models.FloatField(null=True, blank=True, verbose_name="Longitude")
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True, verbose_name="Geohash")
     adresse_geocodee = models.TextField(blank=True, null=True, verbose_name="Adresse géocodée")
     derniere_geolocalisation = models.DateTimeField(null=True, blank=True)
     
@@ -235,15 +248,32 @@ class Agent(models.Model):
     
     def save(self, *args, **kwargs):
         # Si les coordonnées changent, marquer comme corrigé manuellement
+        coordonnees_modifiees = self.latitude is not None
         if self.pk:
             old_agent = Agent.objects.get(pk=self.pk)
-            if (old_agent.latitude != self.latitude or 
-                old_agent.longitude != self.longitude):
+            coordonnees_modifiees = (old_agent.latitude != self.latitude or 
+                                     old_agent.longitude != self.longitude)
+            if coordonnees_modifiees:
                 self.corrige_manuellement = True
                 from django.utils import timezone
                 self.date_correction_coords = timezone.now()
         
+        # Clé de regroupement des agents qui partagent une adresse
+        from gestion.geolocalisation.adresses import normaliser_adresse
+        from gestion.geolocalisation.index_spatial import encoder_geohash, invalider_index_agents
+        self.adresse_normalisee = normaliser_adresse(self.adresse)
+        self.geohash = encoder_geohash(self.latitude, self.longitude)
+        
         super().save(*args, **kwargs)
+        
+        # Index spatial des agents à reconstruire (après le commit, pour que les autres processus relisent la base)
+        if coordonnees_modifiees:
+            from django.db import transaction
+            transaction.on_commit(invalider_index_agents)
+        # Position corrigée à la main : le géocodage en attente ne doit plus l'écraser
+        if coordonnees_modifiees and self.corrige_manuellement:
+            from gestion.geolocalisation.models import GeocodageAgent
+            GeocodageAgent.objects.filter(agent_id=self.pk).delete()
     class Meta:
         verbose_name = "Agent"
         verbose_name_plural = "Agents"
@@ -286,27 +316,15 @@ class Agent(models.Model):
         if not self.adresse:
             return False
             
-        # Liste des corrections d'adresses
-        corrections = {
-            'hay riadh': 'Hay Riadh, Sousse, Tunisie',
-            'cite ghodrane': 'Cite Ghodrane, Sousse, Tunisie',
-            'ariana ville': 'Ariana Ville, Sousse, Tunisie',
-            'lac 2': 'Lac 2, Sousse, Tunisie',
-            'ghodrane': 'Cite Ghodrane, Sousse, Tunisie',
-            'riadh': 'Hay Riadh, Sousse, Tunisie',
-            'lac': 'Lac 2, Sousse, Tunisie'
-        }
-        
-        adresse_lower = self.adresse.lower()
-        
-        for mot_cle, adresse_corrigee in corrections.items():
-            if mot_cle in adresse_lower:
-                self.adresse = adresse_corrigee
-                self.save()
-                print(f"✅ Adresse corrigée: {self.nom} → {adresse_corrigee}")
-                return True
+        from gestion.geolocalisation.gazetteer import gazetteer
+        quartier = gazetteer().rechercher(self.adresse)
+        if quartier is None or quartier['adresse'] == self.adresse:
+            return False
         
-        return False
+        self.adresse = quartier['adresse']
+        self.save()
+        print(f"✅ Adresse corrigée: {self.nom} → {self.adresse}")
+        return True
 class Course(models.Model):
     chauffeur = models.ForeignKey(Chauffeur, on_delete=models.CASCADE)
     type_transport = models.CharField(max_length=20, choices=[('ramassage', 'Ramassage'), ('depart', 'Depart')])
@@ -594,3 +612,101 @@ class Affectation(models.Model):
         if self.course:
             self.prix_societe = self.course.get_prix_par_societe()
         super().save(*args, **kwargs)
+
+
+class PlanningShift(models.Model):
+    "Shift d'un agent issu d'un upload du planning EMS (un par agent et par jour travaillé)"
+    agent = models.ForeignKey(Agent, on_delete=models.CASCADE)
+    date_reelle = models.DateField()
+    jour = models.CharField(max_length=20)
+    heure_debut = models.IntegerField(verbose_name="Heure de début (ramassage)")
+    heure_fin = models.IntegerField(verbose_name="Heure de fin (24h+ pour les shifts de nuit)")
+    heure_depart = models.IntegerField(verbose_name="Heure de départ (fin ramenée sur 0-23h)")
+    source_upload = models.CharField(max_length=64, db_index=True, verbose_name="Empreinte du planning uploadé")
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Shift planning"
+        verbose_name_plural = "Shifts planning"
+        ordering = ['date_reelle', 'heure_debut', 'agent__nom']
+        indexes = [
+            models.Index(fields=['date_reelle', 'heure_debut'], name='shift_date_ramassage_idx'),
+            models.Index(fields=['date_reelle', 'heure_depart'], name='shift_date_depart_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.agent.nom} - {self.jour} {self.date_reelle} ({self.heure_debut}h-{self.heure_fin}h)"
+    
+    @staticmethod
+    def champ_heure(type_transport):
+        "Colonne comparée pour un type de transport"
+        return 'heure_debut' if type_transport == 'ramassage' else 'heure_depart'
+    
+    @classmethod
+    def non_affectes(cls, date_reelle, type_transport, heures=None):
+        """Shifts du jour dont l'agent n'a encore aucune affectation ce jour-là.
+
+        Anti-jointure SQL (NOT EXISTS sur Affectation) ; les agents avec voiture
+        personnelle sont exclus.
+        """
+        champ = cls.champ_heure(type_transport)
+        shifts = cls.objects.filter(
+            date_reelle=date_reelle,
+            agent__voiture_personnelle=False
+        ).exclude(
+            models.Exists(Affectation.objects.filter(
+                agent_id=models.OuterRef('agent_id'),
+                date_reelle=models.OuterRef('date_reelle')
+            ))
+        )
+        if heures is not None:
+            heures = [int(heure) for heure in heures]
+            if type_transport == 'depart':
+                heures = [heure - 24 if heure >= 24 else heure for heure in heures]
+            shifts = shifts.filter(**{f'{champ}__in': heures})
+        return shifts.select_related('agent')
+
+
+class PlanningImport(models.Model):
+    "Import d'un planning EMS exécuté en arrière-plan (suivi de progression pour la page d'upload)"
+    STATUT_CHOICES = [
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('termine', 'Terminé'),
+        ('erreur', 'Erreur'),
+    ]
+    
+    planning_id = models.CharField(max_length=64, db_index=True, verbose_name="Version du planning")
+    nom_fichier = models.CharField(max_length=255)
+    taille = models.PositiveIntegerField(default=0)
+    content_type = models.CharField(max_length=100, blank=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_attente')
+    etape = models.CharField(max_length=100, blank=True)
+    lignes_lues = models.PositiveIntegerField(default=0)
+    agents_resolus = models.PositiveIntegerField(default=0)
+    nb_lignes = models.PositiveIntegerField(null=True, blank=True)
+    erreurs = models.TextField(blank=True)
+    dates_par_jour = models.JSONField(default=dict, blank=True)
+    resume_modifications = models.JSONField(null=True, blank=True)
+    agents_charges = models.BooleanField(default=False, verbose_name="info.xlsx chargé")
+    utilisateur = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    termine_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Import planning"
+        verbose_name_plural = "Imports planning"
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.nom_fichier} ({self.get_statut_display()})"
+    
+    @property
+    def est_fini(self):
+        return self.statut in ('termine', 'erreur')
@@ -0,0 +1,577 @@
+# Instantané binaire du planning EMS.xlsx
+# Le fichier Excel n'est parsé qu'une seule fois par upload : les shifts
+# (agent x jour -> heure début / heure fin) et les dates extraites sont
+# sauvegardés dans un .npz identifié par l'empreinte SHA-256 du fichier.
+# L'extraction des heures est vectorisée (opérations pandas .str sur les
+# valeurs uniques de la grille) au lieu d'un regex Python par cellule.
+
+import bisect
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+VERSION_INSTANTANE = 1
+JOURS_SEMAINE = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
+SANS_HEURE = -1
+
+# Mêmes règles que GestionnaireTransport.extraire_heures
+MOTS_REPOS = ['', 'REPOS', 'ABSENCE', 'OFF', 'MALADIE', 'CONGÉ PAYÉ', 'CONGÉ MATERNITÉ']
+MOTIFS_HEURES = [
+    r'(\d{1,2})H?\s*[-]\s*(\d{1,2})H?',
+    r'(\d{1,2})H\s*(\d{1,2})H',
+    r'(\d{1,2})\s*[-]\s*(\d{1,2})',
+    r'R\s*(\d{1,2})H?\s*[-]\s*(\d{1,2})H?',
+    # Dernier recours : les deux premiers nombres isolés du texte
+    r'\b(\d{1,2})\b.*?\b(\d{1,2})\b',
+]
+
+# Structure du fichier EMS : ligne 0 titre, ligne 1 jours + dates, données ensuite
+LIGNES_ENTETE = 2
+LIGNES_RECHERCHE_DATES = 3
+COLONNES_PLANNING = ['Salarie', 'Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche', 'Qualification']
+# Textes que pandas.read_excel considère comme vides (na_values par défaut)
+VALEURS_VIDES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null',
+}
+
+# Instantanés déjà chargés dans ce processus (empreinte -> InstantanePlanning)
+_instantanes_memoire = OrderedDict()
+_TAILLE_MEMOIRE = 8
+
+
+def extraire_heures_vectorise(valeurs):
+    """Version vectorisée de extraire_heures pour un ensemble de cellules.
+
+    Retourne deux tableaux int16 (début, fin) alignés sur `valeurs`, avec
+    SANS_HEURE pour les repos, absences et cellules illisibles.
+    """
+    serie = pd.Series(valeurs, dtype=object)
+    debut = np.full(len(serie), SANS_HEURE, dtype=np.int16)
+    fin = np.full(len(serie), SANS_HEURE, dtype=np.int16)
+    if serie.empty:
+        return debut, fin
+
+    manquant = serie.isna().to_numpy()
+    # Les plannings répètent beaucoup les mêmes libellés ("16h-1h", "REPOS"...) :
+    # on ne traite que les valeurs distinctes puis on redistribue
+    codes, uniques = pd.factorize(serie.astype(str))
+    textes = pd.Series(uniques, dtype=object).str.strip()
+
+    debut_u = np.full(len(textes), SANS_HEURE, dtype=np.int16)
+    fin_u = np.full(len(textes), SANS_HEURE, dtype=np.int16)
+
+    a_traiter = ~textes.isin(MOTS_REPOS).to_numpy()
+    propres = (
+        textes.str.upper()
+        .str.replace(r'[^0-9H\s\-:]', ' ', regex=True)
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+
+    for motif in MOTIFS_HEURES:
+        if not a_traiter.any():
+            break
+        extrait = propres[a_traiter].str.extract(motif)
+        trouve = extrait[0].notna().to_numpy()
+        positions = extrait.index.to_numpy()[trouve]
+        debut_u[positions] = extrait[0][trouve].astype(np.int16).to_numpy()
+        fin_u[positions] = extrait[1][trouve].astype(np.int16).to_numpy()
+        a_traiter[positions] = False
+
+    # Shift de nuit : fin avant le début (ex. 22h-6h) -> fin le lendemain
+    nuit = (fin_u != SANS_HEURE) & (fin_u < debut_u) & (fin_u < 12)
+    fin_u[nuit] += 24
+
+    debut[:] = debut_u[codes]
+    fin[:] = fin_u[codes]
+    debut[manquant] = SANS_HEURE
+    fin[manquant] = SANS_HEURE
+    return debut, fin
+
+
+def _valeur_cellule(valeur):
+    "Même conversion que le lecteur openpyxl de pandas (entiers restitués en int, textes vides -> None)"
+    if isinstance(valeur, float) and valeur.is_integer():
+        return int(valeur)
+    if isinstance(valeur, str) and valeur in VALEURS_VIDES:
+        return None
+    return valeur
+
+
+def parcourir_planning(chemin):
+    """Lecture du classeur en une seule passe (openpyxl en lecture seule).
+
+    Générateur d'événements, dans l'ordre du fichier :
+      ('entete', index, valeurs)  pour les LIGNES_RECHERCHE_DATES premières lignes
+      ('validation', infos)       une fois les lignes d'en-tête lues
+      ('shift', valeurs)          pour chaque ligne de données non vide
+      ('fin', infos)              nombre de lignes et de colonnes lues
+    Seule la ligne courante est en mémoire : le classeur n'est jamais chargé en entier.
+    """
+    from openpyxl import load_workbook
+
+    classeur = load_workbook(chemin, read_only=True, data_only=True, keep_links=False)
+    try:
+        feuille = classeur.worksheets[0]
+        feuille.reset_dimensions()
+
+        nb_colonnes = 0
+        nb_lignes = 0
+        entete_lu = False
+        for index, ligne in enumerate(feuille.iter_rows(values_only=True)):
+            valeurs = [_valeur_cellule(valeur) for valeur in ligne]
+            while valeurs and valeurs[-1] is None:
+                valeurs.pop()
+            nb_colonnes = max(nb_colonnes, len(valeurs))
+
+            if index < LIGNES_RECHERCHE_DATES:
+                yield ('entete', index, valeurs)
+            if index == LIGNES_ENTETE - 1:
+                entete_lu = True
+                yield ('validation', {'feuille': feuille.title, 'nb_colonnes': nb_colonnes})
+            if index >= LIGNES_ENTETE and any(v is not None for v in valeurs):
+                nb_lignes += 1
+                yield ('shift', valeurs[:len(COLONNES_PLANNING)])
+
+        if not entete_lu or not nb_colonnes:
+            raise ValueError("Fichier planning vide ou sans ligne d'en-tête")
+        yield ('fin', {'nb_lignes': nb_lignes, 'nb_colonnes': nb_colonnes})
+    finally:
+        classeur.close()
+
+
+def grille_heures(df_planning):
+    "Heures début/fin (n x 7) de toute la grille du planning, en une passe"
+    n = len(df_planning)
+    jours_presents = [jour for jour in JOURS_SEMAINE if jour in df_planning.columns]
+    debut = np.full((n, len(JOURS_SEMAINE)), SANS_HEURE, dtype=np.int16)
+    fin = np.full((n, len(JOURS_SEMAINE)), SANS_HEURE, dtype=np.int16)
+    if n == 0 or not jours_presents:
+        return debut, fin
+
+    # Colonne par colonne -> une seule série (ordre agent-majeur)
+    valeurs = df_planning[jours_presents].to_numpy(dtype=object).reshape(-1)
+    debut_plat, fin_plat = extraire_heures_vectorise(valeurs)
+    colonnes = [JOURS_SEMAINE.index(jour) for jour in jours_presents]
+    debut[:, colonnes] = debut_plat.reshape(n, len(jours_presents))
+    fin[:, colonnes] = fin_plat.reshape(n, len(jours_presents))
+    return debut, fin
+
+
+def construire_table_shifts(noms, noms_manquants, debut, fin, jours_presents):
+    """Table typée (agent_idx, jour, debut, fin, repos) d'un planning.
+
+    Une ligne par agent nommé et par jour présent dans le fichier, dans l'ordre
+    agent puis jour. `jour` est l'index dans JOURS_SEMAINE.
+    """
+    noms = np.char.strip(np.asarray(noms, dtype=str))
+    agents = np.flatnonzero(~np.asarray(noms_manquants, dtype=bool) & (noms != ''))
+    jours = np.array([JOURS_SEMAINE.index(j) for j in JOURS_SEMAINE if j in jours_presents], dtype=np.int8)
+
+    agent_idx = np.repeat(agents, len(jours)).astype(np.int32)
+    jour = np.tile(jours, len(agents))
+    table = pd.DataFrame({
+        'agent_idx': agent_idx,
+        'jour': jour,
+        'debut': debut[agent_idx, jour] if len(agent_idx) else np.array([], dtype=np.int16),
+        'fin': fin[agent_idx, jour] if len(agent_idx) else np.array([], dtype=np.int16),
+    })
+    table['repos'] = table['debut'].to_numpy() == SANS_HEURE
+    return table
+
+
+class IndexTransports:
+    """Index inversé (jour, type_transport, heure) -> shifts d'un instantané.
+
+    `heure` est l'heure de comparaison : début ajusté pour un ramassage, fin
+    ajustée ramenée sur 0-23 pour un départ (un départ à 25h répond à 1h).
+    Chaque entrée contient (agent_idx, heure, heure_affichee) dans l'ordre des
+    agents du planning.
+    """
+
+    TYPES = ('ramassage', 'depart')
+
+    def __init__(self, table, decalage=0):
+        self.decalage = decalage
+        self._entrees = {}
+        self._agents_par_jour = {}
+
+        actifs = table[~table['repos'].to_numpy()]
+        agents = actifs['agent_idx'].to_numpy()
+        jours = actifs['jour'].to_numpy()
+        debut = actifs['debut'].to_numpy().astype(np.int32) - decalage
+        fin = actifs['fin'].to_numpy().astype(np.int32) - decalage
+        fin_comparaison = np.where(fin >= 24, fin - 24, fin)
+
+        for jour in np.unique(jours).tolist():
+            self._agents_par_jour[jour] = frozenset(agents[jours == jour].tolist())
+
+        self._indexer('ramassage', agents, jours, debut, debut, debut)
+        self._indexer('depart', agents, jours, fin_comparaison, fin, fin_comparaison)
+
+    def _indexer(self, type_transport, agents, jours, cles, heures, affichees):
+        if not len(agents):
+            return
+        # Tri par (jour, heure de comparaison, agent) puis découpage en groupes contigus
+        ordre = np.lexsort((agents, cles, jours))
+        jours, cles = jours[ordre], cles[ordre]
+        agents, heures, affichees = agents[ordre], heures[ordre], affichees[ordre]
+        ruptures = np.flatnonzero((np.diff(jours) != 0) | (np.diff(cles) != 0)) + 1
+        bornes = np.concatenate(([0], ruptures, [len(agents)]))
+        for debut_groupe, fin_groupe in zip(bornes[:-1].tolist(), bornes[1:].tolist()):
+            cle = (int(jours[debut_groupe]), type_transport, int(cles[debut_groupe]))
+            self._entrees[cle] = list(zip(
+                agents[debut_groupe:fin_groupe].tolist(),
+                heures[debut_groupe:fin_groupe].tolist(),
+                affichees[debut_groupe:fin_groupe].tolist(),
+            ))
+
+    def _cles_shift(self, jour, debut, fin):
+        "Clés d'index (et valeurs stockées) d'un shift brut pour ce décalage horaire"
+        debut = debut - self.decalage
+        fin = fin - self.decalage
+        fin_comparaison = fin - 24 if fin >= 24 else fin
+        return [
+            ((jour, 'ramassage', debut), debut, debut),
+            ((jour, 'depart', fin_comparaison), fin, fin_comparaison),
+        ]
+
+    def appliquer_changements(self, changements):
+        """Nouvel index dérivé de celui-ci en ne touchant que les (agent, jour) modifiés.
+
+        `changements` : (agent_idx, jour, ancien, nouveau) où ancien/nouveau valent
+        (debut, fin) ou None (repos / absent). Les agent_idx doivent être les mêmes
+        dans les deux versions. Les listes non modifiées sont partagées.
+        """
+        index = IndexTransports.__new__(IndexTransports)
+        index.decalage = self.decalage
+        index._entrees = dict(self._entrees)
+        index._agents_par_jour = dict(self._agents_par_jour)
+        copiees = set()
+
+        def liste_modifiable(cle):
+            if cle not in copiees:
+                index._entrees[cle] = list(index._entrees.get(cle, []))
+                copiees.add(cle)
+            return index._entrees[cle]
+
+        for agent_idx, jour, ancien, nouveau in changements:
+            if ancien is not None:
+                for cle, heure, affichee in self._cles_shift(jour, *ancien):
+                    entrees = liste_modifiable(cle)
+                    position = bisect.bisect_left(entrees, (agent_idx,))
+                    if position < len(entrees) and entrees[position][0] == agent_idx:
+                        del entrees[position]
+                    if not entrees:
+                        del index._entrees[cle]
+                        copiees.discard(cle)
+            if nouveau is not None:
+                for cle, heure, affichee in self._cles_shift(jour, *nouveau):
+                    bisect.insort(liste_modifiable(cle), (agent_idx, heure, affichee))
+
+            agents_jour = set(index._agents_par_jour.get(jour, frozenset()))
+            if nouveau is None:
+                agents_jour.discard(agent_idx)
+            else:
+                agents_jour.add(agent_idx)
+            index._agents_par_jour[jour] = frozenset(agents_jour)
+
+        return index
+
+    def rechercher(self, jour, type_transport, heure):
+        "Shifts (agent_idx, heure, heure_affichee) pour un jour (index ou nom), un type et une heure"
+        if isinstance(jour, str):
+            if jour not in JOURS_SEMAINE:
+                return []
+            jour = JOURS_SEMAINE.index(jour)
+        heure = int(heure)
+        if type_transport == 'depart' and heure >= 24:
+            heure -= 24
+        return self._entrees.get((jour, type_transport, heure), [])
+
+    def travaille(self, agent_indices, jour):
+        "True si l'un de ces agent_idx a un shift (hors repos) ce jour-là"
+        agents = self.agents_du_jour(jour)
+        return any(agent_idx in agents for agent_idx in agent_indices)
+
+    def agents_du_jour(self, jour):
+        "agent_idx des agents qui travaillent ce jour (hors repos)"
+        if isinstance(jour, str):
+            if jour not in JOURS_SEMAINE:
+                return frozenset()
+            jour = JOURS_SEMAINE.index(jour)
+        return self._agents_par_jour.get(jour, frozenset())
+
+
+class DiffPlanning:
+    """Différences (agent, jour) entre deux instantanés du planning.
+
+    `changements` : (nom, agent_idx, jour, ancien, nouveau) avec ancien/nouveau
+    = (debut, fin) ou None pour un repos / un agent absent de la version.
+    """
+
+    def __init__(self, ancien, nouveau):
+        self.ancien = ancien
+        self.nouveau = nouveau
+        self.changements = []
+        self.agents_ajoutes = []
+        self.agents_supprimes = []
+
+        noms_anciens = ancien.noms_agents()
+        noms_nouveaux = nouveau.noms_agents()
+        # Même liste d'agents dans le même ordre : comparaison ligne à ligne, agent_idx inchangés
+        self.meme_ordre = noms_anciens == noms_nouveaux and ancien.colonnes == nouveau.colonnes
+
+        if self.meme_ordre:
+            lignes = np.asarray(nouveau.table_shifts()['agent_idx'].unique(), dtype=np.int64)
+            self._comparer(lignes, lignes)
+            return
+
+        positions_anciennes = self._positions(ancien)
+        positions_nouvelles = self._positions(nouveau)
+        communs = [nom for nom in positions_nouvelles if nom in positions_anciennes]
+        self._comparer(
+            np.array([positions_anciennes[nom] for nom in communs], dtype=np.int64),
+            np.array([positions_nouvelles[nom] for nom in communs], dtype=np.int64),
+        )
+
+        for nom, idx in positions_nouvelles.items():
+            if nom not in positions_anciennes:
+                self.agents_ajoutes.append(nom)
+                self._ajouter_ligne(nom, idx, nouveau, nouveau_cote=True)
+        for nom, idx in positions_anciennes.items():
+            if nom not in positions_nouvelles:
+                self.agents_supprimes.append(nom)
+                self._ajouter_ligne(nom, idx, ancien, nouveau_cote=False)
+
+    @staticmethod
+    def _positions(instantane):
+        "Nom -> agent_idx (première occurrence) des agents nommés"
+        noms = instantane.noms_agents()
+        positions = {}
+        for idx in instantane.table_shifts()['agent_idx'].unique().tolist():
+            positions.setdefault(noms[idx], idx)
+        return positions
+
+    @staticmethod
+    def _shift(instantane, idx, jour):
+        debut = int(instantane.debut[idx, jour])
+        return None if debut == SANS_HEURE else (debut, int(instantane.fin[idx, jour]))
+
+    def _comparer(self, idx_anciens, idx_nouveaux):
+        if not len(idx_nouveaux):
+            return
+        differents = (
+            (self.ancien.debut[idx_anciens] != self.nouveau.debut[idx_nouveaux])
+            | (self.ancien.fin[idx_anciens] != self.nouveau.fin[idx_nouveaux])
+        )
+        noms = self.nouveau.noms_agents()
+        for ligne, jour in zip(*np.nonzero(differents)):
+            idx_ancien, idx_nouveau = int(idx_anciens[ligne]), int(idx_nouveaux[ligne])
+            self.changements.append((
+                noms[idx_nouveau], idx_nouveau, int(jour),
+                self._shift(self.ancien, idx_ancien, jour),
+                self._shift(self.nouveau, idx_nouveau, jour),
+            ))
+
+    def _ajouter_ligne(self, nom, idx, instantane, nouveau_cote):
+        for jour in range(len(JOURS_SEMAINE)):
+            shift = self._shift(instantane, idx, jour)
+            if shift is None:
+                continue
+            if nouveau_cote:
+                self.changements.append((nom, idx, jour, None, shift))
+            else:
+                self.changements.append((nom, None, jour, shift, None))
+
+    def resume(self):
+        "Résumé lisible des modifications (pour l'utilisateur et les logs)"
+        heures_deplacees = [
+            {
+                'agent': nom,
+                'jour': JOURS_SEMAINE[jour],
+                'avant': f"{ancien[0]}h-{ancien[1] % 24}h",
+                'apres': f"{nouveau[0]}h-{nouveau[1] % 24}h",
+            }
+            for nom, _, jour, ancien, nouveau in self.changements
+            if ancien is not None and nouveau is not None
+        ]
+        return {
+            'agents_ajoutes': list(self.agents_ajoutes),
+            'agents_supprimes': list(self.agents_supprimes),
+            'heures_deplacees': heures_deplacees,
+            'shifts_ajoutes': sum(1 for c in self.changements if c[3] is None),
+            'shifts_supprimes': sum(1 for c in self.changements if c[4] is None),
+            'total_changements': len(self.changements),
+        }
+
+
+def nettoyer_instantanes(dossier, conserver=None):
+    "Supprime les instantanés les plus anciens (par date de modification) au-delà de `conserver`"
+    if conserver is None:
+        from django.conf import settings
+        conserver = getattr(settings, 'PLANNING_VERSIONS_CONSERVEES', 10)
+    try:
+        chemins = [
+            os.path.join(dossier, nom) for nom in os.listdir(dossier)
+            if nom.startswith('planning_') and nom.endswith('.npz')
+        ]
+    except OSError:
+        return 0
+    def date_modification(chemin):
+        try:
+            return os.path.getmtime(chemin)
+        except OSError:
+            return 0
+
+    chemins.sort(key=date_modification, reverse=True)
+    for chemin in chemins[conserver:]:
+        try:
+            os.remove(chemin)
+        except OSError:
+            pass
+    return max(len(chemins) - conserver, 0)
+
+
+def _memoriser(instantane):
+    _instantanes_memoire[instantane.empreinte] = instantane
+    _instantanes_memoire.move_to_end(instantane.empreinte)
+    while len(_instantanes_memoire) > _TAILLE_MEMOIRE:
+        _instantanes_memoire.popitem(last=False)
+
+
+class InstantanePlanning:
+    "Forme compacte du planning parsé : cellules brutes, heures début/fin par jour et dates réelles"
+
+    def __init__(self, empreinte, colonnes, cellules, manquants, debut, fin, dates_par_jour):
+        self.empreinte = empreinte
+        self.colonnes = list(colonnes)
+        self.cellules = cellules      # (n, nb_colonnes) texte brut des cellules
+        self.manquants = manquants    # (n, nb_colonnes) True si la cellule était vide
+        self.debut = debut            # (n, 7) int16, SANS_HEURE si repos / non lisible
+        self.fin = fin                # (n, 7) int16, fin de nuit déjà passée en +24
+        self.dates_par_jour = dict(dates_par_jour)
+        self._table = None
+        self._index = {}
+        self._noms_agents = None
+        self._indices_par_nom = None
+
+    @property
+    def noms(self):
+        return self.cellules[:, 0] if len(self.colonnes) else np.array([], dtype=str)
+
+    def noms_agents(self):
+        "Noms nettoyés des agents, indexés comme agent_idx"
+        if self._noms_agents is None:
+            self._noms_agents = [str(nom).strip() for nom in self.noms.tolist()]
+        return self._noms_agents
+
+    def indices_par_nom(self):
+        "Nom -> agent_idx des lignes de cet agent (un nom peut apparaître plusieurs fois)"
+        if self._indices_par_nom is None:
+            indices = {}
+            for agent_idx, nom in enumerate(self.noms_agents()):
+                indices.setdefault(nom, []).append(agent_idx)
+            self._indices_par_nom = indices
+        return self._indices_par_nom
+
+    @classmethod
+    def depuis_dataframe(cls, empreinte, df_planning, dates_par_jour):
+        n = len(df_planning)
+        colonnes = list(df_planning.columns)
+
+        manquants = df_planning.isna().to_numpy(dtype=bool).reshape(n, len(colonnes))
+        cellules = df_planning.astype(str).to_numpy(dtype=str).reshape(n, len(colonnes))
+        cellules = np.where(manquants, '', cellules)
+
+        debut, fin = grille_heures(df_planning)
+        return cls(empreinte, colonnes, cellules, manquants, debut, fin, dates_par_jour)
+
+    def table_shifts(self):
+        "Table (agent_idx, jour, debut, fin, repos), calculée une fois par instantané"
+        if self._table is None:
+            noms_manquants = self.manquants[:, 0] if len(self.colonnes) else np.zeros(0, dtype=bool)
+            self._table = construire_table_shifts(self.noms, noms_manquants, self.debut, self.fin, self.colonnes)
+        return self._table
+
+    def index_transports(self, decalage=0):
+        "Index inversé des transports, construit une fois par instantané et par décalage horaire"
+        if decalage not in self._index:
+            self._index[decalage] = IndexTransports(self.table_shifts(), decalage)
+        return self._index[decalage]
+
+    def heriter_index(self, precedent, diff):
+        "Reprend les index déjà construits de la version précédente en n'appliquant que le diff"
+        if not diff.meme_ordre:
+            return
+        changements = [(idx, jour, ancien, nouveau) for _, idx, jour, ancien, nouveau in diff.changements]
+        for decalage, index in precedent._index.items():
+            self._index[decalage] = index.appliquer_changements(changements)
+
+    def vers_dataframe(self):
+        "Reconstruit le DataFrame du planning (cellules vides -> NaN)"
+        donnees = self.cellules.astype(object)
+        donnees[self.manquants] = np.nan
+        return pd.DataFrame(donnees, columns=self.colonnes)
+
+    @staticmethod
+    def chemin(dossier, empreinte):
+        return os.path.join(dossier, f"planning_{empreinte}.npz")
+
+    def sauvegarder(self, dossier):
+        os.makedirs(dossier, exist_ok=True)
+        chemin = self.chemin(dossier, self.empreinte)
+        chemin_tmp = f"{chemin}.{os.getpid()}.tmp"
+
+        jours_dates = list(self.dates_par_jour.keys())
+        with open(chemin_tmp, 'wb') as f:
+            np.savez(
+                f,
+                version=np.array(VERSION_INSTANTANE, dtype=np.int16),
+                colonnes=np.array(self.colonnes, dtype=str),
+                cellules=self.cellules,
+                manquants=self.manquants,
+                debut=self.debut,
+                fin=self.fin,
+                jours_dates=np.array(jours_dates, dtype=str),
+                valeurs_dates=np.array([self.dates_par_jour[j] for j in jours_dates], dtype=str),
+            )
+        # Remplacement atomique : un autre worker ne voit jamais un fichier à moitié écrit
+        os.replace(chemin_tmp, chemin)
+        _memoriser(self)
+        return chemin
+
+    @classmethod
+    def charger(cls, dossier, empreinte):
+        "Retourne l'instantané correspondant à l'empreinte, ou None s'il n'existe pas"
+        instantane = _instantanes_memoire.get(empreinte)
+        if instantane is not None:
+            _instantanes_memoire.move_to_end(empreinte)
+            return instantane
+
+        chemin = cls.chemin(dossier, empreinte)
+        if not os.path.exists(chemin):
+            return None
+
+        try:
+            with np.load(chemin, allow_pickle=False) as donnees:
+                if int(donnees['version']) != VERSION_INSTANTANE:
+                    return None
+                instantane = cls(
+                    empreinte,
+                    donnees['colonnes'].tolist(),
+                    donnees['cellules'],
+                    donnees['manquants'],
+                    donnees['debut'],
+                    donnees['fin'],
+                    dict(zip(donnees['jours_dates'].tolist(), donnees['valeurs_dates'].tolist())),
+                )
+        except Exception as e:
+            print(f"⚠️ Instantané planning illisible ({chemin}): {e}")
+            return None
+
+        _memoriser(instantane)
+        return instantane
@@ -0,0 +1,157 @@
+# Stockage versionné des fichiers uploadés (planning EMS, fichier agents)
+# Chaque upload est écrit dans un fichier temporaire puis renommé atomiquement
+# sous MEDIA_ROOT/<categorie>/<version>.xlsx : un fichier visible est toujours
+# complet et n'est plus jamais modifié, les lecteurs n'ont donc besoin d'aucun
+# verrou. Un pointeur "COURANT" (lui aussi remplacé atomiquement) désigne la
+# dernière version pour les vues qui n'ont pas la session du dispatcher.
+# L'empreinte SHA-256 du contenu est calculée pendant l'écriture et enregistrée
+# à côté (<version>.sha256) : les lectures retrouvent l'instantané du planning
+# sans relire le fichier.
+
+import hashlib
+import os
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+CATEGORIE_PLANNINGS = 'plannings'
+CATEGORIE_AGENTS = 'agents'
+FICHIER_COURANT = 'COURANT'
+EXTENSION = '.xlsx'
+EXTENSION_EMPREINTE = '.sha256'
+
+
+def dossier_categorie(categorie):
+    return os.path.join(settings.MEDIA_ROOT, categorie)
+
+
+def nouvel_identifiant():
+    "Identifiant de version triable chronologiquement (horodatage + suffixe aléatoire)"
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{uuid.uuid4().hex[:8]}"
+
+
+def identifiant_valide(version_id):
+    return bool(version_id) and os.path.basename(str(version_id)) == str(version_id) and not str(version_id).startswith('.')
+
+
+def chemin_version(categorie, version_id):
+    "Chemin du fichier d'une version, ou None si l'identifiant est invalide ou la version supprimée"
+    if not identifiant_valide(version_id):
+        return None
+    chemin = os.path.join(dossier_categorie(categorie), f"{version_id}{EXTENSION}")
+    return chemin if os.path.exists(chemin) else None
+
+
+def empreinte_fichier(chemin):
+    "Empreinte SHA-256 du contenu d'un fichier (lecture brute, sans parsing)"
+    sha = hashlib.sha256()
+    with open(chemin, 'rb') as f:
+        for bloc in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloc)
+    return sha.hexdigest()
+
+
+def _chemin_empreinte(categorie, version_id):
+    return os.path.join(dossier_categorie(categorie), f"{version_id}{EXTENSION_EMPREINTE}")
+
+
+def _ecrire_atomique(chemin, morceaux):
+    chemin_tmp = f"{chemin}.{os.getpid()}.{uuid.uuid4().hex[:6]}.tmp"
+    try:
+        with open(chemin_tmp, 'wb') as destination:
+            for morceau in morceaux:
+                destination.write(morceau)
+            destination.flush()
+            os.fsync(destination.fileno())
+        os.replace(chemin_tmp, chemin)
+    finally:
+        if os.path.exists(chemin_tmp):
+            os.remove(chemin_tmp)
+
+
+def stocker_version(categorie, fichier):
+    "Enregistre un fichier uploadé comme nouvelle version ; retourne (version_id, chemin)"
+    dossier = dossier_categorie(categorie)
+    os.makedirs(dossier, exist_ok=True)
+    version_id = nouvel_identifiant()
+    chemin = os.path.join(dossier, f"{version_id}{EXTENSION}")
+    sha = hashlib.sha256()
+    
+    def morceaux():
+        for morceau in fichier.chunks():
+            sha.update(morceau)
+            yield morceau
+    
+    _ecrire_atomique(chemin, morceaux())
+    _ecrire_atomique(_chemin_empreinte(categorie, version_id), [sha.hexdigest().encode('utf-8')])
+    return version_id, chemin
+
+
+def empreinte_version(categorie, version_id):
+    """Empreinte SHA-256 d'une version, ou None si la version n'existe pas.
+
+    Lue dans le fichier enregistré à l'upload ; pour une version plus ancienne,
+    calculée une fois puis enregistrée.
+    """
+    chemin = chemin_version(categorie, version_id)
+    if not chemin:
+        return None
+    try:
+        with open(_chemin_empreinte(categorie, version_id), encoding='utf-8') as f:
+            empreinte = f.read().strip()
+        if empreinte:
+            return empreinte
+    except OSError:
+        pass
+    empreinte = empreinte_fichier(chemin)
+    _ecrire_atomique(_chemin_empreinte(categorie, version_id), [empreinte.encode('utf-8')])
+    return empreinte
+
+
+def definir_version_courante(categorie, version_id):
+    "Fait pointer COURANT sur cette version, puis récupère les anciennes versions"
+    dossier = dossier_categorie(categorie)
+    os.makedirs(dossier, exist_ok=True)
+    _ecrire_atomique(os.path.join(dossier, FICHIER_COURANT), [str(version_id).encode('utf-8')])
+    nettoyer_versions(categorie)
+
+
+def version_courante(categorie):
+    "Identifiant de la dernière version publiée, ou None"
+    try:
+        with open(os.path.join(dossier_categorie(categorie), FICHIER_COURANT), encoding='utf-8') as f:
+            version_id = f.read().strip()
+    except OSError:
+        return None
+    return version_id if identifiant_valide(version_id) else None
+
+
+def nettoyer_versions(categorie, conserver=None):
+    """Supprime les versions les plus anciennes au-delà de `conserver`.
+
+    La version courante n'est jamais supprimée. Une session qui pointe encore
+    vers une version récupérée devra recharger son planning.
+    """
+    if conserver is None:
+        conserver = getattr(settings, 'PLANNING_VERSIONS_CONSERVEES', 10)
+    dossier = dossier_categorie(categorie)
+    try:
+        versions = sorted(
+            nom[:-len(EXTENSION)] for nom in os.listdir(dossier)
+            if nom.endswith(EXTENSION)
+        )
+    except OSError:
+        return 0
+
+    courante = version_courante(categorie)
+    a_supprimer = [v for v in versions[:max(len(versions) - conserver, 0)] if v != courante]
+    for version_id in a_supprimer:
+        for extension in (EXTENSION, EXTENSION_EMPREINTE):
+            try:
+                os.remove(os.path.join(dossier, f"{version_id}{extension}"))
+            except OSError:
+                pass
+    if a_supprimer:
+        print(f"🧹 {len(a_supprimer)} ancienne(s) version(s) {categorie} supprimée(s)")
+    return len(a_supprimer)
@@ -0,0 +1,159 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .geolocalisation.file_geocodage import MAX_TENTATIVES, planifier_geocodage, vider_file
+from .geolocalisation.models import GeocodageAgent
+from .geolocalisation.utils import GeolocalisationManager
+from .models import Agent
+
+
+def resultat_geocodeur(adresses, **options):
+    return [{
+        'success': True,
+        'latitude': 35.70,
+        'longitude': 10.70,
+        'adresse_formatee': adresse,
+        'source': 'test',
+    } for adresse in adresses]
+
+
+def resultat_quartier(adresses, **options):
+    return [dict(result, source='gazetteer', provisoire=True) for result in resultat_geocodeur(adresses)]
+
+
+def resultat_echec(adresses, **options):
+    return [dict(result, success=False, source='fallback_centre') for result in resultat_geocodeur(adresses)]
+
+
+class PlanificationGeocodageTests(TestCase):
+    "Les agents nouveaux ou dont l'adresse change passent par la file, vidée par le worker"
+
+    def creer_agent(self, nom, adresse):
+        return Agent.objects.create(nom=nom, adresse=adresse, telephone="00000000")
+
+    def test_planifier_ajoute_une_entree_par_agent(self):
+        agent = self.creer_agent("Agent file", "3 rue des oliviers sousse")
+        self.assertEqual(planifier_geocodage([agent], lancer=False), 1)
+        self.assertEqual(planifier_geocodage([agent], lancer=False), 1)
+        self.assertEqual(list(GeocodageAgent.objects.filter(agent=agent).values_list('adresse', flat=True)),
+                         [agent.adresse])
+
+    def test_planifier_ignore_adresse_a_completer(self):
+        agent = self.creer_agent("Agent incomplet", "Adresse à compléter")
+        self.assertEqual(planifier_geocodage([agent], lancer=False), 0)
+        self.assertFalse(GeocodageAgent.objects.exists())
+
+    def test_planifier_reprend_position_meme_adresse(self):
+        voisin = self.creer_agent("Voisin", "3 rue des oliviers sousse")
+        Agent.objects.filter(pk=voisin.pk).update(latitude=35.81, longitude=10.61)
+        agent = self.creer_agent("Agent même adresse", "3, Rue des Oliviers, Sousse")
+        self.assertEqual(planifier_geocodage([agent], lancer=False), 0)
+
+        agent.refresh_from_db()
+        self.assertEqual((agent.latitude, agent.longitude), (35.81, 10.61))
+        self.assertFalse(GeocodageAgent.objects.filter(agent=agent).exists())
+
+    @mock.patch.object(GeolocalisationManager, 'batch_geocode_adresses', side_effect=resultat_geocodeur)
+    def test_vider_file_enregistre_position_et_supprime_entree(self, _geocodeur):
+        agent = self.creer_agent("Agent géocodé", "3 rue des oliviers sousse")
+        planifier_geocodage([agent], lancer=False)
+        self.assertEqual(vider_file(), (1, 0))
+
+        agent.refresh_from_db()
+        self.assertEqual((agent.latitude, agent.longitude), (35.70, 10.70))
+        self.assertTrue(agent.geohash)
+        self.assertFalse(GeocodageAgent.objects.exists())
+
+    @mock.patch.object(GeolocalisationManager, 'batch_geocode_adresses', side_effect=resultat_echec)
+    def test_vider_file_reporte_echec(self, _geocodeur):
+        agent = self.creer_agent("Agent introuvable", "3 rue des oliviers sousse")
+        planifier_geocodage([agent], lancer=False)
+        self.assertEqual(vider_file(), (0, 1))
+
+        entree = GeocodageAgent.objects.get(agent=agent)
+        self.assertEqual(entree.tentatives, 1)
+        self.assertGreater(entree.prochaine_tentative, timezone.now())
+        agent.refresh_from_db()
+        self.assertIsNone(agent.latitude)
+        # Pas encore échue : pas de nouvelle tentative
+        self.assertEqual(vider_file(), (0, 0))
+
+    @mock.patch.object(GeolocalisationManager, 'batch_geocode_adresses', side_effect=resultat_echec)
+    def test_vider_file_abandonne_apres_max_tentatives(self, _geocodeur):
+        agent = self.creer_agent("Agent abandonné", "3 rue des oliviers sousse")
+        planifier_geocodage([agent], lancer=False)
+        GeocodageAgent.objects.filter(agent=agent).update(tentatives=MAX_TENTATIVES - 1)
+        vider_file()
+        self.assertFalse(GeocodageAgent.objects.exists())
+
+    @mock.patch.object(GeolocalisationManager, 'batch_geocode_adresses', side_effect=resultat_geocodeur)
+    def test_vider_file_ignore_adresse_changee(self, _geocodeur):
+        agent = self.creer_agent("Agent déménagé", "3 rue des oliviers sousse")
+        planifier_geocodage([agent], lancer=False)
+        # Adresse modifiée après la mise en file (entrée pas encore remplacée)
+        Agent.objects.filter(pk=agent.pk).update(adresse="8 avenue de la plage monastir")
+        self.assertEqual(vider_file(), (0, 0))
+
+        agent.refresh_from_db()
+        self.assertIsNone(agent.latitude)
+
+
+class FileGeocodageTests(TestCase):
+    "La file de géocodage ne doit jamais écraser une position corrigée à la main"
+
+    def setUp(self):
+        self.agent = Agent.objects.create(nom="Agent test", adresse="12 rue de test sousse", telephone="00000000")
+        planifier_geocodage([self.agent], lancer=False)
+
+    def corriger(self):
+        self.agent.latitude = 35.8300
+        self.agent.longitude = 10.6300
+        self.agent.save()
+
+    def test_correction_supprime_entree_en_attente(self):
+        self.assertTrue(GeocodageAgent.objects.filter(agent=self.agent).exists())
+        self.corriger()
+        self.assertFalse(GeocodageAgent.objects.filter(agent=self.agent).exists())
+
+    @mock.patch.object(GeolocalisationManager, 'batch_geocode_adresses', side_effect=resultat_geocodeur)
+    def test_vider_file_garde_position_corrigee(self, _geocodeur):
+        # Correction pendant le géocodage : l'entrée a déjà été lue par le worker
+        entree = GeocodageAgent.objects.get(agent=self.agent)
+        self.corriger()
+        GeocodageAgent.objects.create(agent=self.agent, adresse=entree.adresse)
+        vider_file()
+
+        self.agent.refresh_from_db()
+        self.assertEqual((self.agent.latitude, self.agent.longitude), (35.8300, 10.6300))
+        self.assertTrue(self.agent.corrige_manuellement)
+        self.assertFalse(GeocodageAgent.objects.filter(agent=self.agent).exists())
+
+    @mock.patch.object(GeolocalisationManager, 'batch_geocode_adresses', side_effect=resultat_geocodeur)
+    def test_vider_file_geocode_agent_non_corrige(self, _geocodeur):
+        self.assertEqual(vider_file(), (1, 0))
+        self.agent.refresh_from_db()
+        self.assertEqual((self.agent.latitude, self.agent.longitude), (35.70, 10.70))
+        self.assertFalse(self.agent.corrige_manuellement)
+
+    @mock.patch.object(GeolocalisationManager, 'batch_geocode_adresses', side_effect=resultat_quartier)
+    def test_vider_file_garde_entree_position_provisoire(self, _geocodeur):
+        # Centre du quartier : position enregistrée, mais l'adresse sera regéocodée
+        vider_file()
+        self.agent.refresh_from_db()
+        self.assertEqual((self.agent.latitude, self.agent.longitude), (35.70, 10.70))
+        entree = GeocodageAgent.objects.get(agent=self.agent)
+        self.assertEqual(entree.tentatives, 1)
+
+    def test_changement_adresse_efface_ancienne_position(self):
+        self.corriger()
+        self.agent.adresse = "5 avenue nouvelle monastir"
+        self.agent.save()
+        planifier_geocodage([self.agent], lancer=False)
+
+        self.agent.refresh_from_db()
+        self.assertIsNone(self.agent.latitude)
+        self.assertIsNone(self.agent.longitude)
+        self.assertFalse(self.agent.corrige_manuellement)
+        self.assertEqual(GeocodageAgent.objects.get(agent=self.agent).adresse, self.agent.adresse)
@@ -5,6 +5,7 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('tableau-de-bord/', views.tableau_de_bord, name='tableau_de_bord'),
     path('upload/', views.upload_files, name='upload'),
+    path('upload/api/statut/<int:import_id>/', views.api_statut_import, name='api_statut_import'),
     path('transports/', views.liste_transports, name='liste_transports'),
     path('transports/pdf/', views.generer_pdf, name='generer_pdf'),
     path('chauffeurs/', views.gestion_chauffeurs, name='chauffeurs'),
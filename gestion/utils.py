@@ -1,10 +1,27 @@
+import numpy as np
 import pandas as pd
 import re
 from datetime import datetime, timedelta
 import os
 from django.conf import settings
 from django.core.cache import cache
-from .models import HeureTransport, Affectation, Agent, Course, Societe
+from django.db import transaction
+from django.db.models import Q
+from .models import HeureTransport, Affectation, Agent, Course, Societe, PlanningShift
+from .planning import (
+    COLONNES_PLANNING, JOURS_SEMAINE, LIGNES_RECHERCHE_DATES, DiffPlanning, InstantanePlanning,
+    nettoyer_instantanes, parcourir_planning,
+)
+from .stockage import (
+    CATEGORIE_AGENTS, CATEGORIE_PLANNINGS, chemin_version, definir_version_courante,
+    empreinte_fichier, empreinte_version, stocker_version, version_courante,
+)
+
+# Lignes du planning gardées en listes Python avant d'être rangées en colonnes
+TAILLE_BLOC_PLANNING = 1000
+# Résolution des noms d'agents : noms par requête nom__in, et par requête "contient" (OU)
+TAILLE_LOT_NOMS = 500
+TAILLE_LOT_CONTIENT = 50
 
 class GestionnaireTransport:
     def get_heures_config(self, type_transport):
@@ -18,62 +35,323 @@ class GestionnaireTransport:
             cache.set(cache_key, heures, 3600)  # Cache 1 heure
         return [(heure_obj.heure, heure_obj.libelle) for heure_obj in heures]
     def __init__(self):
-        self.df_planning = None
+        self._df_planning = None
         self.df_agents = None
         self.dates_par_jour = {}
-        self.temp_path = os.path.join(settings.BASE_DIR, 'temp_planning.xlsx')
+        self.instantane = None
+        self._infos_agents = {}
+        self._agents_par_nom = None
+        self.planning_id = None
+        self.infos_validation = {}
+        self.erreur_chargement = None
+        self.resume_modifications = None
+        self.temp_path = None
+        self.dossier_instantanes = os.path.join(settings.BASE_DIR, 'planning_snapshots')
+        # Callback optionnel (imports en arrière-plan) : appelé avec etape/lignes_lues/agents_resolus
+        self.suivi_progression = None
+        
+    @property
+    def df_planning(self):
+        "DataFrame du planning ; après un rechargement depuis l'instantané, reconstruit seulement s'il est demandé"
+        if self._df_planning is None and self.instantane is not None:
+            self._df_planning = self.instantane.vers_dataframe()
+        return self._df_planning
+
+    @df_planning.setter
+    def df_planning(self, df_planning):
+        self._df_planning = df_planning
+
+    def colonnes_planning(self):
+        "Colonnes du planning chargé, lues dans l'instantané si possible (sans reconstruire le DataFrame)"
+        if self.instantane is not None:
+            return self.instantane.colonnes
+        return [] if self._df_planning is None else list(self._df_planning.columns)
+
+    def planning_vide(self):
+        "True si aucun planning n'est chargé ou s'il n'a aucune ligne"
+        if self.instantane is not None:
+            return len(self.instantane.cellules) == 0
+        return self._df_planning is None or self._df_planning.empty
+
+    def _signaler(self, **progression):
+        "Transmet la progression au suivi d'import s'il y en a un (ne doit jamais interrompre le chargement)"
+        if self.suivi_progression is None:
+            return
+        try:
+            self.suivi_progression(**progression)
+        except Exception as e:
+            print(f"⚠️ Suivi de progression: {e}")
         
     def charger_planning(self, fichier):
+        "Enregistre le fichier uploadé comme nouvelle version du planning puis le charge"
         try:
-            with open(self.temp_path, 'wb+') as destination:
-                for chunk in fichier.chunks():
-                    destination.write(chunk)
+            planning_id, chemin = stocker_version(CATEGORIE_PLANNINGS, fichier)
+        except Exception as e:
+            print(f"Erreur chargement planning: {e}")
+            return False
+        return self.charger_planning_version(planning_id, chemin)
+
+    def charger_planning_version(self, planning_id, chemin=None):
+        "Parse une version stockée du planning, enregistre ses shifts et la publie comme version courante"
+        try:
+            self.planning_id = planning_id
+            self.temp_path = chemin or chemin_version(CATEGORIE_PLANNINGS, planning_id)
             
-            self.extraire_dates_reelles(self.temp_path)
+            precedent = self._instantane_precedent()
             
-            self.df_planning = pd.read_excel(self.temp_path, skiprows=2, header=None)
-            self.df_planning = self.df_planning.dropna(how='all').reset_index(drop=True)
+            self._signaler(etape='Lecture du fichier')
+            self._lire_planning(self.temp_path)
+            self._construire_instantane(
+                empreinte_version(CATEGORIE_PLANNINGS, planning_id) or empreinte_fichier(self.temp_path)
+            )
             
-            noms_colonnes = ['Salarie', 'Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche', 'Qualification']
+            self._signaler(etape='Enregistrement des shifts')
             
-            if len(self.df_planning.columns) > len(noms_colonnes):
-                self.df_planning = self.df_planning.iloc[:, :len(noms_colonnes)]
+            # Re-upload de la même semaine : n'appliquer que les (agent, jour) modifiés
+            self.resume_modifications = None
+            if precedent is not None and self.instantane is not None and precedent.dates_par_jour == self.dates_par_jour:
+                diff = DiffPlanning(precedent, self.instantane)
+                self.instantane.heriter_index(precedent, diff)
+                self.resume_modifications = diff.resume()
+                print(f"🔁 Diff planning: {self.resume_modifications['total_changements']} changement(s), "
+                      f"{len(diff.agents_ajoutes)} agent(s) ajouté(s), {len(diff.agents_supprimes)} supprimé(s)")
+                if not self.appliquer_diff_shifts(diff):
+                    self.enregistrer_shifts()
+            else:
+                self.enregistrer_shifts()
             
-            self.df_planning.columns = noms_colonnes[:len(self.df_planning.columns)]
+            self._signaler(etape='Publication de la version')
+            definir_version_courante(CATEGORIE_PLANNINGS, planning_id)
+            nettoyer_instantanes(self.dossier_instantanes)
                 
             return True
                 
         except Exception as e:
             print(f"Erreur chargement planning: {e}")
+            self.erreur_chargement = str(e)
+            return False
+
+    def _lire_planning(self, chemin):
+        "Parse le fichier Excel en une seule passe (dates + grille des shifts) - coûteux, à éviter hors upload"
+        lignes_entete = []
+        # Lignes regroupées par blocs, rangés colonne par colonne (tableaux numpy) :
+        # seul le bloc courant reste en listes Python
+        bloc = []
+        colonnes = [[] for _ in COLONNES_PLANNING]
+        nb_lignes = 0
+        self.infos_validation = {}
+        # Le DataFrame relu remplace l'instantané éventuellement chargé avant
+        self.instantane = None
+        
+        def ranger_bloc():
+            if not bloc:
+                return
+            valeurs = np.empty((len(bloc), len(COLONNES_PLANNING)), dtype=object)
+            for i, ligne in enumerate(bloc):
+                valeurs[i, :len(ligne)] = ligne
+            for j, colonne in enumerate(colonnes):
+                colonne.append(valeurs[:, j].copy())
+            bloc.clear()
+        
+        for evenement in parcourir_planning(chemin):
+            if evenement[0] == 'entete':
+                lignes_entete.append(evenement[2])
+            elif evenement[0] == 'shift':
+                bloc.append(evenement[1])
+                nb_lignes += 1
+                if len(bloc) >= TAILLE_BLOC_PLANNING:
+                    ranger_bloc()
+                if nb_lignes % 500 == 0:
+                    self._signaler(lignes_lues=nb_lignes)
+            else:
+                self.infos_validation.update(evenement[1])
+        ranger_bloc()
+        
+        self._signaler(lignes_lues=nb_lignes)
+        self.extraire_dates_reelles(chemin, lignes_entete=lignes_entete)
+        
+        largeur = min(self.infos_validation.get('nb_colonnes', 0), len(COLONNES_PLANNING))
+        donnees = {}
+        for nom, blocs in zip(COLONNES_PLANNING[:largeur], colonnes):
+            valeurs = np.concatenate(blocs) if blocs else np.empty(0, dtype=object)
+            blocs.clear()
+            # Cellules vides -> NaN, comme pd.read_excel
+            valeurs[pd.isna(valeurs)] = np.nan
+            donnees[nom] = valeurs
+        colonnes.clear()
+        # Colonnes numériques typées, comme pd.read_excel
+        self.df_planning = pd.DataFrame(donnees, columns=COLONNES_PLANNING[:largeur]).infer_objects()
+
+    def _construire_instantane(self, empreinte):
+        "Sauvegarde les shifts parsés et les dates pour que les requêtes suivantes évitent openpyxl"
+        try:
+            self.instantane = InstantanePlanning.depuis_dataframe(
+                empreinte, self.df_planning, self.dates_par_jour
+            )
+            self.instantane.sauvegarder(self.dossier_instantanes)
+            print(f"💾 Instantané planning {empreinte[:12]} ({len(self.df_planning)} lignes)")
+        except Exception as e:
+            print(f"⚠️ Instantané planning non sauvegardé: {e}")
+
+    def enregistrer_shifts(self):
+        "Enregistre les shifts du planning chargé en base (PlanningShift), en remplaçant ceux des mêmes dates"
+        try:
+            table = self.table_shifts()
+            table = table[~table['repos'].to_numpy()]
+            source_upload = self.instantane.empreinte
+            
+            dates = {}
+            for jour_nom, date_str in self.dates_par_jour.items():
+                try:
+                    dates[JOURS_SEMAINE.index(jour_nom)] = datetime.strptime(date_str, "%d/%m/%Y").date()
+                except (ValueError, TypeError):
+                    continue
+            if not dates:
+                print("⚠️ Shifts non enregistrés : dates du planning inconnues")
+                return 0
+            
+            noms = self._noms_planning()
+            infos_agents = self.resoudre_agents(noms[agent_idx] for agent_idx in dict.fromkeys(table['agent_idx'].tolist()))
+            
+            shifts = []
+            for agent_idx, jour_idx, heure_debut, heure_fin in zip(
+                table['agent_idx'].tolist(), table['jour'].tolist(),
+                table['debut'].tolist(), table['fin'].tolist()
+            ):
+                agent_obj = infos_agents[noms[agent_idx]]['agent_obj']
+                if agent_obj is None or jour_idx not in dates:
+                    continue
+                shifts.append(PlanningShift(
+                    agent_id=agent_obj.id,
+                    date_reelle=dates[jour_idx],
+                    jour=JOURS_SEMAINE[jour_idx],
+                    heure_debut=heure_debut,
+                    heure_fin=heure_fin,
+                    heure_depart=heure_fin - 24 if heure_fin >= 24 else heure_fin,
+                    source_upload=source_upload
+                ))
+            
+            with transaction.atomic():
+                PlanningShift.objects.filter(date_reelle__in=list(dates.values())).delete()
+                PlanningShift.objects.bulk_create(shifts, batch_size=1000)
+            
+            print(f"🗄️ {len(shifts)} shift(s) enregistré(s) pour le planning {source_upload[:12]}")
+            return len(shifts)
+        except Exception as e:
+            print(f"⚠️ Shifts planning non enregistrés: {e}")
+            return 0
+
+    def _instantane_precedent(self):
+        "Instantané de la version courante (avant publication du nouvel upload), ou None"
+        try:
+            empreinte = empreinte_version(CATEGORIE_PLANNINGS, version_courante(CATEGORIE_PLANNINGS))
+            if not empreinte:
+                return None
+            return InstantanePlanning.charger(self.dossier_instantanes, empreinte)
+        except Exception as e:
+            print(f"⚠️ Version précédente du planning illisible: {e}")
+            return None
+
+    def appliquer_diff_shifts(self, diff):
+        "Met à jour PlanningShift uniquement pour les (agent, jour) modifiés ; False si un enregistrement complet est nécessaire"
+        try:
+            ancienne_source = diff.ancien.empreinte
+            nouvelle_source = self.instantane.empreinte
+            
+            dates = {}
+            for jour_nom, date_str in self.dates_par_jour.items():
+                try:
+                    dates[JOURS_SEMAINE.index(jour_nom)] = datetime.strptime(date_str, "%d/%m/%Y").date()
+                except (ValueError, TypeError):
+                    continue
+            if not dates:
+                return False
+            
+            # Les shifts en base doivent correspondre exactement à la version précédente
+            if not PlanningShift.objects.filter(source_upload=ancienne_source, date_reelle__in=list(dates.values())).exists():
+                return False
+            
+            changements = [c for c in diff.changements if c[2] in dates]
+            # Au-delà, réécrire toute la semaine coûte moins cher qu'une suppression ciblée
+            if len(changements) > 500:
+                return False
+            infos_agents = self.resoudre_agents(nom for nom, _, _, _, _ in changements)
+            
+            a_supprimer = Q()
+            nouveaux = []
+            for nom_agent, _, jour_idx, ancien, nouveau in changements:
+                agent_obj = infos_agents[nom_agent]['agent_obj']
+                if agent_obj is None:
+                    return False
+                if ancien is not None:
+                    a_supprimer |= Q(agent_id=agent_obj.id, date_reelle=dates[jour_idx])
+                if nouveau is not None:
+                    heure_debut, heure_fin = nouveau
+                    nouveaux.append(PlanningShift(
+                        agent_id=agent_obj.id,
+                        date_reelle=dates[jour_idx],
+                        jour=JOURS_SEMAINE[jour_idx],
+                        heure_debut=heure_debut,
+                        heure_fin=heure_fin,
+                        heure_depart=heure_fin - 24 if heure_fin >= 24 else heure_fin,
+                        source_upload=nouvelle_source
+                    ))
+            
+            with transaction.atomic():
+                if a_supprimer:
+                    PlanningShift.objects.filter(a_supprimer, source_upload=ancienne_source).delete()
+                PlanningShift.objects.bulk_create(nouveaux, batch_size=1000)
+                PlanningShift.objects.filter(
+                    source_upload=ancienne_source, date_reelle__in=list(dates.values())
+                ).update(source_upload=nouvelle_source)
+            
+            print(f"🗄️ {len(changements)} shift(s) mis à jour (incrémental) pour le planning {nouvelle_source[:12]}")
+            return True
+        except Exception as e:
+            print(f"⚠️ Mise à jour incrémentale des shifts impossible: {e}")
             return False
 
     def charger_agents_excel(self, fichier):
         "Charge les agents depuis un fichier Excel uploadé"
         try:
-            with open(os.path.join(settings.BASE_DIR, 'temp_agents.xlsx'), 'wb+') as destination:
-                for chunk in fichier.chunks():
-                    destination.write(chunk)
-            
-            self.df_agents = pd.read_excel(os.path.join(settings.BASE_DIR, 'temp_agents.xlsx'))
+            agents_id, chemin = stocker_version(CATEGORIE_AGENTS, fichier)
+            self.df_agents = pd.read_excel(chemin)
+            definir_version_courante(CATEGORIE_AGENTS, agents_id)
             return True
         except Exception as e:
             print(f"Erreur chargement agents: {e}")
             return False
 
-    def recharger_planning_depuis_session(self):
+    def chemin_agents_courant(self):
+        "Dernière version du fichier agents uploadé, ou None"
+        return chemin_version(CATEGORIE_AGENTS, version_courante(CATEGORIE_AGENTS))
+
+    def recharger_planning_depuis_session(self, planning_id=None):
+        """Recharge la version `planning_id` du planning (celle de la session du dispatcher).
+
+        Sans identifiant, la version courante (dernier upload) est utilisée. Les
+        versions sont immuables : aucune lecture ne peut voir un fichier partiel.
+        L'instantané est retrouvé par l'empreinte enregistrée avec la version, sans
+        relire le fichier ; le DataFrame n'est reconstruit que s'il est demandé.
+        """
         try:
-            if os.path.exists(self.temp_path):
-                self.extraire_dates_reelles(self.temp_path)
-                
-                self.df_planning = pd.read_excel(self.temp_path, skiprows=2, header=None)
-                self.df_planning = self.df_planning.dropna(how='all').reset_index(drop=True)
+            planning_id = planning_id or version_courante(CATEGORIE_PLANNINGS)
+            chemin = chemin_version(CATEGORIE_PLANNINGS, planning_id)
+            if chemin:
+                self.planning_id = planning_id
+                self.temp_path = chemin
+                empreinte = empreinte_version(CATEGORIE_PLANNINGS, planning_id)
+                instantane = InstantanePlanning.charger(self.dossier_instantanes, empreinte)
                 
-                noms_colonnes = ['Salarie', 'Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche', 'Qualification']
-                if len(self.df_planning.columns) > len(noms_colonnes):
-                    self.df_planning = self.df_planning.iloc[:, :len(noms_colonnes)]
+                if instantane is not None:
+                    self.instantane = instantane
+                    self.df_planning = None
+                    self.dates_par_jour = dict(instantane.dates_par_jour)
+                    return True
                 
-                self.df_planning.columns = noms_colonnes[:len(self.df_planning.columns)]
-                self.extraire_dates_reelles(self.temp_path)
+                # Pas encore d'instantané pour ce contenu : parser une fois puis le sauvegarder
+                self._lire_planning(self.temp_path)
+                self._construire_instantane(empreinte)
                 print(f"📅 Dates extraites après rechargement: {self.dates_par_jour}")
                 return True
             else:
@@ -82,18 +360,24 @@ class GestionnaireTransport:
             print(f"Erreur rechargement planning: {e}")
             return False
 
-    def extraire_dates_reelles(self, fichier_path):
+    def extraire_dates_reelles(self, fichier_path, lignes_entete=None):
       
         try:
             print("📅 Tentative d'extraction des dates depuis le fichier Excel...")
             
-            # Méthode 1: Lire le fichier avec pandas
-            df_raw = pd.read_excel(fichier_path, header=None)
+            # Premières lignes du fichier (déjà lues par _lire_planning, sinon lecture partielle)
+            if lignes_entete is None:
+                lignes_entete = []
+                for evenement in parcourir_planning(fichier_path):
+                    if evenement[0] == 'entete':
+                        lignes_entete.append(evenement[2])
+                    elif evenement[0] == 'shift' and len(lignes_entete) >= LIGNES_RECHERCHE_DATES:
+                        break
             
             # Chercher la ligne contenant les dates
             date_row_index = None
-            for idx in range(min(3, len(df_raw))):  # Regarder les 3 premières lignes
-                row = df_raw.iloc[idx]
+            for idx in range(min(3, len(lignes_entete))):  # Regarder les 3 premières lignes
+                row = lignes_entete[idx]
                 # Vérifier si cette ligne contient des dates
                 date_count = 0
                 for cell in row:
@@ -108,7 +392,7 @@ class GestionnaireTransport:
                     break
             
             if date_row_index is not None:
-                date_row = df_raw.iloc[date_row_index]
+                date_row = lignes_entete[date_row_index]
                 print(f"📊 Ligne de dates trouvée à l'index {date_row_index}")
                 
                 # Mapping des colonnes vers les jours
@@ -218,6 +502,119 @@ class GestionnaireTransport:
             date_jour = date_debut + timedelta(days=i)
             self.dates_par_jour[jour] = date_jour.strftime("%d/%m/%Y")
     
+    @staticmethod
+    def normaliser_nom(nom):
+        "Clé de comparaison d'un nom d'agent (casse et espaces ignorés)"
+        return ' '.join(str(nom).split()).casefold()
+
+    @staticmethod
+    def _info_depuis_agent(agent_db):
+        return {
+            "adresse": agent_db.adresse,
+            "telephone": agent_db.telephone,
+            "societe": agent_db.get_societe_display(),
+            "voiture_personnelle": agent_db.voiture_personnelle,
+            "est_complet": agent_db.est_complet(),
+            "agent_obj": agent_db
+        }
+
+    def resoudre_agents(self, noms):
+        """Résout en lot les noms du planning vers les infos agent (même format que get_info_agent).
+
+        Les noms sont d'abord cherchés tels quels (nom__in, par lots) ; les noms restants
+        passent par une requête "contient" (nom__icontains en OU) vérifiée en mémoire,
+        et les agents encore introuvables sont créés en un seul bulk_create.
+        """
+        noms = [nom for nom in dict.fromkeys(noms) if nom not in self._infos_agents]
+        if not noms:
+            return self._infos_agents
+        
+        requetes = 0
+        try:
+            if self._agents_par_nom is None:
+                self._agents_par_nom = {}
+            
+            # 1. Noms exacts (espaces superflus retirés)
+            cles = {nom_agent: self.normaliser_nom(nom_agent) for nom_agent in noms}
+            a_chercher = [nom_agent for nom_agent in noms if cles[nom_agent] not in self._agents_par_nom]
+            variantes = list(dict.fromkeys(
+                variante for nom_agent in a_chercher for variante in (str(nom_agent), ' '.join(str(nom_agent).split()))
+            ))
+            for debut in range(0, len(variantes), TAILLE_LOT_NOMS):
+                for agent in Agent.objects.select_related('societe').filter(
+                    nom__in=variantes[debut:debut + TAILLE_LOT_NOMS]
+                ).order_by('nom'):
+                    self._agents_par_nom.setdefault(self.normaliser_nom(agent.nom), agent)
+                requetes += 1
+            
+            # 2. Noms restants (casse différente, nom partiel) : même résultat que
+            # nom__icontains(...).first(), premier nom (ordre alphabétique) qui contient la clé
+            restants = list(dict.fromkeys(
+                cles[nom_agent] for nom_agent in a_chercher if cles[nom_agent] not in self._agents_par_nom
+            ))
+            for debut in range(0, len(restants), TAILLE_LOT_CONTIENT):
+                lot = restants[debut:debut + TAILLE_LOT_CONTIENT]
+                filtre = Q()
+                for cle in lot:
+                    filtre |= Q(nom__icontains=cle)
+                candidats = [
+                    (self.normaliser_nom(agent.nom), agent)
+                    for agent in Agent.objects.select_related('societe').filter(filtre).order_by('nom')
+                ]
+                requetes += 1
+                for cle in lot:
+                    agent_db = next((a for c, a in candidats if c == cle), None) \
+                        or next((a for c, a in candidats if cle in c), None)
+                    if agent_db is not None:
+                        self._agents_par_nom[cle] = agent_db
+            
+            manquants = []
+            for nom_agent in noms:
+                agent_db = self._agents_par_nom.get(cles[nom_agent])
+                if agent_db is None:
+                    manquants.append(nom_agent)
+                else:
+                    self._infos_agents[nom_agent] = self._info_depuis_agent(agent_db)
+            
+            if manquants:
+                # Si l'agent n'existe pas, le créer avec des valeurs par défaut (en une fois)
+                with transaction.atomic():
+                    Agent.objects.bulk_create([
+                        Agent(
+                            nom=nom_agent,
+                            adresse="Adresse à compléter",
+                            telephone="00000000",
+                            societe_texte="Société à compléter",
+                            voiture_personnelle=False
+                        )
+                        for nom_agent in manquants
+                    ], ignore_conflicts=True)
+                    crees = {agent.nom: agent for agent in Agent.objects.select_related('societe').filter(nom__in=manquants)}
+                requetes += 2
+                for nom_agent in manquants:
+                    agent_db = crees.get(nom_agent)
+                    if agent_db is None:
+                        self._infos_agents[nom_agent] = self.get_info_agent(nom_agent)
+                        requetes += 1
+                        continue
+                    self._agents_par_nom[self.normaliser_nom(agent_db.nom)] = agent_db
+                    self._infos_agents[nom_agent] = self._info_depuis_agent(agent_db)
+                print(f"👤 {len(manquants)} agent(s) à compléter créé(s)")
+            self._signaler(agents_resolus=len(self._infos_agents))
+        
+        except Exception as e:
+            print(f"Erreur résolution agents: {e}")
+            for nom_agent in noms:
+                self._infos_agents.setdefault(nom_agent, self.get_info_agent(nom_agent))
+            return self._infos_agents
+        
+        if settings.DEBUG:
+            # get_info_agent : une requête par nom, plus une insertion par agent créé
+            requetes_evitees = len(noms) + len(manquants) - requetes
+            print(f"🔎 Résolution agents: {len(noms)} nom(s) en {requetes} requête(s), {requetes_evitees} requête(s) évitée(s)")
+        
+        return self._infos_agents
+
     def get_info_agent(self, nom_agent):
         try:
             # Chercher l'agent dans la base de données
@@ -315,8 +712,87 @@ class GestionnaireTransport:
             else:
                 return [(22, 'Départ 22h'), (23, 'Départ 23h'), (0, 'Départ 0h'), (1, 'Départ 1h'), (2, 'Départ 2h'), (3, 'Départ 3h')]
 
+    def table_shifts(self):
+        "Table vectorisée (agent_idx, jour, debut, fin, repos) du planning chargé"
+        if self.instantane is None:
+            self.instantane = InstantanePlanning.depuis_dataframe('', self.df_planning, self.dates_par_jour)
+        return self.instantane.table_shifts()
+
+    def _noms_planning(self):
+        "Noms des agents du planning, indexés comme agent_idx"
+        return self.instantane.noms_agents()
+
+    def index_transports(self, heure_ete=False):
+        "Index inversé (jour, type_transport, heure) -> agents du planning chargé"
+        self.table_shifts()
+        return self.instantane.index_transports(1 if heure_ete else 0)
+
+    def agents_planifies(self, jour, type_transport, heure, heure_ete=False):
+        "Noms des agents programmés pour un jour/type/heure, sans accès base (voiture personnelle non filtrée)"
+        noms = self._noms_planning()
+        return [noms[agent_idx] for agent_idx, _, _ in self.index_transports(heure_ete).rechercher(jour, type_transport, heure)]
+
+    def est_programme(self, nom_agent, jour):
+        "True si l'agent a un shift (hors repos) ce jour-là : recherche par nom puis appartenance au jour"
+        index = self.index_transports()
+        return index.travaille(self.instantane.indices_par_nom().get(nom_agent, ()), jour)
+
+    def rechercher_transports(self, jour, type_transport, heures, heure_ete=False, filtre_agents='tous'):
+        """Transports d'un jour pour un type et une ou plusieurs heures, au format de traiter_donnees.
+
+        Lecture directe de l'index inversé : le coût dépend du nombre d'agents
+        trouvés, pas de la taille du planning. Un départ à 1h trouve aussi les
+        fins de shift à 25h. Les agents avec voiture personnelle sont exclus.
+        """
+        if self.planning_vide() or jour not in self.colonnes_planning():
+            return []
+        if isinstance(heures, int):
+            heures = [heures]
+        
+        index = self.index_transports(heure_ete)
+        shifts = []
+        if type_transport == 'depart':
+            heures = [heure - 24 if heure >= 24 else heure for heure in heures]
+        for heure in dict.fromkeys(heures):
+            shifts.extend(index.rechercher(jour, type_transport, heure))
+        shifts.sort(key=lambda shift: (shift[1], shift[0]))
+        
+        noms = self._noms_planning()
+        infos_agents = self.resoudre_agents(noms[agent_idx] for agent_idx, _, _ in shifts)
+        date_reelle = self.dates_par_jour.get(jour, 'Date non definie')
+        transports = []
+        for agent_idx, heure, heure_affichee in shifts:
+            nom_agent = noms[agent_idx]
+            info_agent = infos_agents[nom_agent]
+            
+            # Appliquer le filtre agents complet/incomplet
+            if filtre_agents == 'complets' and not info_agent['est_complet']:
+                continue
+            elif filtre_agents == 'incomplets' and info_agent['est_complet']:
+                continue
+            
+            # EXCLUSION AUTOMATIQUE - Si l'agent a une voiture personnelle, on le saute complètement
+            if info_agent['voiture_personnelle']:
+                continue
+            
+            transports.append({
+                'agent': nom_agent,
+                'jour': jour,
+                'heure': heure,
+                'heure_affichage': f"{heure_affichee}h",
+                'adresse': info_agent['adresse'],
+                'telephone': info_agent['telephone'],
+                'societe': info_agent['societe'],
+                'date_reelle': date_reelle,
+                'type_transport': type_transport,
+                'est_complet': info_agent['est_complet'],
+                'agent_id': info_agent['agent_obj'].id if info_agent['agent_obj'] else None
+            })
+        
+        return transports
+
     def traiter_donnees(self, filtre_form):
-        if self.df_planning is None or self.df_planning.empty:
+        if self.planning_vide():
             return []
         
         liste_transports = []
@@ -385,90 +861,27 @@ class GestionnaireTransport:
             except:
                 pass
         
-        jours_mapping = {
-            'Lundi': 'Lundi', 'Mardi': 'Mardi', 'Mercredi': 'Mercredi', 
-            'Jeudi': 'Jeudi', 'Vendredi': 'Vendredi', 'Samedi': 'Samedi', 'Dimanche': 'Dimanche'
-        }
-        
-        for index, agent in self.df_planning.iterrows():
-            if pd.isna(agent['Salarie']) or str(agent['Salarie']).strip() == '':
-                continue
-            
-            nom_agent = str(agent['Salarie']).strip()
-            info_agent = self.get_info_agent(nom_agent)
-            
-            # Appliquer le filtre agents complet/incomplet
-            if filtre_agents == 'complets' and not info_agent['est_complet']:
-                continue
-            elif filtre_agents == 'incomplets' and info_agent['est_complet']:
-                continue
-            
-            # EXCLUSION AUTOMATIQUE - Si l'agent a une voiture personnelle, on le saute complètement
-            if info_agent['voiture_personnelle']:
-                continue
-            
+        colonnes = self.colonnes_planning()
+        if jour_selectionne == 'Tous':
+            jours_a_verifier = [jour for jour in JOURS_SEMAINE if jour in colonnes]
+        elif jour_selectionne in colonnes:
+            jours_a_verifier = [jour_selectionne]
+        else:
             jours_a_verifier = []
-            if jour_selectionne == 'Tous':
-                for jour_col, jour_nom in jours_mapping.items():
-                    if jour_col in agent.index:
-                        jours_a_verifier.append((jour_col, jour_nom))
-            else:
-                if jour_selectionne in agent.index:
-                    jours_a_verifier.append((jour_selectionne, jour_selectionne))
-            
-            for jour_col, jour_nom in jours_a_verifier:
-                planning = agent[jour_col]
-                heure_debut, heure_fin = self.extraire_heures(planning)
-                
-                if heure_debut is not None and heure_fin is not None:
-                    if heure_ete_active:
-                        heure_debut_ajustee = heure_debut - 1
-                        heure_fin_ajustee = heure_fin - 1
-                    else:
-                        heure_debut_ajustee = heure_debut
-                        heure_fin_ajustee = heure_fin
-                    
-                    # Ramassage - Vérifier avec l'heure ajustée
-                    if type_transport_selectionne in ['tous', 'ramassage'] and heure_debut_ajustee in heures_ramassage:
-                        agent_data = {
-                            'agent': nom_agent,
-                            'jour': jour_nom,
-                            'heure': heure_debut_ajustee,
-                            'heure_affichage': f"{heure_debut_ajustee}h",
-                            'adresse': info_agent['adresse'],
-                            'telephone': info_agent['telephone'],
-                            'societe': info_agent['societe'],
-                            'date_reelle': self.dates_par_jour.get(jour_nom, 'Date non definie'),
-                            'type_transport': 'ramassage',
-                            'est_complet': info_agent['est_complet'],
-                            'agent_id': info_agent['agent_obj'].id if info_agent['agent_obj'] else None
-                        }
-                        liste_transports.append(agent_data)
-                    
-                    # Départ - Vérifier avec l'heure ajustée
-                    heure_fin_comparaison = heure_fin_ajustee
-                    if heure_fin_comparaison >= 24:
-                        heure_fin_comparaison = heure_fin_comparaison - 24
-                    
-                    if type_transport_selectionne in ['tous', 'depart'] and heure_fin_comparaison in heures_depart:
-                        heure_fin_affichee = heure_fin_ajustee
-                        if heure_fin_ajustee >= 24:
-                            heure_fin_affichee = heure_fin_ajustee - 24
-                        
-                        agent_data = {
-                            'agent': nom_agent,
-                            'jour': jour_nom,
-                            'heure': heure_fin_ajustee,
-                            'heure_affichage': f"{heure_fin_affichee}h",
-                            'adresse': info_agent['adresse'],
-                            'telephone': info_agent['telephone'],
-                            'societe': info_agent['societe'],
-                            'date_reelle': self.dates_par_jour.get(jour_nom, 'Date non definie'),
-                            'type_transport': 'depart',
-                            'est_complet': info_agent['est_complet'],
-                            'agent_id': info_agent['agent_obj'].id if info_agent['agent_obj'] else None
-                        }
-                        liste_transports.append(agent_data)
+        
+        # Tous les agents du planning résolus en une fois (une requête au lieu d'une par ligne)
+        noms = self._noms_planning()
+        self.resoudre_agents(noms[agent_idx] for agent_idx in dict.fromkeys(self.table_shifts()['agent_idx'].tolist()))
+        
+        for jour_nom in jours_a_verifier:
+            if heures_ramassage:
+                liste_transports.extend(self.rechercher_transports(
+                    jour_nom, 'ramassage', heures_ramassage, heure_ete_active, filtre_agents
+                ))
+            if heures_depart:
+                liste_transports.extend(self.rechercher_transports(
+                    jour_nom, 'depart', heures_depart, heure_ete_active, filtre_agents
+                ))
         
         ordre_jours = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
         liste_transports.sort(key=lambda x: (ordre_jours.index(x['jour']), x['type_transport'], x['heure']))
@@ -488,24 +901,21 @@ class GestionnaireTransport:
                 heure=heure,
                 date_reelle=date_obj
             ).values_list('agent__nom', flat=True)
+            agents_affectes = set(agents_affectes)
             
             # Filtrer les agents du planning qui ne sont pas encore affectés
             agents_non_affectes = []
             
-            if self.df_planning is not None:
-                for index, agent in self.df_planning.iterrows():
-                    if pd.isna(agent['Salarie']) or str(agent['Salarie']).strip() == '':
-                        continue
-                    
-                    nom_agent = str(agent['Salarie']).strip()
-                    
-                    # Vérifier si l'agent est déjà affecté
-                    if nom_agent not in agents_affectes:
-                        info_agent = self.get_info_agent(nom_agent)
-                        
-                        # Vérifier si l'agent a une voiture personnelle
-                        if not info_agent['voiture_personnelle']:
-                            agents_non_affectes.append(nom_agent)
+            if not self.planning_vide():
+                self.table_shifts()
+                noms = [nom for nom in self._noms_planning() if nom]
+                candidats = [nom_agent for nom_agent in noms if nom_agent not in agents_affectes]
+                infos_agents = self.resoudre_agents(candidats)
+                
+                for nom_agent in candidats:
+                    # Vérifier si l'agent a une voiture personnelle
+                    if not infos_agents[nom_agent]['voiture_personnelle']:
+                        agents_non_affectes.append(nom_agent)
             
             return agents_non_affectes
             
@@ -1,4 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.http import HttpResponse, JsonResponse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
@@ -8,6 +9,7 @@ import pandas as pd
 from io import BytesIO
 import os
 import json
+import time
 from django.conf import settings
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
@@ -16,16 +18,20 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
 
-from .models import Societe, Agent, Affectation, HeureTransport, Chauffeur, Course
+from .models import Societe, Agent, Affectation, HeureTransport, Chauffeur, Course, PlanningShift, PlanningImport
 from .forms import UploadFileForm, AgentForm, AffectationMultipleForm, FiltreForm, ChauffeurForm, AgentModificationForm, ImportAgentForm, SocieteForm, SocieteModificationForm
 from .utils import GestionnaireTransport
+from .imports import lancer_import, marquer_imports_interrompus, peut_etre_interrompu
+from .geolocalisation.file_geocodage import planifier_geocodage
+from .geolocalisation.gazetteer import gazetteer, jitter_deterministe
+from .geolocalisation.horaires import horaires_par_agent, planifier_horaires
+from .stockage import CATEGORIE_PLANNINGS, chemin_version, empreinte_version, stocker_version
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 import json
 from .models import Agent
 from django.utils import timezone
-import random
 from django.contrib.auth.decorators import user_passes_test
 def is_admin(user):
     return user.is_authenticated and user.is_staff
@@ -388,19 +394,13 @@ def tableau_de_bord(request):
     return render(request, 'gestion/tableau_de_bord.html', context)
 @login_required
 def upload_files(request):
-    gestionnaire = GestionnaireTransport()
     if request.method == 'POST' and 'action' in request.POST:
         if request.POST['action'] == 'clear_file':
-            # Supprimer le fichier de la session
+            # Retirer le fichier de la session ; la version reste sur disque
+            # (partagée avec COURANT et les autres sessions, supprimée par nettoyer_versions)
             if 'uploaded_file' in request.session:
-                file_path = request.session['uploaded_file'].get('path')
-                if file_path and os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                    except:
-                        pass
-                
                 del request.session['uploaded_file']
+                request.session.pop('planning_id', None)
                 request.session['planning_charge'] = False
                 messages.info(request, '🗑️ Fichier supprimé de la session')
             return redirect('upload')
@@ -415,57 +415,29 @@ def upload_files(request):
             fichier_planning = request.FILES['fichier_planning']
             
             try:
-                # Sauvegarder temporairement le fichier
-                temp_path = os.path.join(settings.MEDIA_ROOT, 'temp_planning.xlsx')
-                with open(temp_path, 'wb+') as destination:
-                    for chunk in fichier_planning.chunks():
-                        destination.write(chunk)
+                # Enregistrer le fichier comme nouvelle version (écriture atomique, un id par upload)
+                planning_id, temp_path = stocker_version(CATEGORIE_PLANNINGS, fichier_planning)
                 
-                # Tester la lecture du fichier
-                import pandas as pd
-                try:
-                    # Lire les premières lignes pour vérifier le format
-                    df_test = pd.read_excel(temp_path, nrows=3)
-                    file_is_valid = True
-                    row_count = len(df_test)
-                except Exception as e:
-                    file_is_valid = False
-                    error_message = str(e)
+                # Le parsing et l'enregistrement des shifts se font en arrière-plan
+                planning_import = PlanningImport.objects.create(
+                    planning_id=planning_id,
+                    nom_fichier=fichier_planning.name,
+                    taille=fichier_planning.size,
+                    content_type=fichier_planning.content_type or '',
+                    utilisateur=request.user if request.user.is_authenticated else None
+                )
+                lancer_import(planning_import)
+                request.session['import_en_cours'] = planning_import.id
                 
-                if file_is_valid:
-                    if gestionnaire.charger_planning(fichier_planning):
-                        # Stocker les infos du fichier dans la session
-                        request.session['uploaded_file'] = {
-                            'name': fichier_planning.name,
-                            'size': fichier_planning.size,
-                            'content_type': fichier_planning.content_type,
-                            'row_count': row_count,
-                            'upload_time': datetime.now().isoformat(),
-                            'path': temp_path
-                        }
-                        request.session['planning_charge'] = True
-                        
-                        # IMPORTANT: Sauvegarder les dates dans la session
-                        if gestionnaire.dates_par_jour:
-                            request.session['gestionnaire_dates'] = gestionnaire.dates_par_jour
-                            print(f"📅 Dates sauvegardées dans session après upload: {gestionnaire.dates_par_jour}")
-                        
-                        messages.success(request, f'✅ Fichier {fichier_planning.name} uploadé avec succès! ({row_count} lignes détectées)')
-                        
-                        # Charger automatiquement le fichier agents par défaut s'il existe
-                        info_path = os.path.join(settings.BASE_DIR, 'info.xlsx')
-                        if os.path.exists(info_path):
-                            gestionnaire.charger_agents(info_path)
-                            messages.info(request, '📂 Fichier info.xlsx chargé automatiquement')
-                        else:
-                            messages.warning(request, '⚠️ Fichier info.xlsx non trouvé. Vous pouvez importer les agents depuis la section "Gestion Agents".')
-                        
-                        # Rediriger vers la même page pour afficher les infos
-                        return redirect('upload')
-                    else:
-                        messages.error(request, '❌ Erreur lors du chargement du planning dans le gestionnaire')
-                else:
-                    messages.error(request, f'❌ Fichier invalide : {error_message}')
+                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                    return JsonResponse({
+                        'success': True,
+                        'import_id': planning_import.id,
+                        'statut_url': reverse('api_statut_import', args=[planning_import.id])
+                    })
+                
+                messages.info(request, f'⏳ Fichier {fichier_planning.name} en cours de traitement...')
+                return redirect('upload')
                     
             except Exception as e:
                 messages.error(request, f'❌ Erreur lors du traitement du fichier : {str(e)}')
@@ -478,9 +450,80 @@ def upload_files(request):
         'form': form,
         'uploaded_file': uploaded_file_info,
         'planning_charge': planning_charge,
+        'import_en_cours': request.session.get('import_en_cours'),
     }
     return render(request, 'gestion/upload.html', context)
 
+@login_required
+def api_statut_import(request, import_id):
+    "API pour suivre la progression d'un import de planning en arrière-plan"
+    try:
+        planning_import = PlanningImport.objects.get(id=import_id)
+    except PlanningImport.DoesNotExist:
+        if request.session.get('import_en_cours') == import_id:
+            request.session.pop('import_en_cours', None)
+        return JsonResponse({'success': False, 'error': 'Import introuvable'}, status=404)
+    
+    # Import sans progression depuis le délai : perdu au redémarrage du serveur ? Vérifié
+    # seulement dans ce cas (pas à chaque interrogation), la page d'upload arrête alors de le suivre
+    if peut_etre_interrompu(planning_import):
+        marquer_imports_interrompus()
+        planning_import.refresh_from_db()
+    
+    resume = planning_import.resume_modifications
+    
+    # Import terminé : publier le planning dans la session du dispatcher qui l'a lancé
+    if planning_import.est_fini and request.session.get('import_en_cours') == planning_import.id:
+        request.session.pop('import_en_cours', None)
+        if planning_import.statut == 'termine':
+            request.session['uploaded_file'] = {
+                'name': planning_import.nom_fichier,
+                'size': planning_import.taille,
+                'content_type': planning_import.content_type,
+                'row_count': planning_import.nb_lignes,
+                'upload_time': planning_import.created_at.isoformat(),
+                'path': chemin_version(CATEGORIE_PLANNINGS, planning_import.planning_id)
+            }
+            request.session['planning_charge'] = True
+            request.session['planning_id'] = planning_import.planning_id
+            if planning_import.dates_par_jour:
+                request.session['gestionnaire_dates'] = planning_import.dates_par_jour
+                print(f"📅 Dates sauvegardées dans session après import: {planning_import.dates_par_jour}")
+            
+            messages.success(request, f'✅ Fichier {planning_import.nom_fichier} uploadé avec succès! ({planning_import.nb_lignes} lignes détectées)')
+            
+            # Re-upload de la même semaine : résumé des modifications
+            if resume is not None:
+                if resume['total_changements']:
+                    messages.info(request, (
+                        f"🔁 Modifications : {len(resume['agents_ajoutes'])} agent(s) ajouté(s), "
+                        f"{len(resume['agents_supprimes'])} supprimé(s), "
+                        f"{len(resume['heures_deplacees'])} horaire(s) déplacé(s)"
+                    ))
+                else:
+                    messages.info(request, '🔁 Aucun changement par rapport au planning précédent')
+            
+            if planning_import.agents_charges:
+                messages.info(request, '📂 Fichier info.xlsx chargé automatiquement')
+            else:
+                messages.warning(request, '⚠️ Fichier info.xlsx non trouvé. Vous pouvez importer les agents depuis la section "Gestion Agents".')
+        else:
+            messages.error(request, f'❌ Fichier invalide : {planning_import.erreurs}')
+    
+    return JsonResponse({
+        'success': True,
+        'import_id': planning_import.id,
+        'statut': planning_import.statut,
+        'statut_display': planning_import.get_statut_display(),
+        'etape': planning_import.etape,
+        'fini': planning_import.est_fini,
+        'lignes_lues': planning_import.lignes_lues,
+        'nb_lignes': planning_import.nb_lignes,
+        'agents_resolus': planning_import.agents_resolus,
+        'erreurs': planning_import.erreurs,
+        'resume_modifications': resume,
+    })
+
 @login_required
 def liste_transports(request):
   
@@ -493,7 +536,7 @@ def liste_transports(request):
     
     # Essayer de recharger le planning
     planning_charge = False
-    if gestionnaire.recharger_planning_depuis_session():
+    if gestionnaire.recharger_planning_depuis_session(request.session.get('planning_id')):
         planning_charge = True
         gestionnaire.dates_par_jour = request.session.get('gestionnaire_dates', {})
     else:
@@ -501,8 +544,8 @@ def liste_transports(request):
         return redirect('upload')
     
     # Charger les agents
-    temp_agents_path = os.path.join(settings.BASE_DIR, 'temp_agents.xlsx')
-    if os.path.exists(temp_agents_path):
+    temp_agents_path = gestionnaire.chemin_agents_courant()
+    if temp_agents_path:
         gestionnaire.charger_agents(temp_agents_path)
     else:
         info_path = os.path.join(settings.BASE_DIR, 'info.xlsx')
@@ -522,7 +565,7 @@ def liste_transports(request):
         # DEBUG: Afficher les valeurs
         print(f"DEBUG - Filtres: Jour={jour_selectionne}, Type={type_transport_selectionne}")
         
-        if not gestionnaire.df_planning.empty:
+        if not gestionnaire.planning_vide():
             # Créer un faux objet form avec les données nettoyées
             class FiltreFormSimple:
                 def __init__(self, jour, type_transport, heure_ete=False, filtre_agents='tous'):
@@ -636,12 +679,12 @@ def generer_pdf(request):
     
     # Recharger les données exactement comme dans liste_transports
     gestionnaire = GestionnaireTransport()
-    if gestionnaire.recharger_planning_depuis_session():
+    if gestionnaire.recharger_planning_depuis_session(request.session.get('planning_id')):
         gestionnaire.dates_par_jour = request.session.get('gestionnaire_dates', {})
         
         # Charger les agents
-        temp_agents_path = os.path.join(settings.BASE_DIR, 'temp_agents.xlsx')
-        if os.path.exists(temp_agents_path):
+        temp_agents_path = gestionnaire.chemin_agents_courant()
+        if temp_agents_path:
             gestionnaire.charger_agents(temp_agents_path)
         else:
             info_path = os.path.join(settings.BASE_DIR, 'info.xlsx')
@@ -1113,6 +1156,8 @@ def api_modifier_agent(request):
                 }
             )
             
+            adresse_modifiee = created or agent.adresse != adresse or agent.latitude is None
+            
             if not created:
                 # Mettre à jour l'agent existant
                 agent.adresse = adresse
@@ -1137,6 +1182,9 @@ def api_modifier_agent(request):
                 
                 agent.save()
             
+            if adresse_modifiee:
+                planifier_geocodage([agent])
+            
             return JsonResponse({'success': True, 'message': 'Agent mis à jour avec succès'})
             
         except Exception as e:
@@ -1208,6 +1256,7 @@ def get_agents_non_affectes(request):
     jour = request.GET.get('jour', '')
     type_transport = request.GET.get('type_transport', '')
     heure = request.GET.get('heure', '')
+    heure_ete = request.GET.get('heure_ete', 'false') in ('on', 'true', '1')
     
     print(f"🔍 API Appelée - Jour: {jour}, Type: {type_transport}, Heure: {heure}")
     
@@ -1218,64 +1267,83 @@ def get_agents_non_affectes(request):
         # Convertir l'heure en entier
         heure_int = int(heure)
         
-        # CORRECTION : Pour les heures 0-3 (nuit), chercher aussi 24-27
-        heures_a_chercher = [heure_int]
-        if heure_int in [0, 1, 2, 3]:
-            heures_a_chercher.append(heure_int + 24)  # Chercher aussi 24h, 25h, etc.
+        gestionnaire = GestionnaireTransport()
+        planning_id = request.session.get('planning_id')
+        gestionnaire.dates_par_jour = request.session.get('gestionnaire_dates', {})
+        heures_config = [h for h, libelle in gestionnaire.get_heures_config(type_transport)]
         
-        print(f"🕒 Heures à chercher: {heures_a_chercher}")
+        # Shifts enregistrés en base pour le planning de la session : planifiés mais pas
+        # encore affectés = une seule anti-jointure SQL sur Affectation, sans relire le planning
+        date_reelle = gestionnaire.dates_par_jour.get(jour, '')
+        date_obj = datetime.strptime(date_reelle, "%d/%m/%Y").date() if date_reelle else None
+        source_upload = empreinte_version(CATEGORIE_PLANNINGS, planning_id) if planning_id else None
+        if date_obj and source_upload and PlanningShift.objects.filter(
+            date_reelle=date_obj, source_upload=source_upload
+        ).exists():
+            # Heure d'été : heures affichées = heures du planning - 1 (comme l'index des transports)
+            decalage = 1 if heure_ete else 0
+            champ_heure = PlanningShift.champ_heure(type_transport)
+            heures_planning = [h + decalage for h in heures_config]
+            if type_transport == 'depart':
+                heures_planning = [h % 24 for h in heures_planning]
+            tous_agents_disponibles = []
+            for shift in PlanningShift.non_affectes(date_obj, type_transport, heures_planning).filter(
+                source_upload=source_upload
+            ):
+                heure_shift = getattr(shift, champ_heure) - decalage
+                if type_transport == 'depart':
+                    heure_shift %= 24
+                if heure_shift == heure_int:
+                    tous_agents_disponibles.append({
+                        'nom': shift.agent.nom,
+                        'type': 'principal',
+                        'heure': heure_int,
+                        'info': f"{type_transport} {heure}h (programmé)"
+                    })
+                else:
+                    tous_agents_disponibles.append({
+                        'nom': shift.agent.nom,
+                        'type': 'secondaire',
+                        'heure': (shift.heure_debut if type_transport == 'ramassage' else shift.heure_fin) - decalage,
+                        'info': f"{type_transport} {heure_shift}h (autre horaire)"
+                    })
+            
+            tous_agents_disponibles.sort(key=lambda x: x['nom'])
+            print(f"✅ Total agents disponibles (shifts en base): {len(tous_agents_disponibles)}")
+            return JsonResponse(tous_agents_disponibles, safe=False)
         
-        # Recharger le planning
-        gestionnaire = GestionnaireTransport()
-        if not gestionnaire.recharger_planning_depuis_session():
+        # Pas de shifts en base pour ce planning : recharger le planning
+        if not gestionnaire.recharger_planning_depuis_session(planning_id):
             return JsonResponse([], safe=False)
         
         gestionnaire.dates_par_jour = request.session.get('gestionnaire_dates', {})
         
         # Charger les agents
-        temp_agents_path = os.path.join(settings.BASE_DIR, 'temp_agents.xlsx')
-        if os.path.exists(temp_agents_path):
+        temp_agents_path = gestionnaire.chemin_agents_courant()
+        if temp_agents_path:
             gestionnaire.charger_agents(temp_agents_path)
         else:
             info_path = os.path.join(settings.BASE_DIR, 'info.xlsx')
             if os.path.exists(info_path):
                 gestionnaire.charger_agents(info_path)
         
-        # Obtenir la date réelle
-        date_reelle = gestionnaire.dates_par_jour.get(jour, '')
-        if not date_reelle:
+        if not date_obj:
             return JsonResponse([], safe=False)
         
-        date_obj = datetime.strptime(date_reelle, "%d/%m/%Y").date()
-        
         # 1. AGENTS PRIMAIRES : Ceux programmés à cette heure exacte
-        class FiltreFormAPI:
-            def __init__(self, jour, type_transport):
-                self.cleaned_data = {
-                    'jour': jour,
-                    'type_transport': type_transport,
-                    'heure_ete': False,
-                    'filtre_agents': 'tous'
-                }
-        
-        form_api = FiltreFormAPI(jour, type_transport)
-        tous_agents_jour = gestionnaire.traiter_donnees(form_api)
+        # (l'index inversé gère les départs de nuit : 1h trouve aussi les fins à 25h)
+        tous_agents_jour = gestionnaire.rechercher_transports(jour, type_transport, heures_config, heure_ete)
         
         agents_principaux = []
-        for transport in tous_agents_jour:
-            # CORRECTION : Chercher dans toutes les heures (incluant 24h+)
-            if (transport['heure'] in heures_a_chercher or 
-                (transport['heure'] >= 24 and (transport['heure'] - 24) in heures_a_chercher)):
-                if transport['type_transport'] == type_transport:
-                    agents_principaux.append(transport['agent'])
+        if heure_int in heures_config:
+            agents_principaux = [t['agent'] for t in gestionnaire.rechercher_transports(jour, type_transport, heure_int, heure_ete)]
         
         print(f"🎯 Agents principaux ({heure}h): {agents_principaux}")
         
         # 2. AGENTS SECONDAIRES : Tous les agents du planning ce jour (autres heures)
         agents_secondaires = []
         for transport in tous_agents_jour:
-            if (transport['agent'] not in agents_principaux and 
-                transport['type_transport'] == type_transport):
+            if transport['agent'] not in agents_principaux:
                 agents_secondaires.append({
                     'nom': transport['agent'],
                     'heure_reelle': transport['heure'],
@@ -1389,177 +1457,151 @@ def api_carte_course(request, course_id):
             'corrige_manuellement': True
         }
         
-        affectations = Affectation.objects.filter(course=course).select_related('agent')
+        affectations = Affectation.objects.filter(course=course).select_related('agent', 'agent__geocodage_en_attente')
         print(f"📊 {affectations.count()} affectations trouvées")
         
         # Préparer les données pour la carte
+        # Les agents qui partagent une adresse (même clé normalisée) forment un seul arrêt :
+        # une seule position, un seul point à optimiser, pas de décalage entre eux
+        groupes = {}
+        for affectation in affectations:
+            agent = affectation.agent
+            cle_arret = agent.adresse_normalisee or f"agent:{agent.id}"
+            groupes.setdefault(cle_arret, []).append(affectation)
+        
         points = []
+        arrets = []
         positions_utilisees = set()
+        # Adresses sans coordonnées : géocodage borné par un budget commun à toute la requête
+        from gestion.geolocalisation.utils import GeolocalisationManager
+        geo_manager = GeolocalisationManager()
+        echeance = time.monotonic() + getattr(settings, 'GEOCODAGE_BUDGET_REQUETE', 2.0)
         
-        for affectation in affectations:
-            agent = affectation.agent
+        for cle_arret, affectations_arret in groupes.items():
+            agents_arret = [affectation.agent for affectation in affectations_arret]
+            agent = agents_arret[0]
             
-            print(f"👤 Agent: ID={agent.id}, Nom={agent.nom}")
-            print(f"📌 Adresse: {agent.adresse}")
+            print(f"📌 Adresse: {agent.adresse} ({len(agents_arret)} agent(s))")
             
             # ============ CORRECTION CRITIQUE ICI ============
             # Gestion des adresses incomplètes
             adresse_corrigee = agent.adresse
             latitude_finale = None
             longitude_finale = None
+            position_provisoire = False
             
-            # Dictionnaire de correspondance quartier -> coordonnées
-            correspondances_quartiers = {
-                'riadh': (35.8085, 10.5920, 'Hay Riadh, Sousse, Tunisie'),
-                'cite riadh': (35.8085, 10.5920, 'Hay Riadh, Sousse, Tunisie'),
-                'riadh 1': (35.8085, 10.5920, 'Riadh 1, Sousse, Tunisie'),
-                'riadh 2': (35.8110, 10.5880, 'Riadh 2, Sousse, Tunisie'),
-                'riadh 3': (35.8050, 10.5850, 'Riadh 3, Sousse, Tunisie'),
-                'ghodrane': (35.8120, 10.6120, 'Cite Ghodrane, Sousse, Tunisie'),
-                'cite ghodrane': (35.8120, 10.6120, 'Cite Ghodrane, Sousse, Tunisie'),
-                'cite jawhara': (35.8256, 10.6084, 'Cite Jawhara, Sousse, Tunisie'),
-                'sahloul': (35.8350, 10.5960, 'Sahloul, Sousse, Tunisie'),
-                'sahloul 1': (35.8350, 10.5960, 'Sahloul 1, Sousse, Tunisie'),
-                'sahloul 2': (35.8385, 10.5930, 'Sahloul 2, Sousse, Tunisie'),
-                'khezama': (35.8525, 10.6150, 'Khezama Est, Sousse, Tunisie'),
-                'khezama est': (35.8525, 10.6150, 'Khezama Est, Sousse, Tunisie'),
-                'taffala': (35.8170, 10.6130, 'Taffala, Sousse, Tunisie'),
-                'akouda': (35.8680, 10.5650, 'Akouda, Sousse, Tunisie'),
-                'Hammam Sousse': (35.8580, 10.5980, 'Hammam Sousse, Sousse, Tunisie'),
-                'Khezama Ouest': (35.8485, 10.6050, 'Khezama Ouest, Sousse, Tunisie'),
-                'Sidi Abdelhamid': (35.7950, 10.6350, 'Sidi Abdelhamid, Sousse, Tunisie'),
-                'medina': (35.8275, 10.6392, 'Medina Sousse, Tunisie'),
-                'boujaafar': (35.8340, 10.6400, 'Boujaafar, Sousse, Tunisie'),
-                'Kalaa Kebira': (35.8660, 10.5360, 'BKalaa Kebira, Sousse, Tunisie'),
-                'Kalaa Seghira': (35.8200, 10.5600, 'Kalaa Seghira, Sousse, Tunisie'),
-                'Msaken Centre': (35.7300, 10.5850, 'Msaken Centre, Sousse, Tunisie'),
-                'Msaken Ennour': (35.7350, 10.5750, 'Msaken Ennour, Sousse, Tunisie'),
-                'Chatt Meriem': (35.9180, 10.5900, 'Chatt Meriem, Sousse, Tunisie'),
-
-            }
-            
-            adresse_lower = agent.adresse.lower().strip()
-            
-            # Vérifier si l'adresse correspond à un quartier connu
-            quartier_trouve = None
-            for quartier, (lat_q, lon_q, adresse_q) in correspondances_quartiers.items():
-                if quartier in adresse_lower:
-                    quartier_trouve = (lat_q, lon_q, adresse_q)
-                    break
+            # Quartier connu : position du gazetteer, décalée de façon stable pour l'adresse
+            quartier_trouve = gazetteer().localiser(agent.adresse, graine=cle_arret, rayon=0.002)
+            agent_geocode = next((a for a in agents_arret if a.latitude and a.longitude), None)
             
             if quartier_trouve:
-                # Utiliser les coordonnées du quartier avec un petit décalage aléatoire
-                import random
-                lat_q, lon_q, adresse_q = quartier_trouve
-                latitude_finale = lat_q + random.uniform(-0.002, 0.002)
-                longitude_finale = lon_q + random.uniform(-0.002, 0.002)
-                adresse_corrigee = adresse_q
-                print(f"✅ Quartier identifié: {quartier} → {adresse_q}")
-            elif agent.latitude and agent.longitude:
+                latitude_finale = quartier_trouve['latitude']
+                longitude_finale = quartier_trouve['longitude']
+                adresse_corrigee = quartier_trouve['adresse']
+                print(f"✅ Quartier identifié: {quartier_trouve['quartier']} → {adresse_corrigee}")
+            elif agent_geocode:
                 # Utiliser les coordonnées existantes si elles sont valides
-                latitude_finale = agent.latitude
-                longitude_finale = agent.longitude
+                latitude_finale = agent_geocode.latitude
+                longitude_finale = agent_geocode.longitude
                 print(f"✅ Coordonnées DB: {latitude_finale}, {longitude_finale}")
             else:
-                # Géocoder l'adresse
-                try:
-                    from gestion.geolocalisation.utils import GeolocalisationManager
-                    geo_manager = GeolocalisationManager()
-                    result = geo_manager.geocode_adresse(agent.adresse)
-                    
-                    if result['success']:
-                        latitude_finale = result['latitude']
-                        longitude_finale = result['longitude']
-                        adresse_corrigee = result.get('adresse_formatee', agent.adresse)
-                        
-                        # Sauvegarder dans la base pour plus tard
-                        agent.latitude = latitude_finale
-                        agent.longitude = longitude_finale
-                        agent.adresse_geocodee = adresse_corrigee
-                        agent.derniere_geolocalisation = datetime.now()
-                        agent.save()
-                        print(f"✅ Géocodage réussi: {latitude_finale}, {longitude_finale}")
-                    else:
-                        # Fallback: centre de Sousse
-                        latitude_finale = 35.8256
-                        longitude_finale = 10.6415
-                        print(f"⚠️ Géocodage échoué, fallback centre Sousse")
-                        
-                except Exception as e:
-                    print(f"❌ Erreur géocodage: {e}")
-                    latitude_finale = 35.8256
-                    longitude_finale = 10.6415
+                # Les agents sont géocodés en arrière-plan ; en attendant, cache ou fournisseur
+                # dans le budget restant, sinon position approximative (provisoire)
+                a_planifier = [a for a in agents_arret if not hasattr(a, 'geocodage_en_attente')]
+                if a_planifier:
+                    planifier_geocodage(a_planifier)
+                result_geo = geo_manager.geocode_adresse(agent.adresse, budget=max(echeance - time.monotonic(), 0))
+                latitude_finale = result_geo['latitude']
+                longitude_finale = result_geo['longitude']
+                position_provisoire = not result_geo['success']
+                print(f"⏳ Adresse sans coordonnées ({result_geo['source']}), géocodage planifié: {agent.adresse}")
             
             # Assurer qu'on a des coordonnées
             if not latitude_finale or not longitude_finale:
                 latitude_finale = 35.8256
                 longitude_finale = 10.6415
             
-            point = {
-                'nom': agent.nom,
-                'adresse': adresse_corrigee,
-                'latitude': latitude_finale,
-                'longitude': longitude_finale,
-                'societe': agent.get_societe_display(),
-                'telephone': agent.telephone,
-                'type_transport': affectation.type_transport,
-                'heure': affectation.heure,
-                'ordre': len(points) + 1,
-                'agent_id': agent.id,
-                'corrige_manuellement': agent.corrige_manuellement,
-                'date_correction': agent.date_correction_coords.strftime("%d/%m/%Y %H:%M") if agent.date_correction_coords else None
-            }
-            
-            # Ajouter un décalage pour éviter la superposition exacte
-            position_key = f"{point['latitude']:.4f},{point['longitude']:.4f}"
+            # Ajouter un décalage pour éviter la superposition exacte de deux adresses différentes
+            decalage_auto = False
+            position_key = f"{latitude_finale:.4f},{longitude_finale:.4f}"
             if position_key in positions_utilisees:
-                import random
-                point['latitude'] += random.uniform(-0.0005, 0.0005)
-                point['longitude'] += random.uniform(-0.0005, 0.0005)
-                point['decalage_auto'] = True
-                print(f"⚠️ Décalage appliqué pour éviter superposition: {agent.nom}")
-            
-            positions_utilisees.add(f"{point['latitude']:.4f},{point['longitude']:.4f}")
-            points.append(point)
-            print(f"✅ Point ajouté: {agent.nom} - lat: {point['latitude']:.6f}, lon: {point['longitude']:.6f}")
+                dlat, dlon = jitter_deterministe(cle_arret, 0.0005)
+                latitude_finale += dlat
+                longitude_finale += dlon
+                decalage_auto = True
+                print(f"⚠️ Décalage appliqué pour éviter superposition: {agent.adresse}")
+            positions_utilisees.add(f"{latitude_finale:.4f},{longitude_finale:.4f}")
+            
+            points_arret = []
+            for affectation in affectations_arret:
+                agent_point = affectation.agent
+                point = {
+                    'nom': agent_point.nom,
+                    'adresse': adresse_corrigee,
+                    'latitude': latitude_finale,
+                    'longitude': longitude_finale,
+                    'societe': agent_point.get_societe_display(),
+                    'telephone': agent_point.telephone,
+                    'type_transport': affectation.type_transport,
+                    'heure': affectation.heure,
+                    'ordre': len(points) + 1,
+                    'agent_id': agent_point.id,
+                    'arret': cle_arret,
+                    'corrige_manuellement': agent_point.corrige_manuellement,
+                    'date_correction': agent_point.date_correction_coords.strftime("%d/%m/%Y %H:%M") if agent_point.date_correction_coords else None
+                }
+                if decalage_auto:
+                    point['decalage_auto'] = True
+                if position_provisoire:
+                    point['position_provisoire'] = True
+                points.append(point)
+                points_arret.append(point)
+                print(f"✅ Point ajouté: {agent_point.nom} - lat: {latitude_finale:.6f}, lon: {longitude_finale:.6f}")
+            
+            # Point de l'arrêt pour l'optimisation et la carte
+            arrets.append(dict(
+                points_arret[0],
+                nom=' / '.join(p['nom'] for p in points_arret),
+                telephone=' / '.join(p['telephone'] for p in points_arret if p['telephone']),
+                agents=[{'agent_id': p['agent_id'], 'nom': p['nom'], 'telephone': p['telephone']} for p in points_arret],
+                nombre_agents=len(points_arret)
+            ))
         
         # Reste du code reste inchangé...
         if points:
             print("🔧 Tentative d'optimisation...")
             try:
-                from gestion.geolocalisation.utils import GeolocalisationManager
-                geo_manager = GeolocalisationManager()
-                
-                # Créer l'itinéraire optimisé
+                # Créer l'itinéraire optimisé, au départ du point fixe (inclus dans l'optimisation)
                 print("📐 Optimisation de l'itineraire...")
-                itineraire_optimise = geo_manager.optimiser_itineraire(points)
-                
-                # Ajouter le point de départ fixe à l'itinéraire
-                print("📍 Ajout du point de départ fixe à l'itineraire...")
-                itineraire_optimise['itineraire'].insert(0, point_depart_fixe)
+                itineraire_optimise = geo_manager.optimiser_itineraire(arrets, depart=point_depart_fixe)
                 
-                # Mettre à jour les ordres de visite
+                # Mettre à jour les ordres de visite (un arrêt par adresse, reporté sur ses agents)
+                ordre_arrets = {}
                 for i, point in enumerate(itineraire_optimise['itineraire']):
                     point['ordre_visite'] = i + 1
+                    if point.get('arret'):
+                        ordre_arrets[point['arret']] = i + 1
+                for point in points:
+                    point['ordre_visite'] = ordre_arrets.get(point['arret'])
+                
+                # Horaires : ramassage à rebours de l'heure du poste, départ vers les domiciles
+                horaires = planifier_horaires(itineraire_optimise['itineraire'], course.type_transport,
+                                              course.date_reelle, course.heure)
+                passages = horaires_par_agent(horaires)
+                cle_heure = 'heure_prise_en_charge' if course.type_transport == 'ramassage' else 'heure_depose'
+                for point in points:
+                    passage = passages.get(point['agent_id'])
+                    if passage:
+                        point[cle_heure] = passage['heure']
+                        point['ordre_passage'] = passage['ordre_passage']
+                        point['temps_a_bord_minutes'] = passage['temps_a_bord_minutes']
+                if not horaires['realisable']:
+                    print(f"⚠️ Horaires non réalisables: {'; '.join(horaires['alertes'])}")
                 
                 # Ajuster le nombre total de points
                 itineraire_optimise['nombre_points'] = len(itineraire_optimise['itineraire'])
                 itineraire_optimise['point_depart_fixe'] = point_depart_fixe['nom']
                 
-                # Recalculer la distance avec le point de départ
-                if len(itineraire_optimise['itineraire']) > 1:
-                    from geopy.distance import geodesic
-                    depart = (point_depart_fixe['latitude'], point_depart_fixe['longitude'])
-                    premier_agent = (
-                        itineraire_optimise['itineraire'][1]['latitude'], 
-                        itineraire_optimise['itineraire'][1]['longitude']
-                    )
-                    distance_depart = geodesic(depart, premier_agent).kilometers
-                    
-                    itineraire_optimise['distance_totale'] = round(
-                        itineraire_optimise.get('distance_totale', 0) + distance_depart, 2
-                    )
-                
                 print(f"✅ Itinéraire optimisé: {len(itineraire_optimise.get('itineraire', []))} points")
                 print(f"📏 Distance totale: {itineraire_optimise['distance_totale']} km")
                 
@@ -1589,11 +1631,17 @@ def api_carte_course(request, course_id):
                     'itineraire': itineraire_optimise,
                     'carte_url': carte_resultat['url'] if carte_resultat else None,
                     'distance_totale': itineraire_optimise.get('distance_totale', 0),
-                    'temps_estime': round(itineraire_optimise.get('distance_totale', 0) / 40 * 60, 1),
+                    'distance_avant_amelioration': itineraire_optimise.get('distance_initiale', 0),
+                    'economie_km': itineraire_optimise.get('economie_estimee', 0),
+                    # Même durée que les horaires (trajets routiers en mode 'routier', arrêts compris)
+                    'temps_estime': horaires['duree_minutes'],
+                    'heure_depart_chauffeur': horaires['heure_depart_chauffeur'],
+                    'horaires': horaires,
                     'point_depart': point_depart_fixe,
                     'debug_info': {
                         'affectations_count': affectations.count(),
                         'points_count': len(points),
+                        'arrets_count': len(arrets),
                         'itineraire_count': len(itineraire_optimise.get('itineraire', [])),
                         'agents_missing_coords': len([p for p in points if p.get('geocode_auto', False)])
                     }
@@ -1958,12 +2006,12 @@ def detail_societe_paie(request, societe_nom):
     planning_charge = False
     
     if request.session.get('planning_charge'):
-        if gestionnaire.recharger_planning_depuis_session():
+        if gestionnaire.recharger_planning_depuis_session(request.session.get('planning_id')):
             planning_charge = True
             gestionnaire.dates_par_jour = request.session.get('gestionnaire_dates', {})
             
-            temp_agents_path = os.path.join(settings.BASE_DIR, 'temp_agents.xlsx')
-            if os.path.exists(temp_agents_path):
+            temp_agents_path = gestionnaire.chemin_agents_courant()
+            if temp_agents_path:
                 gestionnaire.charger_agents(temp_agents_path)
             else:
                 info_path = os.path.join(settings.BASE_DIR, 'info.xlsx')
@@ -2112,6 +2160,7 @@ def gestion_agents(request):
                 agent.societe_texte = None
             
             agent.save()
+            planifier_geocodage([agent])
             messages.success(request, 'Agent ajouté avec succès')
             return redirect('agents')
         else:
@@ -2164,6 +2213,8 @@ def modifier_agent(request, id):
                 agent.societe_texte = None
             
             agent.save()
+            if 'adresse' in form.changed_data or agent.latitude is None:
+                planifier_geocodage([agent])
             messages.success(request, f'Agent {agent.nom} modifié avec succès')
             return redirect('agents')
         else:
@@ -2210,6 +2261,7 @@ def importer_agents(request):
                 agents_crees = 0
                 agents_modifies = 0
                 erreurs = []
+                a_geocoder = []
                 
                 for index, row in df.iterrows():
                     nom = row.get('voyant', '')
@@ -2228,18 +2280,25 @@ def importer_agents(request):
                             
                             if created:
                                 agents_crees += 1
+                                a_geocoder.append(agent)
                             else:
                                 # Mettre à jour l'agent existant
+                                ancienne_adresse = agent.adresse
                                 agent.adresse = row.get('adresse', agent.adresse)
                                 agent.telephone = str(row.get('Mobile', agent.telephone))
                                 agent.societe_texte = row.get('societe', agent.societe_texte)
                                 agent.voiture_personnelle = row.get('voiture', '').lower() in ['oui', 'yes', 'true', '1']
                                 agent.save()
                                 agents_modifies += 1
+                                if agent.adresse != ancienne_adresse or agent.latitude is None:
+                                    a_geocoder.append(agent)
                                 
                         except Exception as e:
                             erreurs.append(f"Ligne {index + 2}: {str(e)}")
                 
+                # Géocodage en arrière-plan des agents nouveaux ou dont l'adresse a changé
+                planifier_geocodage(a_geocoder)
+                
                 if erreurs:
                     messages.warning(request, f"{agents_crees} créés, {agents_modifies} modifiés, mais {len(erreurs)} erreurs")
                     for erreur in erreurs[:5]:  # Afficher seulement les 5 premières erreurs
@@ -2328,40 +2387,25 @@ def get_agents_du_planning(request):
     try:
         # Utiliser le MÊME gestionnaire que dans liste_transports
         gestionnaire = GestionnaireTransport()
-        if not gestionnaire.recharger_planning_depuis_session():
+        if not gestionnaire.recharger_planning_depuis_session(request.session.get('planning_id')):
             return JsonResponse({'agents': []})
         
         gestionnaire.dates_par_jour = request.session.get('gestionnaire_dates', {})
         
         # Charger les agents
-        temp_agents_path = os.path.join(settings.BASE_DIR, 'temp_agents.xlsx')
-        if os.path.exists(temp_agents_path):
+        temp_agents_path = gestionnaire.chemin_agents_courant()
+        if temp_agents_path:
             gestionnaire.charger_agents(temp_agents_path)
         else:
             info_path = os.path.join(settings.BASE_DIR, 'info.xlsx')
             if os.path.exists(info_path):
                 gestionnaire.charger_agents(info_path)
         
-        # Créer un faux formulaire de filtre
-        class FiltreFormPlanning:
-            def __init__(self, jour, type_transport, heure):
-                self.cleaned_data = {
-                    'jour': jour,
-                    'type_transport': type_transport,
-                    'heure_ete': False,
-                    'filtre_agents': 'tous'
-                }
-        
-        form_filtre = FiltreFormPlanning(jour, type_transport, heure)
-        
-        # Obtenir la liste des transports
-        liste_transports = gestionnaire.traiter_donnees(form_filtre)
-        
-        # Filtrer pour l'heure spécifique
-        agents_heure_specifique = []
-        for transport in liste_transports:
-            if transport['heure'] == int(heure):
-                agents_heure_specifique.append(transport['agent'])
+        # Lecture directe de l'index (jour, type, heure) du planning
+        agents_heure_specifique = [
+            transport['agent']
+            for transport in gestionnaire.rechercher_transports(jour, type_transport, int(heure))
+        ]
         
         # Retourner les noms d'agents uniques
         agents_uniques = list(set(agents_heure_specifique))
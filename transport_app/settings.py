@@ -168,9 +168,79 @@ CACHES = {
 }
 
 CACHE_GEOCODING = True
-CACHE_TIMEOUT_GEOCODING = 86400  # 24h
+CACHE_TIMEOUT_GEOCODING = 86400  # 24h (sources sans durée spécifique)
+
+# Cache géocodage persistant (table GeocodeCache) : durées par source dans
+# gestion/geolocalisation/cache.py (TTL_PAR_SOURCE), à surcharger ici si besoin,
+# par exemple GEOCODE_CACHE_TTL = {'fallback_centre': 1800} (secondes)
+GEOCODE_CACHE_TTL = {}
+GEOCODE_CACHE_LRU_TAILLE = 2048  # entrées gardées en mémoire par processus
+GEOCODE_CACHE_NEGATIF_TTL = 3600  # "aucun résultat" d'un fournisseur, retenté après 1h
+
+# Disjoncteur par fournisseur : ignoré après N échecs consécutifs, requête d'essai après le délai
+GEOCODAGE_DISJONCTEUR = {
+    'seuil_echecs': 3,
+    'delai_ouverture': 30,
+    'delai_max': 600,
+}
+
+# Appels externes : débit maximal par fournisseur (requêtes/seconde), partagé entre tous
+# les workers via des fichiers verrouillés dans GEOCODAGE_DOSSIER_LIMITES
+GEOCODAGE_DEBITS = {
+    'nominatim': 1.0,
+    'positionstack': 2.0,
+    'osrm': 1.0,
+}
+GEOCODAGE_DOSSIER_LIMITES = os.path.join(BASE_DIR, 'rate_limits')
+# Géocodage en lot : nombre de threads
+GEOCODAGE_BATCH_WORKERS = 4
+# Budget de temps du géocodage dans les vues (carte d'une course, optimisation) : au-delà,
+# position approximative marquée provisoire, affinée en arrière-plan
+GEOCODAGE_BUDGET_REQUETE = 2.0  # secondes pour toute la requête
+GEOCODAGE_BUDGET_MIN_APPEL = 0.5  # temps restant minimum pour interroger un fournisseur
+
+# Index spatial des agents (API agents proches) : grille en mémoire, sinon préfixes geohash en base
+INDEX_AGENTS_MEMOIRE = True
+INDEX_AGENTS_TAILLE_CELLULE = 0.01  # degrés
+
+# Optimisation d'itinéraire : calcul des distances ('haversine', 'equirectangulaire', 'precis'
+# ou 'routier' : distances et durées OSRM /table, gardées en cache par paire de geohash)
+ITINERAIRE_MODE_DISTANCE = 'haversine'
+ROUTAGE_PRECISION_GEOHASH = 8  # cellule d'environ 38 m : deux positions plus proches partagent leurs trajets
+ROUTAGE_TAILLE_TABLE = 100  # coordonnées par requête /table (max-table-size du serveur OSRM)
+ROUTAGE_BUDGET = 3.0  # secondes de requêtes /table par matrice, au-delà estimation à vol d'oiseau
+# Amélioration de l'ordre de visite (2-opt, Or-opt) : budget de temps et de mouvements
+ITINERAIRE_AMELIORATION = {
+    'budget_s': 0.5,
+    'max_iterations': 5000,
+}
+
+# Répartition automatique d'un créneau entre les chauffeurs : essais de balayage,
+# pool de processus (0 : aucun ; plafonné au nombre de CPU) et budget de recherche locale par tournée
+REPARTITION = {
+    'essais': 12,
+    'processus': 0,
+    'budget_route_s': 0.05,
+}
+
+# Horaires de passage : temps d'arrêt par adresse, marges autour du poste (minutes)
+# et temps à bord maximum d'un agent au-delà duquel la course est signalée ; un départ
+# sans shift connu avant heure_max_fin_nuit est la fin d'un poste de nuit (lendemain)
+HORAIRES_COURSE = {
+    'arret_minutes': 2,
+    'marge_arrivee_minutes': 5,
+    'marge_depart_minutes': 5,
+    'trajet_max_minutes': 60,
+    'heure_max_fin_nuit': 7,
+}
+
+# Accès aux fournisseurs externes : 'http' (réel) ou 'rejeu' (réponses enregistrées, sans réseau)
+GEOCODAGE_FOURNISSEUR = 'http'
+GEOCODAGE_REJEU_FICHIER = os.path.join(BASE_DIR, 'gestion', 'geolocalisation', 'data', 'rejeu_exemple.json')
+# Si défini (mode http), chaque réponse est ajoutée à ce fichier JSON lines, rejouable ensuite
+GEOCODAGE_ENREGISTREMENT_FICHIER = None
 
-# Configuration OSRM pour le routage
+# Configuration OSRM pour le routage (un serveur OSRM local peut remplacer le service public)
 OSRM_BASE_URL = 'http://router.project-osrm.org'
 
 # Configuration de l'application géolocalisation